@@ -0,0 +1,394 @@
+"""
+
+    Offline evaluation of recommendation accuracy and latency.
+
+    Author: Explore Data Science Academy.
+
+    Description: Splits the ratings file by time: the oldest ratings
+    (by default 80%) form the training data and the newest the test data.
+    The recommenders are evaluated as if they had been built just before
+    the split. Every evaluated user's favourite list is their highest
+    rated training movies. The movies they rate highly after the split are
+    the held-out movies the recommendations should find.
+
+    The training ratings are written to a work directory with their own
+    binary cache and models directory, and the factor model is retrained
+    on them, so that no model sees the test data. Every model then scores
+    the favourite lists in a spawned process pool that points at the
+    training data. The report gives precision@k, recall@k, NDCG@k,
+    catalogue coverage and per-query latency side by side:
+
+        python -m benchmarks.evaluate [--k 10] [--test-fraction 0.2] [--users 500]
+            [--model content] [--workers 4] [--baseline benchmarks/results/evaluation.json]
+
+    Given a baseline report of the same split, any model whose accuracy
+    dropped or whose latency grew beyond the tolerances is listed and the
+    run exits with status 1.
+
+    Note: the recommenders read their data locations when first imported,
+    so this module only imports them inside the worker processes.
+
+"""
+# Script dependencies
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from benchmarks.run import MIN_DELTA_MS, TOLERANCE, WORK_DIR, git_commit, run_python
+
+# Default report location
+OUTPUT_PATH = 'benchmarks/results/evaluation.json'
+# Models evaluated by default (keys of `recommenders.batch.BATCH_MODELS`)
+MODELS = ('content', 'neighbourhood', 'svd')
+# Share of the newest ratings held out for testing
+TEST_FRACTION = 0.2
+# Favourite movies per evaluated user, taken from their training ratings
+N_FAVOURITES = 3
+# Held-out ratings at or above this count as relevant
+RELEVANT_RATING = 4.0
+# Users sampled for evaluation
+N_USERS = 500
+# Favourite lists scored per task
+CHUNK_SIZE = 50
+# Relative accuracy drop tolerated before a metric counts as a regression
+ACCURACY_TOLERANCE = 0.05
+# Accuracy metrics compared against the baseline
+ACCURACY_METRICS = ('precision', 'recall', 'ndcg', 'coverage')
+# Latency metrics compared against the baseline
+LATENCY_METRICS = ('p50_ms', 'p95_ms')
+
+
+def time_split(ratings, test_fraction=TEST_FRACTION):
+    """Split ratings at the timestamp leaving `test_fraction` of them after it.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        Ratings with a `timestamp` column.
+    test_fraction : float
+        Share of the newest ratings to hold out.
+
+    Returns
+    -------
+    tuple
+        (train Dataframe, test Dataframe, cutoff timestamp); test ratings
+        are those made at or after the cutoff.
+
+    """
+    cutoff = int(np.quantile(ratings['timestamp'].to_numpy(), 1 - test_fraction))
+    after = ratings['timestamp'].to_numpy() >= cutoff
+    return ratings[~after], ratings[after], cutoff
+
+
+def held_out_sets(train, test, movie_ids, n_favourites=N_FAVOURITES,
+                  relevant_rating=RELEVANT_RATING, n_users=N_USERS, seed=0):
+    """Favourite lists and relevant held-out movies of the evaluated users.
+
+    Users qualify with at least `n_favourites` training ratings and at
+    least one relevant test rating, both of catalogue movies.
+
+    Parameters
+    ----------
+    train, test : Pandas Dataframe
+        Ratings before and after the split.
+    movie_ids : set (int)
+        movieIds of the catalogue.
+    n_users : int
+        Qualifying users sampled; all of them if there are fewer.
+
+    Returns
+    -------
+    list (tuple)
+        (userId, favourite movieIds, relevant movieIds) per user.
+
+    """
+    train = train[train['movieId'].isin(movie_ids)]
+    test = test[test['movieId'].isin(movie_ids) & (test['rating'] >= relevant_rating)]
+    # highest rated first; equal ratings in file order
+    favourites = (train.sort_values(['userId', 'rating'], ascending=[True, False], kind='stable')
+                  .groupby('userId')['movieId'].apply(lambda movies: movies.tolist()[:n_favourites]))
+    favourites = favourites[favourites.str.len() == n_favourites]
+    relevant = test.groupby('userId')['movieId'].apply(set)
+    # a movie rated again after the split is no held-out discovery
+    held_out = [(user, favourites[user], relevant[user] - set(favourites[user]))
+                for user in sorted(set(favourites.index) & set(relevant.index))]
+    held_out = [entry for entry in held_out if entry[2]]
+    if len(held_out) > n_users:
+        chosen = np.random.default_rng(seed).choice(len(held_out), n_users, replace=False)
+        held_out = [held_out[position] for position in sorted(chosen)]
+    return held_out
+
+
+def prepare_split(ratings_path, test_fraction=TEST_FRACTION, work_dir=WORK_DIR):
+    """Write (once) the training ratings and retrain the factors on them.
+
+    Returns
+    -------
+    tuple
+        (train Dataframe, test Dataframe, cutoff timestamp, environment
+        overrides pointing the recommenders at the training data).
+
+    """
+    from utils.data_loader import MODELS_DIR, file_checksum
+
+    ratings = pd.read_csv(ratings_path)
+    train, test, cutoff = time_split(ratings, test_fraction)
+    root = os.path.join(work_dir, f'evaluation-{file_checksum(ratings_path)[:12]}-t{test_fraction:g}')
+    models_dir = os.path.join(root, 'models')
+    env = {'EDSA_RATINGS_PATH': os.path.join(root, 'ratings.csv'),
+           'EDSA_CACHE_DIR': os.path.join(root, 'cache'),
+           'EDSA_MODELS_DIR': models_dir}
+    if not os.path.exists(env['EDSA_RATINGS_PATH']):
+        os.makedirs(root, exist_ok=True)
+        train.to_csv(env['EDSA_RATINGS_PATH'], index=False)
+    os.makedirs(models_dir, exist_ok=True)
+    # the content index does not depend on the ratings; reuse the app's own
+    content_index = os.path.join(MODELS_DIR, 'content_index.npz')
+    target = os.path.join(models_dir, 'content_index.npz')
+    if not os.path.exists(target):
+        if os.path.exists(content_index):
+            shutil.copyfile(content_index, target)
+        else:
+            print("Building the content index ...", file=sys.stderr)
+            run_python('recommenders.content_index', [], env)
+    if not os.path.exists(os.path.join(models_dir, 'svd_factors.npz')):
+        print("Training factors on the training ratings ...", file=sys.stderr)
+        run_python('recommenders.als', ['train'], env)
+    return train, test, cutoff, env
+
+
+def _init_worker(env):
+    """Point a fresh worker process at the training data."""
+    os.environ.update(env)
+
+
+def _warm_up(models, id_list, top_n):
+    """Build the caches and model state of the training data in one worker.
+
+    Runs before any other task, so that concurrent workers only ever read
+    the binary caches and saved stores instead of racing to build them.
+
+    """
+    for model in models:
+        _score_chunk(model, [id_list], top_n)
+
+
+def _score_chunk(model, id_lists, top_n):
+    """Recommend for favourite movieId lists, timing every query on its own.
+
+    Runs in a worker process.
+
+    Returns
+    -------
+    tuple
+        (recommended movieId lists, per-query seconds).
+
+    """
+    from recommenders.batch import BATCH_MODELS
+    from utils.catalog import load_catalog
+
+    catalog = load_catalog()
+    recommend = BATCH_MODELS[model]
+    movie_lists = [catalog.titles_for(movie_ids) for movie_ids in id_lists]
+    # the first query loads the model's state; keep it out of the timings
+    recommend(movie_lists[:1], top_n)
+    recommended, seconds = [], []
+    for movie_list in movie_lists:
+        start = time.perf_counter()
+        titles = recommend([movie_list], top_n)[0]
+        seconds.append(time.perf_counter() - start)
+        recommended.append([catalog.movie_id(title) for title in titles])
+    return recommended, seconds
+
+
+def ranking_metrics(recommended, relevant, k):
+    """Precision@k, recall@k and binary NDCG@k of one recommendation list."""
+    hits = np.array([movie_id in relevant for movie_id in recommended[:k]], dtype=np.float64)
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(len(relevant), k)].sum()
+    return {'precision': hits.sum() / k,
+            'recall': hits.sum() / len(relevant),
+            'ndcg': float(hits @ discounts[:len(hits)] / ideal)}
+
+
+def summarise(recommended, seconds, held_out, k, n_movies):
+    """Aggregate the accuracy and latency of one model.
+
+    Returns
+    -------
+    dict
+        Mean precision, recall and NDCG at k, catalogue coverage (share
+        of movies recommended at least once) and latency percentiles.
+
+    """
+    metrics = [ranking_metrics(movie_ids, relevant, k)
+               for movie_ids, (_, _, relevant) in zip(recommended, held_out)]
+    report = {name: float(np.mean([values[name] for values in metrics]))
+              for name in ('precision', 'recall', 'ndcg')}
+    report['coverage'] = len({movie_id for movie_ids in recommended for movie_id in movie_ids}) / n_movies
+    milliseconds = np.asarray(seconds) * 1000
+    report.update(p50_ms=float(np.percentile(milliseconds, 50)),
+                  p95_ms=float(np.percentile(milliseconds, 95)),
+                  mean_ms=float(milliseconds.mean()), queries=len(milliseconds))
+    return report
+
+
+def evaluate(models=MODELS, k=10, test_fraction=TEST_FRACTION, n_users=N_USERS,
+             workers=None, work_dir=WORK_DIR, seed=0):
+    """Evaluate every model on a time-based split of the configured ratings.
+
+    Parameters
+    ----------
+    models : list (str)
+        Keys of `recommenders.batch.BATCH_MODELS`.
+    k : int
+        Recommendations per query.
+    test_fraction : float
+        Share of the newest ratings held out.
+    n_users : int
+        Users evaluated.
+    workers : int, optional
+        Worker processes; one per CPU by default.
+
+    Returns
+    -------
+    dict
+        Report with the split description and one entry per model.
+
+    Raises
+    ------
+    ValueError
+        If no user qualifies for evaluation.
+
+    """
+    from utils.data_loader import MOVIES_PATH, RATINGS_PATH
+
+    movie_ids = set(pd.read_csv(MOVIES_PATH, usecols=['movieId'])['movieId'].tolist())
+    train, test, cutoff, env = prepare_split(RATINGS_PATH, test_fraction, work_dir)
+    held_out = held_out_sets(train, test, movie_ids, n_users=n_users, seed=seed)
+    if not held_out:
+        raise ValueError(f"No user qualifies for evaluation: none has {N_FAVOURITES} training "
+                         f"ratings and a test rating of at least {RELEVANT_RATING} "
+                         f"(test fraction {test_fraction})")
+    id_lists = [favourites for _, favourites, _ in held_out]
+    chunks = [id_lists[start:start + CHUNK_SIZE] for start in range(0, len(id_lists), CHUNK_SIZE)]
+    # spawned workers import the recommenders afresh, with `env` applied
+    with ProcessPoolExecutor(workers or os.cpu_count(), multiprocessing.get_context('spawn'),
+                             _init_worker, (env,)) as pool:
+        pool.submit(_warm_up, models, id_lists[0], k).result()
+        futures = {model: [pool.submit(_score_chunk, model, chunk, k) for chunk in chunks]
+                   for model in models}
+        results = {}
+        for model, model_futures in futures.items():
+            recommended, seconds = [], []
+            for future in model_futures:
+                chunk_recommended, chunk_seconds = future.result()
+                recommended += chunk_recommended
+                seconds += chunk_seconds
+            results[model] = summarise(recommended, seconds, held_out, k, len(movie_ids))
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'git_commit': git_commit(), 'k': k,
+            'split': {'ratings': RATINGS_PATH, 'test_fraction': test_fraction,
+                      'cutoff': datetime.datetime.fromtimestamp(cutoff, datetime.timezone.utc)
+                      .isoformat(), 'train_ratings': len(train), 'test_ratings': len(test),
+                      'users': len(held_out), 'seed': seed},
+            'models': results}
+
+
+def find_regressions(current, baseline, tolerance=TOLERANCE,
+                     accuracy_tolerance=ACCURACY_TOLERANCE, min_delta_ms=MIN_DELTA_MS):
+    """Compare two evaluation reports of the same split.
+
+    Returns
+    -------
+    list (str)
+        One description per regressed metric; empty if none regressed.
+
+    """
+    if current['split'] != baseline['split'] or current['k'] != baseline['k']:
+        return ['baseline was evaluated on a different split or k']
+    regressions = []
+    for model, metrics in current['models'].items():
+        before = baseline['models'].get(model)
+        if before is None:
+            continue
+        for metric in ACCURACY_METRICS:
+            new, old = metrics[metric], before[metric]
+            if new < old * (1 - accuracy_tolerance):
+                regressions.append(f"{model} {metric}: {old:.4f} -> {new:.4f}")
+        for metric in LATENCY_METRICS:
+            new, old = metrics[metric], before[metric]
+            if new > old * (1 + tolerance) and new - old > min_delta_ms:
+                regressions.append(f"{model} {metric}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def format_report(report):
+    """Render the metrics of every model as an aligned text table."""
+    k, split = report['k'], report['split']
+    lines = [f"{split['users']} users; trained on {split['train_ratings']:,} ratings before "
+             f"{split['cutoff']}, tested on {split['test_ratings']:,}",
+             f"  {'model':<15} {f'P@{k}':>8} {f'R@{k}':>8} {f'NDCG@{k}':>8} {'coverage':>9} "
+             f"{'p50 ms':>9} {'p95 ms':>9}"]
+    for model, metrics in report['models'].items():
+        lines.append(f"  {model:<15} {metrics['precision']:8.4f} {metrics['recall']:8.4f} "
+                     f"{metrics['ndcg']:8.4f} {metrics['coverage']:9.4f} "
+                     f"{metrics['p50_ms']:9.2f} {metrics['p95_ms']:9.2f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate recommendation accuracy and latency.')
+    parser.add_argument('--model', action='append', choices=MODELS,
+                        help='model to evaluate (repeatable; all by default)')
+    parser.add_argument('--k', type=int, default=10, help='recommendations per query')
+    parser.add_argument('--test-fraction', type=float, default=TEST_FRACTION)
+    parser.add_argument('--users', type=int, default=N_USERS, help='users evaluated')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the user sample')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--work-dir', default=WORK_DIR)
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    parser.add_argument('--baseline', help='report to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='relative latency growth tolerated')
+    parser.add_argument('--accuracy-tolerance', type=float, default=ACCURACY_TOLERANCE,
+                        help='relative accuracy drop tolerated')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        # read first, as the baseline may be the default output file
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    try:
+        report = evaluate(args.model or MODELS, args.k, args.test_fraction, args.users,
+                          args.workers, args.work_dir, args.seed)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 2
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(format_report(report))
+    print(f"Results written to: {args.output}")
+
+    if baseline is not None:
+        regressions = find_regressions(report, baseline, args.tolerance, args.accuracy_tolerance)
+        if regressions:
+            print('Regressions against the baseline:')
+            print('\n'.join(f"  {regression}" for regression in regressions))
+            return 1
+        print('No regressions against the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+
+    Timings of the recommender hot paths on one dataset.
+
+    Author: Explore Data Science Academy.
+
+    Description: Measures module import, data loading, first-use state
+    initialisation and the per-query cost of `content_model`,
+    `collab_model` (for every collaborative algorithm with a model
+    available), `highest_rated_users` and `indices_to_titles`. Result
+    caching is bypassed so that every call does the full work.
+
+    The dataset and artifact locations come from the EDSA_* environment
+    variables, so `benchmarks.run` starts one fresh interpreter per
+    dataset:
+
+        python -m benchmarks.hot_paths [n_queries] [repeats]
+
+    prints the report as JSON.
+
+"""
+# Script dependencies
+import json
+import resource
+import sys
+import time
+import numpy as np
+
+from utils.startup import profile_imports
+
+# Modules whose import cost is measured
+IMPORTED_MODULES = ['utils.data_loader', 'recommenders.content_based',
+                    'recommenders.collaborative_based']
+# Movie ids converted per `indices_to_titles` call
+TITLES_PER_CALL = 100
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def summarise(latencies):
+    """Latency percentiles (ms) and throughput (calls/sec) of timed calls."""
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = latencies.sum()
+    return {'n': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p95_ms': float(np.percentile(latencies, 95) * 1000),
+            'mean_ms': float(latencies.mean() * 1000),
+            'throughput_per_s': float(len(latencies) / total) if total > 0 else float('inf')}
+
+
+def time_calls(function, calls, setup=None):
+    """Call `function(*args)` for every args tuple and summarise latencies.
+
+    `setup`, if given, is called untimed before every call.
+    """
+    latencies = []
+    for args in calls:
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - start)
+    return summarise(latencies)
+
+
+def sample_queries(catalog, n_queries, seed=0):
+    """Random favourite-title triples and movie-id lists of rated movies."""
+    rng = np.random.default_rng(seed)
+    rated = np.flatnonzero(np.diff(catalog.rating_offsets) > 0)
+    rated = np.array([movie_id for movie_id in rated.tolist() if catalog.title(movie_id) is not None])
+    favourites = [catalog.titles_for(rng.choice(rated, size=3, replace=False).tolist())
+                  for _ in range(n_queries)]
+    id_lists = [rng.choice(rated, size=min(TITLES_PER_CALL, len(rated)), replace=False).tolist()
+                for _ in range(n_queries)]
+    return favourites, id_lists
+
+
+def measure(n_queries=50, repeats=5, import_repeats=3, seed=0):
+    """Benchmark the hot paths on the dataset configured by the environment.
+
+    Parameters
+    ----------
+    n_queries : int
+        Favourite sets timed per recommender function.
+    repeats : int
+        Timed reloads of the data from the binary cache.
+    import_repeats : int
+        Fresh-interpreter imports timed per module.
+    seed : int
+        Seed of the query sample.
+
+    Returns
+    -------
+    dict
+        `dataset` sizes, one-off `stages` (seconds), per-call
+        `operations` summaries, `peak_rss_mb_by_stage` (the peak RSS
+        reached by the end of every stage) and the overall `peak_rss_mb`.
+
+    """
+    report = {'stages': {}, 'operations': {}, 'peak_rss_mb_by_stage': {}}
+
+    def stage(name, function):
+        start = time.perf_counter()
+        result = function()
+        report['stages'][name] = time.perf_counter() - start
+        report['peak_rss_mb_by_stage'][name] = peak_rss_mb()
+        return result
+
+    imports = {}
+    for _ in range(import_repeats):
+        for _, module, seconds in profile_imports(IMPORTED_MODULES):
+            imports.setdefault(module, []).append(seconds)
+    for module, seconds in imports.items():
+        report['operations'][f'import:{module}'] = summarise(seconds)
+
+    from utils import data_loader
+    from utils.catalog import load_catalog
+    stage('load_data_first', lambda: (data_loader.load_movies(), data_loader.load_ratings()))
+    reloads = []
+    for _ in range(repeats):
+        data_loader.load_columns.cache_clear()
+        start = time.perf_counter()
+        data_loader.load_movies()
+        data_loader.load_ratings()
+        reloads.append(time.perf_counter() - start)
+    report['operations']['load_data'] = summarise(reloads)
+
+    from recommenders.collaborative_based import (ALGORITHMS, collab_model, collab_state,
+                                                  highest_rated_users, indices_to_titles,
+                                                  set_collab_algorithm)
+    from recommenders.content_based import content_model, content_state
+    from recommenders.factor_based import factor_state
+    from utils.popularity import popularity_stats
+    catalog = stage('init_catalog', load_catalog)
+    stage('init_popularity', popularity_stats)
+    stage('init_content', content_state)
+    stage('init_collab', collab_state)
+    algorithms = ['neighbourhood']
+    try:
+        stage('init_svd', factor_state)
+        algorithms.append('svd')
+    except FileNotFoundError:
+        pass
+    report['dataset'] = {'n_movies': len(catalog.id_to_title), 'n_ratings': len(catalog.rating_users),
+                         'n_users': len(np.unique(catalog.rating_users))}
+
+    favourites, id_lists = sample_queries(catalog, n_queries, seed)
+    queries = [(movie_list, 10) for movie_list in favourites]
+    operations = report['operations']
+    operations['content_model'] = time_calls(content_model.uncached, queries)
+    report['peak_rss_mb_by_stage']['content_model'] = peak_rss_mb()
+    # the similarity engine keeps neighbour lists across calls; drop them
+    # so that every uncached query scores its users afresh
+    clear_neighbours = collab_state().similarity_engine.clear_neighbours
+    for name in algorithms:
+        if name not in ALGORITHMS:
+            continue
+        set_collab_algorithm(name)
+        operations[f'collab_model[{name}]'] = time_calls(collab_model.uncached, queries,
+                                                         clear_neighbours)
+        report['peak_rss_mb_by_stage'][f'collab_model[{name}]'] = peak_rss_mb()
+    operations['highest_rated_users'] = time_calls(highest_rated_users,
+                                                   [(movie_list,) for movie_list in favourites])
+    operations['indices_to_titles'] = time_calls(indices_to_titles, [(ids,) for ids in id_lists])
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+if __name__ == '__main__':
+    args = [int(value) for value in sys.argv[1:3]]
+    print(json.dumps(measure(*args)))
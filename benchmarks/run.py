@@ -0,0 +1,186 @@
+"""
+
+    Recommender benchmark suite.
+
+    Author: Explore Data Science Academy.
+
+    Description: Runs `benchmarks.hot_paths` on the bundled data and on
+    synthetic datasets of the requested catalogue x user sizes, each in a
+    fresh interpreter with its own binary cache and model directory, and
+    writes all reports to one JSON file. Given a baseline report, any
+    operation whose p50/p95 latency or peak RSS grew by more than the
+    tolerance is listed and the run exits with status 1.
+
+        python -m benchmarks.run --synthetic 10000x2000 --synthetic 30000x10000
+        python -m benchmarks.run --baseline benchmarks/results/baseline.json
+
+"""
+# Script dependencies
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from benchmarks.synthetic import RATINGS_PER_USER, generate
+
+# Where synthetic datasets, their caches and models are kept between runs
+WORK_DIR = 'benchmarks/work'
+# Default report location
+OUTPUT_PATH = 'benchmarks/results/latest.json'
+# Relative slowdown tolerated before a metric counts as a regression
+TOLERANCE = 0.25
+# Latency differences below this (ms) are treated as noise
+MIN_DELTA_MS = 1.0
+# Metrics compared against the baseline
+COMPARED_METRICS = ('p50_ms', 'p95_ms')
+
+
+def synthetic_dataset(size, ratings_per_user, work_dir=WORK_DIR, seed=0):
+    """Generate (once) a synthetic dataset and return its environment.
+
+    Parameters
+    ----------
+    size : str
+        '<n_movies>x<n_users>', e.g. '10000x2000'.
+    ratings_per_user : int
+        Mean number of ratings per user.
+
+    Returns
+    -------
+    tuple
+        (name, environment overrides pointing at the dataset).
+
+    """
+    n_movies, n_users = (int(value) for value in size.lower().split('x'))
+    name = f'synthetic-{n_movies}x{n_users}x{ratings_per_user}-s{seed}'
+    root = os.path.join(work_dir, name)
+    movies_path = os.path.join(root, 'movies.csv')
+    ratings_path = os.path.join(root, 'ratings.csv')
+    if not (os.path.exists(movies_path) and os.path.exists(ratings_path)):
+        print(f"Generating {name} ...", file=sys.stderr)
+        generate(root, n_movies, n_users, ratings_per_user, seed)
+    env = {'EDSA_MOVIES_PATH': movies_path, 'EDSA_RATINGS_PATH': ratings_path,
+           'EDSA_CACHE_DIR': os.path.join(root, 'cache'),
+           'EDSA_MODELS_DIR': os.path.join(root, 'models')}
+    return name, env
+
+
+def run_python(module, args, env_overrides):
+    """Run `python -m module args` with extra environment; return stdout."""
+    env = dict(os.environ, EDSA_RESULT_CACHE_SIZE='0', **env_overrides)
+    result = subprocess.run([sys.executable, '-m', module, *map(str, args)], env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} failed:\n{result.stderr}")
+    return result.stdout
+
+
+def benchmark_dataset(name, env_overrides, n_queries, repeats, train_factors=True):
+    """Benchmark one dataset in a fresh interpreter and return its report."""
+    models_dir = env_overrides.get('EDSA_MODELS_DIR')
+    if models_dir and not os.path.exists(os.path.join(models_dir, 'content_index.npz')):
+        print(f"Building the content index for {name} ...", file=sys.stderr)
+        run_python('recommenders.content_index', [], env_overrides)
+    if train_factors and models_dir and not os.path.exists(os.path.join(models_dir, 'svd_factors.npz')):
+        print(f"Training factors for {name} ...", file=sys.stderr)
+        run_python('recommenders.als', ['train'], env_overrides)
+    print(f"Benchmarking {name} ...", file=sys.stderr)
+    output = run_python('benchmarks.hot_paths', [n_queries, repeats], env_overrides)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit():
+    """Current commit hash, or None outside a git checkout."""
+    result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True)
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def find_regressions(current, baseline, tolerance=TOLERANCE, min_delta_ms=MIN_DELTA_MS):
+    """Compare two benchmark reports.
+
+    Only datasets and operations present in both are compared.
+
+    Returns
+    -------
+    list (str)
+        One description per regressed metric; empty if none regressed.
+
+    """
+    regressions = []
+    for dataset, report in current['datasets'].items():
+        reference = baseline['datasets'].get(dataset)
+        if reference is None:
+            continue
+        for operation, metrics in report['operations'].items():
+            before = reference['operations'].get(operation)
+            if before is None:
+                continue
+            for metric in COMPARED_METRICS:
+                new, old = metrics[metric], before[metric]
+                if new > old * (1 + tolerance) and new - old > min_delta_ms:
+                    regressions.append(f"{dataset} {operation} {metric}: {old:.2f} -> {new:.2f}")
+        new, old = report['peak_rss_mb'], reference['peak_rss_mb']
+        if new > old * (1 + tolerance):
+            regressions.append(f"{dataset} peak_rss_mb: {old:.0f} -> {new:.0f}")
+    return regressions
+
+
+def format_report(results):
+    """Render the operations of every dataset as an aligned text table."""
+    lines = []
+    for dataset, report in results['datasets'].items():
+        sizes = ', '.join(f"{key} {value:,}" for key, value in report['dataset'].items())
+        lines.append(f"{dataset} ({sizes}; peak RSS {report['peak_rss_mb']:.0f} MiB)")
+        for operation, metrics in report['operations'].items():
+            lines.append(f"  {operation:<45} p50 {metrics['p50_ms']:9.2f} ms  "
+                         f"p95 {metrics['p95_ms']:9.2f} ms  {metrics['throughput_per_s']:10.1f} /s")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the recommender hot paths.')
+    parser.add_argument('--synthetic', action='append', default=[], metavar='MOVIESxUSERS',
+                        help='synthetic dataset size (repeatable)')
+    parser.add_argument('--ratings-per-user', type=int, default=RATINGS_PER_USER)
+    parser.add_argument('--no-bundled', action='store_true', help='skip the bundled data')
+    parser.add_argument('--queries', type=int, default=50, help='queries per operation')
+    parser.add_argument('--repeats', type=int, default=5, help='timed data reloads')
+    parser.add_argument('--work-dir', default=WORK_DIR)
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    parser.add_argument('--baseline', help='report to check for regressions against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    datasets = [] if args.no_bundled else [('bundled', {})]
+    datasets += [synthetic_dataset(size, args.ratings_per_user, args.work_dir)
+                 for size in args.synthetic]
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'git_commit': git_commit(), 'python': platform.python_version(),
+               'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+               'datasets': {}}
+    for name, env_overrides in datasets:
+        # The bundled data uses the app's own artifacts and is never retrained
+        results['datasets'][name] = benchmark_dataset(name, env_overrides, args.queries, args.repeats,
+                                                      train_factors=bool(env_overrides))
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    print(format_report(results))
+    print(f"Results written to: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = find_regressions(results, json.load(baseline), args.tolerance)
+        if regressions:
+            print('Regressions against the baseline:')
+            print('\n'.join(f"  {regression}" for regression in regressions))
+            return 1
+        print('No regressions against the baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
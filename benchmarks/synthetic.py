@@ -0,0 +1,123 @@
+"""
+
+    Synthetic MovieLens-style datasets.
+
+    Author: Explore Data Science Academy.
+
+    Description: Generates `movies.csv` and `ratings.csv` files with the
+    same columns as the bundled MovieLens data, at any catalogue and user
+    count, so that the recommenders can be benchmarked beyond the size of
+    the bundled sample. Movie popularity follows a Zipf-like curve and
+    ratings come from a small latent-factor model, so that collaborative
+    filtering has real structure to find.
+
+        python -m benchmarks.synthetic <out_dir> <n_movies> <n_users> [ratings_per_user]
+
+"""
+# Script dependencies
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Genres used by MovieLens
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime', 'Documentary',
+          'Drama', 'Fantasy', 'Film-Noir', 'Horror', 'IMAX', 'Musical', 'Mystery', 'Romance',
+          'Sci-Fi', 'Thriller', 'War', 'Western']
+# Mean number of ratings per user (MovieLens 25M has about 150)
+RATINGS_PER_USER = 100
+# Latent factors of the rating generator
+N_TASTE_FACTORS = 8
+# Ratings generated per chunk (bounds memory)
+CHUNK_SIZE = 1_000_000
+
+
+def generate_movies(n_movies, rng):
+    """Movies with sparse ids, a release year and one to three genres."""
+    movie_ids = np.sort(rng.choice(np.arange(1, 3 * n_movies + 1), size=n_movies, replace=False))
+    years = rng.integers(1920, 2020, size=n_movies)
+    n_genres = rng.integers(1, 4, size=n_movies)
+    genre_rows = np.argsort(rng.random((n_movies, len(GENRES))), axis=1)
+    genres = ['|'.join(GENRES[column] for column in sorted(row[:count]))
+              for row, count in zip(genre_rows.tolist(), n_genres.tolist())]
+    titles = [f"Synthetic Movie {movie_id} ({year})"
+              for movie_id, year in zip(movie_ids.tolist(), years.tolist())]
+    return pd.DataFrame({'movieId': movie_ids, 'title': titles, 'genres': genres})
+
+
+def generate_ratings(movie_ids, n_users, ratings_per_user, rng):
+    """Ratings of `n_users` users drawn from a latent-factor model.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `userId`, `movieId`, `rating` (0.5 to 5.0 in half stars) and
+        `timestamp` columns, one row per distinct (user, movie) pair.
+
+    """
+    n_movies = len(movie_ids)
+    counts = np.clip(rng.lognormal(np.log(ratings_per_user), 0.8, size=n_users).astype(np.int64),
+                     5, n_movies)
+    popularity = 1.0 / (rng.permutation(n_movies) + 10.0) ** 0.9
+    popularity /= popularity.sum()
+    users = np.repeat(np.arange(n_users, dtype=np.int64), counts)
+    movies = rng.choice(n_movies, size=len(users), p=popularity)
+    # Keep one rating per (user, movie) pair
+    pairs = np.unique(users * n_movies + movies)
+    users, movies = pairs // n_movies, pairs % n_movies
+
+    user_taste = rng.normal(0, 0.35, size=(n_users, N_TASTE_FACTORS)).astype(np.float32)
+    movie_taste = rng.normal(0, 0.35, size=(n_movies, N_TASTE_FACTORS)).astype(np.float32)
+    user_bias = rng.normal(0, 0.4, size=n_users).astype(np.float32)
+    movie_bias = rng.normal(0, 0.5, size=n_movies).astype(np.float32)
+    ratings = np.empty(len(users), dtype=np.float32)
+    for start in range(0, len(users), CHUNK_SIZE):
+        chunk = slice(start, start + CHUNK_SIZE)
+        u, m = users[chunk], movies[chunk]
+        raw = (3.5 + user_bias[u] + movie_bias[m] + np.einsum('ij,ij->i', user_taste[u], movie_taste[m])
+               + rng.normal(0, 0.5, size=len(u)))
+        ratings[chunk] = np.clip(np.round(raw * 2) / 2, 0.5, 5.0)
+    timestamps = rng.integers(946684800, 1577836800, size=len(users))
+    return pd.DataFrame({'userId': users + 1, 'movieId': np.asarray(movie_ids)[movies],
+                         'rating': ratings, 'timestamp': timestamps})
+
+
+def generate(out_dir, n_movies, n_users, ratings_per_user=RATINGS_PER_USER, seed=0):
+    """Write a synthetic `movies.csv` and `ratings.csv` to `out_dir`.
+
+    Parameters
+    ----------
+    out_dir : str
+        Directory the two files are written to.
+    n_movies : int
+        Catalogue size.
+    n_users : int
+        Number of users.
+    ratings_per_user : int
+        Mean number of ratings per user.
+    seed : int
+        Seed of the generator; equal arguments give identical files.
+
+    Returns
+    -------
+    tuple (str)
+        Paths of the movies and ratings files.
+
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    movies = generate_movies(n_movies, rng)
+    ratings = generate_ratings(movies['movieId'].to_numpy(), n_users, ratings_per_user, rng)
+    movies_path = os.path.join(out_dir, 'movies.csv')
+    ratings_path = os.path.join(out_dir, 'ratings.csv')
+    movies.to_csv(movies_path, index=False)
+    ratings.to_csv(ratings_path, index=False)
+    return movies_path, ratings_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        sys.exit(__doc__.strip().splitlines()[-1].strip())
+    sizes = [int(value) for value in sys.argv[2:5]]
+    paths = generate(sys.argv[1], *sizes)
+    print(f"Wrote: {', '.join(paths)}")
@@ -34,11 +34,26 @@ import numpy as np
 
 # Custom Libraries
 from utils.data_loader import load_movie_titles
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
+from recommenders.client import SERVICE_URL
+if SERVICE_URL:
+    # Thin client: the recommendation service (recommenders.service) holds
+    # the only copy of the models, whatever the number of app sessions
+    from recommenders.client import collab_algorithms, collab_model, content_model, set_collab_algorithm
+else:
+    from recommenders.collaborative_based import collab_algorithms, collab_model, set_collab_algorithm
+    from recommenders.content_based import content_model
+from utils import instrumentation
+from utils.startup import PROFILE_STARTUP, format_timings, profile_imports, startup_timings
 
 # Data Loading
 title_list = load_movie_titles('resources/data/movies.csv')
+if not SERVICE_URL:
+    # A fresh checkout has no content index: build it once, at startup,
+    # rather than inside the first recommendation request
+    from recommenders.content_index import content_index_ready, ensure_content_index
+    if not content_index_ready():
+        with st.spinner('Building the content index (first start only, a few minutes)...'):
+            ensure_content_index()
 
 # App declaration
 def main():
@@ -47,6 +62,14 @@ def main():
     # you are welcome to add more options to enrich your app.
     page_options = ["Recommender System","Solution Overview", "Movies EDA", "About Sigma AI"]
 
+    # Collaborative algorithm used by collab_model for this session:
+    # user-neighbourhood similarity or SVD matrix factorisation
+    set_collab_algorithm(st.sidebar.selectbox("Collaborative algorithm", collab_algorithms()))
+    # Debug panel: time every recommender stage of this session's queries
+    # (the process-wide metrics are enabled by EDSA_INSTRUMENT=1 only)
+    show_timings = st.sidebar.checkbox("Debug: stage timings", value=instrumentation.enabled())
+    instrumentation.set_capture(show_timings)
+
     # -------------------------------------------------------------------
     # ----------- !! THIS CODE MUST NOT BE ALTERED !! -------------------
     # -------------------------------------------------------------------
@@ -172,6 +195,26 @@ def main():
             st.image('resources/imgs/basheer.jpg', caption="Basheer Ashafa.\n Project Manager")
         with col5:
             st.image('resources/imgs/nana.jpg', caption="Nana Adewale.\n Technical Support")
+
+    # Startup profiling mode (EDSA_PROFILE_STARTUP=1): show how long each
+    # recommender took to initialise in this process, and optionally the
+    # standalone import cost of each module
+    if PROFILE_STARTUP:
+        with st.sidebar.expander("Startup profile"):
+            timings = startup_timings()
+            if st.button("Profile module imports"):
+                timings = profile_imports() + timings
+            st.text(format_timings(timings))
+
+    # Per-stage breakdown of the last recommendation made in this session
+    if show_timings:
+        with st.sidebar.expander("Stage timings", expanded=True):
+            last = instrumentation.last_trace()
+            if last is None:
+                st.write("No recommendation traced yet.")
+            else:
+                st.write(f"Last query: {last['model']}")
+                st.text(instrumentation.format_trace(last))
         
         
 
@@ -0,0 +1,313 @@
+"""
+
+    Alternating least squares (ALS) matrix-factorisation trainer.
+
+    Author: Explore Data Science Academy.
+
+    Description: Trains the same biased factor model as surprise.SVD
+    (r_ui ~ mu + b_u + b_i + p_u.q_i) directly on the sparse users x movies
+    ratings matrix. Each half-iteration fixes one side and solves the
+    ridge regressions of every row on the other side in blocks: the
+    rows are grouped by length and each block is assembled and solved with
+    batched matrix products, without per-row Python work; rows shorter than
+    the number of factors are solved in the smaller dual form. Factors are
+    kept in float32 and only the compact arrays used by
+    `recommenders.factor_based` are exported.
+
+    On a single core the fit is still slower than surprise.SVD's compiled
+    SGD (`compare` reports both) but reaches a lower test RMSE in fewer
+    passes; the trainer is optional and surprise remains the default.
+
+        python -m recommenders.als train [n_factors] [n_iters]
+        python -m recommenders.als compare
+
+"""
+# Script dependencies
+import os
+import sys
+import time
+import numpy as np
+import scipy.sparse as sp
+
+from recommenders.factor_based import FACTORS_PATH, SGD_INIT_STD, FactorModel
+
+# Latent factors per user and movie
+N_FACTORS = 50
+# Alternating iterations (one user and one movie solve each)
+N_ITERS = 5
+# Ridge penalty per rating, as in weighted-lambda ALS
+ALS_REG = 0.1
+# Padded ratings solved per block (bounds memory)
+BLOCK_NNZ = 65536
+
+
+def ratings_matrix(user_ids, movie_ids, ratings):
+    """Build the float32 CSR ratings matrix and its row/column ids.
+
+    Repeated (user, movie) pairs are averaged.
+
+    Returns
+    -------
+    tuple
+        (matrix, user_ids, movie_ids) where the ids label the rows and
+        columns of the matrix.
+
+    """
+    users, user_rows = np.unique(np.asarray(user_ids), return_inverse=True)
+    movies, movie_cols = np.unique(np.asarray(movie_ids), return_inverse=True)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    shape = (len(users), len(movies))
+    totals = sp.csr_matrix((ratings, (user_rows, movie_cols)), shape=shape)
+    counts = sp.csr_matrix((np.ones_like(ratings), (user_rows, movie_cols)), shape=shape)
+    totals.sum_duplicates()
+    counts.sum_duplicates()
+    matrix = sp.csr_matrix(((totals.data / counts.data).astype(np.float32), totals.indices,
+                            totals.indptr), shape=shape)
+    return matrix, users, movies
+
+
+def _row_blocks(counts, block_nnz):
+    """Group rows of similar length into blocks of about `block_nnz` slots.
+
+    Rows are ordered by their number of ratings, so that padding every
+    row of a block to the longest one wastes little work.
+
+    """
+    order = np.argsort(counts, kind='stable')
+    order = order[counts[order] > 0]
+    sorted_counts = counts[order]
+    start = 0
+    while start < len(order):
+        end = min(len(order), start + max(1, block_nnz // sorted_counts[start]))
+        while end - start > 1 and (end - start) * sorted_counts[end - 1] > block_nnz:
+            end = start + max(1, block_nnz // sorted_counts[end - 1])
+        yield order[start:end]
+        start = end
+
+
+def solve_side(matrix, other_factors, other_biases, global_mean, reg=ALS_REG, block_nnz=BLOCK_NNZ):
+    """Refit the factors and biases of every row of `matrix`.
+
+    With the other side fixed, row u solves
+    min sum_i (r_ui - mu - b_i - b_u - p_u.q_i)^2 + reg * n_u * (|p_u|^2 + b_u^2)
+    over its n_u ratings, where (q_i, b_i) are `other_factors` and
+    `other_biases`. Rows without ratings are left at zero.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        Ratings with the side being solved as rows.
+    other_factors : np.ndarray
+        float32 factors of the columns, shape (n_columns, n_factors).
+    other_biases : np.ndarray
+        Biases of the columns.
+    global_mean : float
+        Mean training rating.
+    reg : float
+        Ridge penalty per rating.
+    block_nnz : int
+        Padded ratings processed per block.
+
+    Returns
+    -------
+    tuple (np.ndarray)
+        float32 factors of shape (n_rows, n_factors) and biases.
+
+    """
+    n_rows, n_factors = matrix.shape[0], other_factors.shape[1]
+    # Append a constant column so that the row bias is solved jointly; the
+    # extra zero row is what padded slots point at
+    design = np.zeros((len(other_factors) + 1, n_factors + 1), dtype=np.float32)
+    design[:-1, :n_factors] = other_factors
+    design[:-1, n_factors] = 1
+    targets = np.append(matrix.data - global_mean - other_biases[matrix.indices], 0).astype(np.float32)
+    indices = np.append(matrix.indices, len(other_factors))
+    counts = np.diff(matrix.indptr)
+    solution = np.zeros((n_rows, n_factors + 1), dtype=np.float32)
+    identity = np.eye(n_factors + 1, dtype=np.float32)
+    for rows in _row_blocks(counts, block_nnz):
+        width = counts[rows[-1]]
+        slots = matrix.indptr[rows][:, None] + np.arange(width)
+        # Slots past the end of a row point at the zero design row
+        slots = np.where(np.arange(width) < counts[rows][:, None], slots, len(indices) - 1)
+        block = design[indices[slots]]
+        block_t = block.transpose(0, 2, 1)
+        penalty = (reg * counts[rows])[:, None, None]
+        if width <= n_factors:
+            # Rows with fewer ratings than unknowns (most movies) solve the
+            # same ridge regression in its dual form,
+            # X^T (X X^T + reg I)^-1 y: a width x width system per row
+            # instead of (n_factors + 1)^2. Padded slots are zero rows of X
+            # with zero targets, so their dual weights are zero.
+            kernel = block @ block_t
+            kernel += penalty * np.eye(width, dtype=np.float32)
+            weights = np.linalg.solve(kernel, targets[slots][:, :, None])
+            solution[rows] = (block_t @ weights)[:, :, 0]
+        else:
+            gram = block_t @ block
+            gram += penalty * identity
+            rhs = block_t @ targets[slots][:, :, None]
+            solution[rows] = np.linalg.solve(gram, rhs)[:, :, 0]
+    return solution[:, :n_factors].copy(), solution[:, n_factors].copy()
+
+
+def _load_checkpoint(path, shapes):
+    """Return (iteration, arrays) from an ALS checkpoint, or None."""
+    if path is None or not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as archive:
+        arrays = {name: archive[name] for name in shapes}
+        iteration = int(archive['iteration'])
+    if any(arrays[name].shape != shape for name, shape in shapes.items()):
+        return None
+    return iteration, arrays
+
+
+def _save_checkpoint(path, iteration, arrays):
+    """Atomically write the factors after `iteration` iterations."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    staging = path + '.tmp'
+    with open(staging, 'wb') as checkpoint:
+        np.savez(checkpoint, iteration=iteration, **arrays)
+    os.replace(staging, path)
+
+
+def train_als(user_ids, movie_ids, ratings, n_factors=N_FACTORS, n_iters=N_ITERS, reg=ALS_REG,
+              seed=0, checkpoint_path=None, block_nnz=BLOCK_NNZ, verbose=False):
+    """Fit a biased factor model with alternating least squares.
+
+    Parameters
+    ----------
+    user_ids, movie_ids, ratings : np.ndarray
+        Parallel arrays of training ratings.
+    n_factors : int
+        Latent factors per user and movie.
+    n_iters : int
+        Alternating iterations.
+    reg : float
+        Ridge penalty per rating.
+    seed : int
+        Seed of the initial movie factors.
+    checkpoint_path : str, optional
+        .npz file the factors are written to after every iteration; an
+        existing checkpoint for the same data shape is resumed from.
+    block_nnz : int
+        Ratings processed per block.
+    verbose : bool
+        Print the training RMSE after every iteration.
+
+    Returns
+    -------
+    tuple
+        (FactorModel, stats) where stats holds the fit time in seconds,
+        the number of iterations run and the ratings/sec throughput.
+
+    """
+    start = time.perf_counter()
+    matrix, users, movies = ratings_matrix(user_ids, movie_ids, ratings)
+    transposed = matrix.T.tocsr()
+    global_mean = float(matrix.data.mean())
+    shapes = {'user_factors': (len(users), n_factors), 'user_biases': (len(users),),
+              'item_factors': (len(movies), n_factors), 'item_biases': (len(movies),)}
+    resumed = _load_checkpoint(checkpoint_path, shapes)
+    if resumed is None:
+        rng = np.random.default_rng(seed)
+        first_iter = 0
+        arrays = {'user_factors': np.zeros(shapes['user_factors'], np.float32),
+                  'user_biases': np.zeros(len(users), np.float32),
+                  'item_factors': rng.normal(0, SGD_INIT_STD, shapes['item_factors']).astype(np.float32),
+                  'item_biases': np.zeros(len(movies), np.float32)}
+    else:
+        first_iter, arrays = resumed
+    for iteration in range(first_iter, n_iters):
+        arrays['user_factors'], arrays['user_biases'] = solve_side(
+            matrix, arrays['item_factors'], arrays['item_biases'], global_mean, reg, block_nnz)
+        arrays['item_factors'], arrays['item_biases'] = solve_side(
+            transposed, arrays['user_factors'], arrays['user_biases'], global_mean, reg, block_nnz)
+        if checkpoint_path is not None:
+            _save_checkpoint(checkpoint_path, iteration + 1, arrays)
+        if verbose:
+            model = FactorModel(movies, arrays['item_factors'], arrays['item_biases'], global_mean,
+                                user_ids=users, user_factors=arrays['user_factors'],
+                                user_biases=arrays['user_biases'])
+            rows = np.repeat(np.arange(len(users)), np.diff(matrix.indptr))
+            train_rmse = rmse(model.predict(users[rows], movies[matrix.indices]), matrix.data)
+            print(f"iteration {iteration + 1}/{n_iters}: train rmse {train_rmse:.4f}")
+    fit_seconds = time.perf_counter() - start
+    model = FactorModel(movies, arrays['item_factors'], arrays['item_biases'], global_mean,
+                        float(matrix.data.max()), users, arrays['user_factors'], arrays['user_biases'])
+    n_run = n_iters - first_iter
+    stats = {'fit_seconds': fit_seconds, 'iterations': n_run,
+             'ratings_per_second': matrix.nnz * n_run / fit_seconds if fit_seconds > 0 else 0.0}
+    return model, stats
+
+
+def rmse(predictions, ratings, rating_scale=None):
+    """Root mean squared error, optionally clipping predictions to the scale."""
+    predictions = np.asarray(predictions, dtype=np.float64)
+    if rating_scale is not None:
+        predictions = np.clip(predictions, *rating_scale)
+    return float(np.sqrt(np.mean((predictions - np.asarray(ratings, dtype=np.float64)) ** 2)))
+
+
+def compare_with_surprise(test_fraction=0.2, n_factors=N_FACTORS, n_iters=N_ITERS, reg=ALS_REG,
+                          seed=0):
+    """Compare test RMSE and training throughput with surprise.SVD.
+
+    Both models are trained on the same random split of the bundled
+    ratings; surprise.SVD uses its default settings with `n_factors`.
+
+    Returns
+    -------
+    dict
+        Per trainer: test RMSE, fit seconds and ratings/sec.
+
+    """
+    import surprise
+    from utils.data_loader import load_ratings
+
+    ratings = load_ratings()
+    rng = np.random.default_rng(seed)
+    test = rng.random(len(ratings)) < test_fraction
+    train_df, test_df = ratings[~test], ratings[test]
+    scale = (float(ratings['rating'].min()), float(ratings['rating'].max()))
+
+    model, stats = train_als(train_df['userId'].to_numpy(), train_df['movieId'].to_numpy(),
+                             train_df['rating'].to_numpy(), n_factors, n_iters, reg, seed)
+    predictions = model.predict(test_df['userId'].to_numpy(), test_df['movieId'].to_numpy())
+    report = {'als': {'rmse': rmse(predictions, test_df['rating'], scale),
+                      'fit_seconds': stats['fit_seconds'],
+                      'ratings_per_second': stats['ratings_per_second']}}
+
+    reader = surprise.Reader(rating_scale=scale)
+    trainset = surprise.Dataset.load_from_df(train_df, reader).build_full_trainset()
+    algo = surprise.SVD(n_factors=n_factors, random_state=seed)
+    start = time.perf_counter()
+    algo.fit(trainset)
+    fit_seconds = time.perf_counter() - start
+    predictions = [algo.predict(user, movie).est
+                   for user, movie in zip(test_df['userId'].tolist(), test_df['movieId'].tolist())]
+    report['surprise'] = {'rmse': rmse(predictions, test_df['rating'], scale),
+                          'fit_seconds': fit_seconds,
+                          'ratings_per_second': trainset.n_ratings * algo.n_epochs / fit_seconds}
+    return report
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'train'
+    if command == 'train':
+        from utils.data_loader import load_ratings
+
+        ratings = load_ratings()
+        args = [int(value) for value in sys.argv[2:4]]
+        trained, stats = train_als(ratings['userId'].to_numpy(), ratings['movieId'].to_numpy(),
+                                   ratings['rating'].to_numpy(), *args, verbose=True)
+        trained.save(FACTORS_PATH)
+        print(f"Trained in {stats['fit_seconds']:.1f} s "
+              f"({stats['ratings_per_second']:,.0f} ratings/sec); saved to: {FACTORS_PATH}")
+    elif command == 'compare':
+        for name, metrics in compare_with_surprise().items():
+            print(f"{name:<10} rmse {metrics['rmse']:.4f}  fit {metrics['fit_seconds']:7.2f} s  "
+                  f"{metrics['ratings_per_second']:>12,.0f} ratings/sec")
+    else:
+        sys.exit(f"Unknown command: {command} (expected 'train' or 'compare')")
@@ -0,0 +1,244 @@
+"""
+
+    Batch recommendation and offline scoring.
+
+    Author: Explore Data Science Academy.
+
+    Description: Computes recommendations for many favourite lists (or
+    users) at once, e.g. to precompute e-mail and homepage rows. Each
+    model has a batch counterpart of its single-query function that shares
+    the expensive work (neighbour lookups, similarity and factor matrix
+    products) across the whole batch and returns the same lists as the
+    single-query function would.
+
+    The command line streams CSV or JSONL files in chunks and spreads the
+    chunks over a process pool, holding only a bounded number of chunks in
+    memory:
+
+        python -m recommenders.batch <input> <output> [--model svd] [--top-n 10]
+            [--chunk-size 1000] [--workers 4]
+
+    Input rows hold either a `userId` or `favourites` (a JSON list, or
+    titles joined by '|' in CSV), plus an optional `id` that is copied to
+    the output.
+
+"""
+# Script dependencies
+import argparse
+import collections
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from recommenders.collaborative_based import BATCH_ALGORITHMS, top_rated_movies
+from recommenders.content_based import content_batch
+from utils.catalog import load_catalog
+from utils.rating_store import rating_store
+
+# Batch recommender of every model
+BATCH_MODELS = {'content': content_batch, **BATCH_ALGORITHMS}
+# Favourites taken from a user's own ratings
+N_FAVOURITES = 3
+# Input rows scored per task
+CHUNK_SIZE = 1000
+# Separator of favourite titles within a CSV field
+TITLE_SEPARATOR = '|'
+
+
+def favourites_for_users(user_ids, n_favourites=N_FAVOURITES):
+    """Each user's highest-rated movie titles, used as their favourites.
+
+    Parameters
+    ----------
+    user_ids : list (int)
+        User ids; unknown users get an empty list.
+    n_favourites : int
+        Titles per user.
+
+    Returns
+    -------
+    list (list (str))
+        Favourite titles of every user, in input order.
+
+    """
+    catalog = load_catalog()
+    top_movies = top_rated_movies(rating_store(), list(set(user_ids)), n=n_favourites)
+    return [catalog.titles_for(top_movies.get(user_id, [])) for user_id in user_ids]
+
+
+def recommend_batch(movie_lists=None, model='content', top_n=10, user_ids=None):
+    """Recommend movies for many favourite lists, or users, at once.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str)), optional
+        Favourite movie titles of every query.
+    model : str
+        A key of `BATCH_MODELS`.
+    top_n : int
+        Number of recommendations per query.
+    user_ids : list (int), optional
+        Users to recommend for instead of `movie_lists`; their top-rated
+        movies are used as favourites.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of every query, in input order.
+
+    """
+    if model not in BATCH_MODELS:
+        raise ValueError(f"Unknown model: {model!r}")
+    if user_ids is not None:
+        movie_lists = favourites_for_users(user_ids)
+    # the single-query recommenders see the favourites in sorted order
+    return BATCH_MODELS[model]([sorted(movie_list) for movie_list in movie_lists], top_n)
+
+
+def _parse_favourites(value):
+    """Favourite titles from a JSON list or a '|'-joined CSV field."""
+    if isinstance(value, list):
+        return value
+    if not value:
+        return []
+    return [title for title in value.split(TITLE_SEPARATOR) if title]
+
+
+def score_records(records, model, top_n):
+    """Score one chunk of input records.
+
+    Parameters
+    ----------
+    records : list (dict)
+        Rows holding a `userId` or `favourites`, and optionally an `id`.
+
+    Returns
+    -------
+    list (dict)
+        One output row per record: its `id` and/or `userId`, and the
+        `recommendations`.
+
+    """
+    by_user = [position for position, record in enumerate(records)
+               if record.get('userId') not in (None, '')]
+    movie_lists = [_parse_favourites(record.get('favourites')) for record in records]
+    if by_user:
+        user_ids = [int(records[position]['userId']) for position in by_user]
+        for position, favourites in zip(by_user, favourites_for_users(user_ids)):
+            movie_lists[position] = favourites
+    recommendations = recommend_batch(movie_lists, model, top_n)
+    output = []
+    for record, recommended in zip(records, recommendations):
+        row = {key: record[key] for key in ('id', 'userId') if record.get(key) not in (None, '')}
+        row['recommendations'] = recommended
+        output.append(row)
+    return output
+
+
+def read_records(path, chunk_size=CHUNK_SIZE):
+    """Stream the records of a CSV or JSONL file in chunks."""
+    with open(path, newline='') as source:
+        if path.endswith('.csv'):
+            records = csv.DictReader(source)
+        else:
+            records = (json.loads(line) for line in source if line.strip())
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+class RecordWriter:
+    """Append output rows to a CSV or JSONL file."""
+
+    def __init__(self, path):
+        self.csv = path.endswith('.csv')
+        self._file = open(path, 'w', newline='')
+        self._writer = None
+        if self.csv:
+            self._writer = csv.DictWriter(self._file, ['id', 'userId', 'recommendations'],
+                                          extrasaction='ignore')
+            self._writer.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.csv:
+                self._writer.writerow(dict(row, recommendations=TITLE_SEPARATOR.join(row['recommendations'])))
+            else:
+                self._file.write(json.dumps(row) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+def score_file(input_path, output_path, model='content', top_n=10, chunk_size=CHUNK_SIZE,
+               workers=0):
+    """Stream `input_path` through the batch recommender into `output_path`.
+
+    Parameters
+    ----------
+    input_path, output_path : str
+        .csv or .jsonl files.
+    model : str
+        A key of `BATCH_MODELS`.
+    top_n : int
+        Recommendations per row.
+    chunk_size : int
+        Rows scored per task.
+    workers : int
+        Worker processes; 0 scores in this process. At most two chunks
+        per worker are in flight at a time, and output keeps input order.
+
+    Returns
+    -------
+    int
+        Number of rows written.
+
+    """
+    writer = RecordWriter(output_path)
+    written = 0
+    try:
+        chunks = read_records(input_path, chunk_size)
+        if workers <= 0:
+            for chunk in chunks:
+                rows = score_records(chunk, model, top_n)
+                writer.write(rows)
+                written += len(rows)
+            return written
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.submit(score_records, chunk, model, top_n))
+                if len(pending) >= 2 * workers:
+                    rows = pending.popleft().result()
+                    writer.write(rows)
+                    written += len(rows)
+            while pending:
+                rows = pending.popleft().result()
+                writer.write(rows)
+                written += len(rows)
+        return written
+    finally:
+        writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score favourite lists or users in bulk.')
+    parser.add_argument('input', help='.csv or .jsonl input file')
+    parser.add_argument('output', help='.csv or .jsonl output file')
+    parser.add_argument('--model', choices=sorted(BATCH_MODELS), default='content')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (0 scores in-process)')
+    args = parser.parse_args(argv)
+    written = score_file(args.input, args.output, args.model, args.top_n, args.chunk_size,
+                         args.workers)
+    print(f"Wrote {written} rows to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+
+    Thin client of the recommendation service.
+
+    Author: Explore Data Science Academy.
+
+    Description: Drop-in replacements for `content_model`, `collab_model`
+    and the collaborative algorithm selection that forward every query to
+    `recommenders.service` over pooled keep-alive HTTP connections, so an
+    app process never loads the ratings, indexes or models itself.
+
+    Configuration:
+        EDSA_SERVICE_URL        e.g. http://127.0.0.1:8765; unset means the
+                                app scores in-process
+        EDSA_SERVICE_TIMEOUT    seconds per request (default 30)
+
+"""
+# Script dependencies
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+
+from utils.instrumentation import count, stage, trace
+
+# Base URL of the recommendation service
+SERVICE_URL = os.environ.get('EDSA_SERVICE_URL') or None
+# Seconds to wait for a response
+TIMEOUT = float(os.environ.get('EDSA_SERVICE_TIMEOUT', '30'))
+# Idle connections kept open per pool
+POOL_SIZE = 8
+# Algorithm used when a session selected none (the service's default)
+DEFAULT_ALGORITHM = os.environ.get('EDSA_COLLAB_ALGORITHM', 'neighbourhood')
+# Seconds before an unreachable service is asked for its algorithms again
+ALGORITHMS_RETRY = 60
+
+# Per-thread (i.e. per Streamlit session) algorithm selection
+_selection = threading.local()
+
+
+class ServiceError(RuntimeError):
+    """The recommendation service rejected a request or could not be reached."""
+
+
+class ConnectionPool:
+    """Reusable keep-alive connections to one HTTP server.
+
+    Parameters
+    ----------
+    url : str
+        Base URL, e.g. 'http://127.0.0.1:8765'.
+    size : int
+        Idle connections kept for reuse; busier threads open extra ones.
+    timeout : float
+        Socket timeout in seconds.
+
+    """
+
+    def __init__(self, url, size=POOL_SIZE, timeout=TIMEOUT):
+        parts = urllib.parse.urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                 else http.client.HTTPConnection)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+
+    def _release(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, payload=None):
+        """Send a request and decode its JSON response.
+
+        A request on a pooled connection that the server has closed in the
+        meantime is retried once on a new connection.
+
+        Returns
+        -------
+        dict
+            The decoded response body.
+
+        """
+        body = None if payload is None else json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        for attempt in range(2):
+            connection = self._acquire()
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as error:
+                connection.close()
+                if attempt == 0:
+                    continue
+                raise ServiceError(f"Recommendation service unreachable: {error}") from error
+            except OSError as error:
+                connection.close()
+                raise ServiceError(f"Recommendation service unreachable: {error}") from error
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            result = json.loads(data)
+            if response.status != 200:
+                raise ServiceError(result.get('error', f"HTTP {response.status}"))
+            return result
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def service_pool():
+    """Process-wide connection pool to SERVICE_URL."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if SERVICE_URL is None:
+                raise ServiceError("EDSA_SERVICE_URL is not set")
+            _pool = ConnectionPool(SERVICE_URL)
+        return _pool
+
+
+def recommend(model, movie_list, top_n=10):
+    """Ask the service for the top-n recommendations of one favourite list."""
+    with trace(model):
+        with stage('service.request'):
+            response = service_pool().request('POST', '/recommend',
+                                              {'model': model, 'movies': list(movie_list),
+                                               'top_n': top_n})
+        count('service.batch_size', response['batch_size'])
+    return response['recommendations']
+
+
+def content_model(movie_list, top_n=10):
+    """`recommenders.content_based.content_model`, scored by the service."""
+    return recommend('content', movie_list, top_n)
+
+
+def collab_model(movie_list, top_n=10):
+    """`recommenders.collaborative_based.collab_model`, scored by the service."""
+    return recommend(get_collab_algorithm(), movie_list, top_n)
+
+
+def set_collab_algorithm(name):
+    """Select the algorithm `collab_model` uses within the current thread."""
+    _selection.name = name
+
+
+def get_collab_algorithm():
+    """Return the algorithm name selected for the current thread."""
+    return getattr(_selection, 'name', DEFAULT_ALGORITHM)
+
+
+# Algorithm names last listed by the service, and when a failed listing
+# may be retried
+_algorithms = {'names': None, 'retry_at': 0.0}
+
+
+def collab_algorithms():
+    """Names of the algorithms the service offers, the default first.
+
+    The service is asked once; its answer is kept for the life of the
+    process. While it cannot be reached, the algorithms this code base
+    implements are listed instead and the service is asked again after
+    ALGORITHMS_RETRY seconds, so that pages never fail on the listing.
+    """
+    if _algorithms['names'] is not None:
+        return _algorithms['names']
+    if time.monotonic() >= _algorithms['retry_at']:
+        try:
+            _algorithms['names'] = service_pool().request('GET', '/algorithms')['collab']
+            return _algorithms['names']
+        except ServiceError:
+            count('service.algorithms_fallback')
+            _algorithms['retry_at'] = time.monotonic() + ALGORITHMS_RETRY
+    from recommenders.collaborative_based import ALGORITHMS
+    return sorted(ALGORITHMS, key=lambda name: name != DEFAULT_ALGORITHM)
@@ -28,31 +28,59 @@
 """
 
 # Script dependencies
+import os
+import threading
+import types
 import pandas as pd
 import numpy as np
-import pickle
-import copy
-from surprise import Reader, Dataset
-from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-import heapq
-from numpy.linalg import norm
-
-
-# Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
-
-# build utility matrix for users 
-util_matrix = ratings_df.pivot_table(index=['userId'], columns=['movieId'], values='rating')
-# Normalize each row (a given user's ratings) of the utility matrix
-util_matrix_norm = util_matrix.apply(lambda x: (x-np.mean(x))/(np.max(x)-np.min(x)), axis=1)
-# Fill Nan values with 0's, transpose matrix, and drop users with no ratings
-util_matrix_norm.fillna(0, inplace=True)
-# Remove rows with all 0s in a Dataframe
-util_matrix_norm = util_matrix_norm.loc[(util_matrix_norm != 0).any(axis=1)]
+
+from recommenders.content_index import content_vectors
+from recommenders.factor_based import FACTORS_PATH, factor_batch, factor_model
+from utils.catalog import load_catalog
+from utils.data_loader import data_version
+from utils.instrumentation import count, stage
+from utils.popularity import popularity_stats
+from utils.rating_store import rating_store
+from utils.rerank import DIVERSITY, diversify, fuse, mmr_pool_size
+from utils.result_cache import cached_recommender, file_version
+from utils.startup import lazy_singleton
+
+
+# Algorithm used by `collab_model` unless a session selects another one
+DEFAULT_ALGORITHM = os.environ.get('EDSA_COLLAB_ALGORITHM', 'neighbourhood')
+# How the top-rated lists of the similar users are merged ('sum' counts
+# occurrences, 'max' or 'rrf')
+MERGE_METHOD = os.environ.get('EDSA_NEIGHBOURHOOD_MERGE', 'sum')
+# Minimum number of top-rated movies taken from every similar user
+N_USER_MOVIES = 20
+# Per-thread (i.e. per Streamlit session) algorithm selection
+_selection = threading.local()
+
+
+@lazy_singleton
+def collab_state():
+    """Build the collaborative filtering data structures on first use.
+
+    Returns
+    -------
+    types.SimpleNamespace
+        The shared `ratings` store, the normalised utility matrix
+        `util_matrix_norm` and the user `similarity_engine` built on it.
+
+    """
+    from recommenders.similarity import UserSimilarityEngine
+    from recommenders.utility_matrix import UtilityMatrix
+    # Importing data
+    ratings = rating_store()
+    # build the normalised utility matrix for users straight from the rating
+    # triplets: each user's ratings are mean-centred and divided by their range,
+    # and users with no usable ratings are left out
+    util_matrix_norm = UtilityMatrix.from_ratings(*ratings.triplets())
+    # CSR view of the normalised matrix with precomputed row norms
+    similarity_engine = UserSimilarityEngine(util_matrix_norm.matrix, util_matrix_norm.user_ids)
+    return types.SimpleNamespace(ratings=ratings,
+                                 util_matrix_norm=util_matrix_norm,
+                                 similarity_engine=similarity_engine)
 
 # this function converts movies ids to movie titles
 def indices_to_titles(idx_list):
@@ -63,13 +91,7 @@ def indices_to_titles(idx_list):
     output:
     title_list: a list containing corresponding movie titles
     """
-    title_list = []
-    for idx in idx_list:
-        movie_title = movies_df[movies_df['movieId'] == idx]['title']
-        if len(movie_title) != 0:
-            movie_title = movie_title.values[0]
-            title_list.append(movie_title)        
-    return title_list    
+    return load_catalog().titles_for(idx_list)
 
 # for each of the movies, select the users with the highest ratings
 def highest_rated_users(movie_list):
@@ -83,21 +105,190 @@ def highest_rated_users(movie_list):
     """
 
     # get the movie id of the rated data
+    catalog = load_catalog()
+    stats = popularity_stats()
     users_raters_list = []
     for movie in movie_list:
-        movie_id = movies_df[movies_df['title'] == movie]['movieId'].values[0]
-        rating = ratings_df[ratings_df['movieId'] == movie_id]['rating']
-        # if the rating is not empty series, get the max rating
-        if len(rating) != 0: 
-            max_rating = rating.max()
-            # get all users with this max_rating and given movie_id
-            max_rating_users = ratings_df[(ratings_df['movieId'] == movie_id) & (ratings_df['rating'] == max_rating)]['userId'].tolist()
-            users_raters_list = users_raters_list + max_rating_users
-    return users_raters_list   
+        # the users who gave the movie its max rating are precomputed
+        users_raters_list += stats.max_raters(catalog.movie_id(movie)).tolist()
+    return users_raters_list
+
+
+def top_rated_movies(ratings, users, n=20):
+    """Each user's n highest-rated movie ids.
+
+    Every user's ratings are a slice of the rating store; equal ratings
+    are ordered exactly as `sort_values(by='rating', ascending=False)` on
+    the user's own ratings orders them.
+
+    Parameters
+    ----------
+    ratings : RatingStore
+        Ratings grouped by user.
+    users : list
+        User ids.
+    n : int
+        Number of movies per user.
+
+    Returns
+    -------
+    dict
+        User id -> list of movie ids, best rated first, for the users
+        with ratings.
+
+    """
+    return {user: ratings.top_movies(user, n) for user in users if user in ratings}
+
+
+def neighbourhood_batch(movie_lists, top_n=10, method=MERGE_METHOD, diversity=DIVERSITY):
+    """User-neighbourhood recommendations for many favourite lists at once.
+
+    The similar users of every query are found with shared matrix
+    products and the top-rated movies of every selected user are looked
+    up in one pass, instead of once per query. Their lists are merged with
+    `utils.rerank.fuse`, leaving out the query's own movies.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movie titles of every query.
+    top_n : int
+        Number of recommendations per query.
+    method : str
+        How the lists of the similar users are merged: 'sum' (number of
+        users listing a movie), 'max' or 'rrf'.
+    diversity : float
+        MMR weight of diversity against relevance; 0 disables MMR.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of every query.
+
+    """
+    state = collab_state()
+    catalog = load_catalog()
+    pool_size = mmr_pool_size(top_n, diversity)
+    with stage('neighbourhood.highest_rated_users'):
+        # get the list of users who highly rated the selected movies
+        users_lists = [highest_rated_users(movie_list) for movie_list in movie_lists]
+    # score every reference user against all users at once and keep the
+    # twenty most similar users of each
+    reference_users = list(dict.fromkeys(user for users in users_lists for user in users))
+    count('neighbourhood.reference_users', len(reference_users))
+    engine = state.similarity_engine
+    with stage('neighbourhood.similarity'):
+        known = [user for user in reference_users if user in engine.row_of]
+        neighbours, scores = engine.most_similar(known, k=20)
+    neighbours_of = {user: position for position, user in enumerate(known)}
+    with stage('neighbourhood.select_users'):
+        selected_lists = []
+        for users_list in users_lists:
+            positions = [neighbours_of[user] for user in dict.fromkeys(users_list) if user in neighbours_of]
+            # sort the collected scores from all the reference users again
+            # and keep the first (best) occurrence of every similar user
+            order = np.argsort(-scores[positions].ravel(), kind='stable')
+            selected_lists.append(pd.unique(neighbours[positions].ravel()[order]).tolist())
+    selected = list({user for users in selected_lists for user in users})
+    count('neighbourhood.candidate_users', len(selected))
+    with stage('neighbourhood.top_rated_movies'):
+        # collect the top rated items of the selected users
+        n_movies = max(N_USER_MOVIES, pool_size)
+        top_movies = top_rated_movies(state.ratings, selected, n_movies)
+    results = []
+    for movie_list, users_list, selected_users in zip(movie_lists, users_lists, selected_lists):
+        # startup problem:
+        # if no users, we recommend the top-n best rated movies in the
+        # catalog, ranked by their damped mean rating
+        if len(users_list) == 0:
+            with stage('neighbourhood.titles'):
+                results.append(indices_to_titles(popularity_stats().top_movies(top_n)))
+            continue
+        with stage('neighbourhood.tally'):
+            # one row of movie ids per similar user, padded with -1
+            selected_movie_ids = np.full((len(selected_users), n_movies), -1, dtype=np.int64)
+            for position, user in enumerate(selected_users):
+                movies = top_movies.get(user, [])
+                selected_movie_ids[position, :len(movies)] = movies
+            # merge the lists: by default, tally the popularity of the movie ids
+            # and sort them by count, keeping the first-seen movie first among
+            # equal counts
+            seeds = [catalog.movie_id(movie) for movie in movie_list]
+            ranked, relevance = fuse(selected_movie_ids, method=method,
+                                     exclude=[seed for seed in seeds if seed is not None])
+        with stage('neighbourhood.rerank'):
+            ranked = diversify(ranked[:pool_size].tolist(), relevance[:pool_size], top_n,
+                               content_vectors, diversity)
+        with stage('neighbourhood.titles'):
+            results.append(indices_to_titles(ranked)[:top_n])
+    return results
+
+
+def neighbourhood_model(movie_list, top_n=10):
+    """Performs user-neighbourhood collaborative filtering for a list of movies.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : type
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    return neighbourhood_batch([movie_list], top_n)[0]
+
+
+# Collaborative algorithms selectable for `collab_model`
+ALGORITHMS = {
+    'neighbourhood': neighbourhood_model,
+    'svd': factor_model,
+}
+# Batch counterparts of `ALGORITHMS`, taking many favourite lists at once
+BATCH_ALGORITHMS = {
+    'neighbourhood': neighbourhood_batch,
+    'svd': factor_batch,
+}
+
+
+def set_collab_algorithm(name):
+    """Select the algorithm `collab_model` uses within the current thread.
+
+    Parameters
+    ----------
+    name : str
+        A key of `ALGORITHMS`.
+
+    """
+    if name not in ALGORITHMS:
+        raise ValueError(f"Unknown collaborative algorithm: {name!r}")
+    _selection.name = name
+
+
+def get_collab_algorithm():
+    """Return the algorithm name selected for the current thread."""
+    return getattr(_selection, 'name', DEFAULT_ALGORITHM)
+
+
+def collab_algorithms():
+    """Names of the selectable algorithms, the default first."""
+    return sorted(ALGORITHMS, key=lambda name: name != DEFAULT_ALGORITHM)
+
+
+def _cache_version():
+    """Results change with the data, the merge settings and, for SVD, with the exported factors."""
+    if get_collab_algorithm() == 'svd':
+        return f'{data_version()}{file_version(FACTORS_PATH)}:{DIVERSITY}'
+    return f'{data_version()}:{MERGE_METHOD}:{DIVERSITY}'
 
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@cached_recommender(get_collab_algorithm, _cache_version)
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -115,60 +306,4 @@ def collab_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # get the list of users who highly rated the selected movies
-    # startup problem:
-    # if no users, we recommend the top-n most popular movies in the catalog
-    users_list = highest_rated_users(movie_list)
-    if len(users_list) == 0:
-        top_movies =  ratings_df.groupby('movieId').mean().sort_values(by='rating', ascending=False).index[:top_n].to_list()
-        top_n_titles = indices_to_titles(top_movies)
-        return top_n_titles
-    # from here, we have a populated users list
-    # select an initial refetrence user
-    collected_scores = []
-    for user in users_list:
-        temp_scores = []
-        # extract similarity value between the reference user and all users excluding same
-        # first get the users vector
-        ref_vector = util_matrix_norm.iloc[user].to_numpy()
-        # then get the vector for all the users and do similarity computation
-        for index, rows in util_matrix_norm.iterrows():
-            if index != user:
-                subset_user_vector = rows.to_numpy()
-                sim_score = np.dot(ref_vector, subset_user_vector)/(norm(ref_vector)*norm(subset_user_vector))
-                temp_scores.append((sim_score, user))
-        # sort the large list to the first 20
-        twenty_highest = heapq.nlargest(20, temp_scores, key=lambda t: t[0])
-        collected_scores = collected_scores + twenty_highest
-    # we now sort the collected scores from all the users again to give the top_n
-    collected_scores.sort(key=lambda x : x[0], reverse=True)
-    # in collected scores, we have repeated users because we are dealing with several reference users
-    # we now collect all the users
-    selected_users = []
-    for score, user in collected_scores: 
-        if user not in selected_users:
-            selected_users.append(user)
-    # collect the top rated items of the selected users
-    selected_movie_ids = []       
-    for user in selected_users:
-        user_df = ratings_df[ratings_df['userId'] == user].sort_values(by='rating', ascending=False)
-        idx_movies = user_df['movieId'].values[:20].tolist()
-        selected_movie_ids = selected_movie_ids + idx_movies
-    # now we will do a tally of popularity of the movie_ids
-    fav_movie_dict = {}
-    for movie in selected_movie_ids:
-        if movie in fav_movie_dict:
-            fav_movie_dict[movie] += 1
-        else:
-            fav_movie_dict[movie] = 1
-    # we now sort the favorite movies and select the ten best
-    sorted_favs = sorted(fav_movie_dict.items(), key=lambda x: x[1], reverse=True)
-    #top_movies = sorted_favs[:top_n]
-    top_movies_list = []
-    for movieid, freq in sorted_favs:
-        top_movies_list.append(movieid)    
-    top_n_titles2 = indices_to_titles(top_movies_list)
-    return top_n_titles2[:top_n]    
-
-
-    
\ No newline at end of file
+    return ALGORITHMS[get_collab_algorithm()](movie_list, top_n)
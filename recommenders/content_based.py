@@ -29,43 +29,89 @@
 
 # Script dependencies
 import os
-import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-import heapq
-from numpy.linalg import norm
-from sklearn.feature_extraction.text import TfidfVectorizer 
-
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
-titles = movies['title']
-indices = pd.Series(movies.index, index=movies['title'])
-
-def data_preprocessing(subset_size):
-    """Prepare data for use within Content filtering algorithm.
+
+# `content_state` is the process-wide index, shared with the re-ranking of
+# the collaborative recommenders
+from recommenders.content_index import INDEX_PATH, content_state
+from utils.catalog import load_catalog
+from utils.data_loader import data_version
+from utils.instrumentation import count, stage
+from utils.rerank import DIVERSITY, fuse, mmr, mmr_pool_size
+from utils.result_cache import cached_recommender, file_version
+
+# Minimum number of neighbours pooled per chosen movie
+N_CANDIDATES = 20
+# How the neighbour lists of the chosen movies are merged ('max', 'sum' or 'rrf')
+MERGE_METHOD = os.environ.get('EDSA_CONTENT_MERGE', 'max')
+
+def _cache_version():
+    """Results change with the data, every rebuild of the index and the merge settings."""
+    return f'{data_version()}{file_version(INDEX_PATH)}:{MERGE_METHOD}:{DIVERSITY}'
+
+def content_batch(movie_lists, top_n=10, method=MERGE_METHOD, diversity=DIVERSITY):
+    """Content-based recommendations for many favourite lists at once.
+
+    Gives the same result as `content_model` for every list, but gathers
+    the neighbours of all lists together. The neighbour lists of a
+    query's movies are merged with `utils.rerank.fuse`: a movie appears at
+    most once and the chosen movies themselves are never recommended.
 
     Parameters
     ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+    movie_lists : list (list (str))
+        Favourite movie titles of every query.
+    top_n : int
+        Number of recommendations per query.
+    method : str
+        How the scores of a movie found by several chosen movies are
+        merged: 'max', 'sum' or 'rrf'.
+    diversity : float
+        MMR weight of diversity against similarity; 0 disables MMR.
 
     Returns
     -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
+    list (list (str))
+        Titles of the top-n recommendations of every query.
 
     """
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    # Subset of the data
-    movies_subset = movies[:subset_size]
-    return movies_subset
+    content_index = content_state()
+    catalog = load_catalog()
+    n_queries = len(movie_lists)
+    width = max([len(movie_list) for movie_list in movie_lists] + [1])
+    with stage('content.lookup'):
+        # index rows of the chosen movies; -1 for unknown titles
+        rows = np.full((n_queries, width), -1, dtype=np.intp)
+        for query, movie_list in enumerate(movie_lists):
+            for position, item in enumerate(movie_list):
+                movie_idx = content_index.row_of.get(catalog.movie_id(item))
+                if movie_idx is not None:
+                    rows[query, position] = movie_idx
+    pool_size = mmr_pool_size(top_n, diversity)
+    # enough neighbours per movie to fill the pool even when the other
+    # chosen movies are among them
+    n_candidates = max(N_CANDIDATES, pool_size + width)
+    with stage('content.candidates'):
+        # neighbours of each query's movies; empty slots (unknown titles,
+        # or gaps left by approximate indexes) are -1
+        candidate_rows, candidate_scores = content_index.neighbours_batch(rows, n_candidates)
+    count('content.candidates', int((candidate_rows >= 0).sum()))
+    results = []
+    for query in range(n_queries):
+        with stage('content.rank'):
+            ranked, relevance = fuse(candidate_rows[query], candidate_scores[query], method,
+                                     exclude=rows[query][rows[query] >= 0])
+            ranked, relevance = ranked[:pool_size], relevance[:pool_size]
+            if diversity > 0:
+                picked = mmr(relevance, content_index.features[ranked], top_n, diversity)
+                ranked = ranked[picked]
+        with stage('content.titles'):
+            results.append(content_index.titles[ranked[:top_n]].tolist())
+    return results
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@cached_recommender('content', _cache_version)
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -83,41 +129,4 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # tfidf was added !!!!!
-    # Instantiating and generating the count matrix
-    tf = TfidfVectorizer(analyzer='word', min_df=0, stop_words='english', max_features = 10000)
-    # Produce a feature matrix, where each row corresponds to a book,
-    # with TF-IDF features as columns 
-    count_matrix = tf.fit_transform(data['keyWords'])
-    sparse_df = pd.DataFrame(count_matrix.toarray(), columns=tf.get_feature_names_out())
-    # get the indices of the chosen movies
-    movie_one_idx = indices[movie_list[0]]
-    movie_two_idx = indices[movie_list[1]]
-    movie_three_idx = indices[movie_list[2]]
-    # do the similarity matrix for each movie and other movies
-    final_scores = []
-    for item in movie_list:
-        temp_scores = []
-        movie_idx = indices[item]
-        # get the movie vector
-        movie_vector = sparse_df.iloc[movie_idx].to_numpy()
-        # get all the rows of the data frame
-        for index, rows in sparse_df.iterrows():
-            if movie_idx != index:
-                # get the vector for that row
-                ref_vector = rows.to_numpy()
-                # do the similarity score
-                sim_score = np.dot(ref_vector, movie_vector)/(norm(ref_vector)*norm(movie_vector)) 
-                temp_scores.append((sim_score, index))
-        # get the 10 highest ratings 
-        five_highest = heapq.nlargest(20, temp_scores, key=lambda t: t[0])
-        final_scores = final_scores + five_highest
-    # sort the final scores to get the top 15 movies
-    final_scores.sort(key=lambda x : x[0], reverse=True)
-    # get the movie titles from the final_scores list and put in a list
-    top_titles = [  indices[indices == indice].index[0] for scores, indice in final_scores]
-    return top_titles[:top_n]
-    
\ No newline at end of file
+    return content_batch([movie_list], top_n)[0]
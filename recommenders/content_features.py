@@ -0,0 +1,244 @@
+"""
+
+    Streaming, stateless content features for the movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Encodes every movie's genres, title words, release year
+    (and decade) and, when a MovieLens `tags.csv` is available, its user
+    tags into one sparse vector with the hashing trick: every
+    `field:token` pair is hashed straight to a column, so there is no
+    vocabulary to fit and rows can be encoded chunk by chunk. The movies
+    (and tags) files are read in chunks, so catalogues of any size are
+    encoded with memory bounded by the output matrix.
+
+    Each field is L2-normalised on its own and weighted by
+    `FIELD_WEIGHTS` before the row is normalised, so that genres and tags
+    decide the neighbours and titles cannot drown them out.
+
+"""
+# Script dependencies
+import hashlib
+import json
+import os
+import re
+import zlib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from utils.data_loader import MOVIES_PATH, file_checksum, load_columns
+
+# Location of the optional MovieLens tags file (userId, movieId, tag, timestamp)
+TAGS_PATH = os.environ.get('EDSA_TAGS_PATH', 'resources/data/tags.csv')
+# Number of hashed feature columns (a power of two). Collisions are rare
+# at this size, and the dense structures of `recommenders.ann` (LSH planes,
+# IVF centroids) stay small.
+N_FEATURES = 2 ** 15
+# Relative weight of every field within a movie's vector. Titles and years
+# only break ties between movies of similar genres and tags (sequels, the
+# same era): a short title is a single, fully weighted token, so a higher
+# weight turns neighbours into title-word matches.
+FIELD_WEIGHTS = {'genres': 1.0, 'title': 0.1, 'year': 0.15, 'tags': 0.8}
+# Rows read per chunk
+CHUNK_SIZE = 20000
+# Bump when tokenisation or hashing changes
+FEATURES_FORMAT = 1
+
+# Words carrying no content in titles and tags
+STOP_WORDS = frozenset("""
+a an and are as at be by de der die for from in is it la le les of on or the to with
+""".split())
+_TOKEN = re.compile(r'\w\w+')
+_YEAR = re.compile(r'\((\d{4})\)\s*$')
+
+
+def title_tokens(title):
+    """Lower-cased title words, without the year and stop words."""
+    title = _YEAR.sub('', title)
+    return [token for token in _TOKEN.findall(title.lower()) if token not in STOP_WORDS]
+
+
+def year_tokens(title):
+    """Release year and decade tokens parsed from a 'Title (1995)' string."""
+    match = _YEAR.search(title)
+    if match is None:
+        return []
+    year = int(match.group(1))
+    return [str(year), f'{year // 10 * 10}s']
+
+
+def genre_tokens(genres):
+    """Genres of a '|'-joined genres field."""
+    return [genre for genre in genres.split('|') if genre and genre != '(no genres listed)']
+
+
+def tag_tokens(tag):
+    """Lower-cased words of a user tag."""
+    return [token for token in _TOKEN.findall(str(tag).lower()) if token not in STOP_WORDS]
+
+
+def hash_token(field, token, n_features=N_FEATURES):
+    """Column and sign of a `field:token` pair (stable across processes)."""
+    digest = zlib.crc32(f'{field}:{token}'.encode('utf-8'))
+    return digest % n_features, 1.0 if digest & 0x80000000 else -1.0
+
+
+def hash_rows(token_lists, field, n_features=N_FEATURES):
+    """Hash one field of many rows into a sparse (signed) count matrix.
+
+    Parameters
+    ----------
+    token_lists : list (list (str))
+        Tokens of every row.
+    field : str
+        Field name, part of every hashed key.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        float32 matrix of shape (len(token_lists), n_features).
+
+    """
+    indptr = [0]
+    indices = []
+    data = []
+    for tokens in token_lists:
+        for token in tokens:
+            column, sign = hash_token(field, token, n_features)
+            indices.append(column)
+            data.append(sign)
+        indptr.append(len(indices))
+    matrix = sp.csr_matrix((np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32),
+                            np.asarray(indptr, dtype=np.int64)), shape=(len(token_lists), n_features))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def normalise_rows(matrix):
+    """Scale every non-empty row of a CSR matrix to unit L2 norm."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.csr_matrix(sp.diags(1.0 / norms) @ matrix, dtype=np.float32)
+
+
+def read_tag_features(tags_path=TAGS_PATH, n_features=N_FEATURES, chunk_size=CHUNK_SIZE * 10):
+    """Stream a tags file into per-movie hashed tag vectors.
+
+    Repeated tags are damped as log(1 + count).
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix or None
+        One row per movieId (row m describes movieId m); None when the
+        file does not exist.
+
+    """
+    if not tags_path or not os.path.exists(tags_path):
+        return None
+    rows, cols, data = [], [], []
+    for chunk in pd.read_csv(tags_path, usecols=['movieId', 'tag'], chunksize=chunk_size):
+        chunk = chunk.dropna()
+        block = hash_rows([tag_tokens(tag) for tag in chunk['tag'].tolist()], 'tags',
+                          n_features).tocoo()
+        rows.append(chunk['movieId'].to_numpy(dtype=np.int64)[block.row])
+        cols.append(block.col)
+        data.append(block.data)
+    rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+    if len(rows) == 0:
+        return None
+    # signed token counts per movie, damped as sign * log(1 + count)
+    counts = sp.csr_matrix((np.concatenate(data), (rows, np.concatenate(cols))),
+                           shape=(int(rows.max()) + 1, n_features))
+    counts.sum_duplicates()
+    counts.data = (np.sign(counts.data) * np.log1p(np.abs(counts.data))).astype(np.float32)
+    counts.eliminate_zeros()
+    return counts
+
+
+def encode_movies(movies, tag_features=None, n_features=N_FEATURES, weights=FIELD_WEIGHTS):
+    """Encode a chunk of movies into weighted, L2-normalised hashed vectors.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movies with `movieId`, `title` and `genres` columns.
+    tag_features : scipy.sparse.csr_matrix, optional
+        Per-movieId tag vectors from `read_tag_features`.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        float32 matrix with one row per movie.
+
+    """
+    titles = movies['title'].tolist()
+    fields = {'genres': hash_rows([genre_tokens(genres) for genres in movies['genres'].tolist()],
+                                  'genres', n_features),
+              'title': hash_rows([title_tokens(title) for title in titles], 'title', n_features),
+              'year': hash_rows([year_tokens(title) for title in titles], 'year', n_features)}
+    if tag_features is not None:
+        movie_ids = movies['movieId'].to_numpy(dtype=np.int64)
+        known = movie_ids < tag_features.shape[0]
+        tags = sp.csr_matrix((len(movies), n_features), dtype=np.float32)
+        if known.any():
+            selector = sp.csr_matrix((np.ones(known.sum(), dtype=np.float32),
+                                      (np.flatnonzero(known), movie_ids[known])),
+                                     shape=(len(movies), tag_features.shape[0]))
+            tags = sp.csr_matrix(selector @ tag_features)
+        fields['tags'] = tags
+    combined = sum(normalise_rows(matrix) * weights.get(field, 1.0) for field, matrix in fields.items())
+    return normalise_rows(sp.csr_matrix(combined))
+
+
+def read_movies(movies_path=MOVIES_PATH, chunk_size=CHUNK_SIZE):
+    """Stream the complete rows of the movies file in chunks."""
+    for chunk in pd.read_csv(movies_path, chunksize=chunk_size,
+                             dtype={'title': str, 'genres': str}):
+        yield chunk.dropna()
+
+
+def features_version(movies_path=MOVIES_PATH, tags_path=TAGS_PATH, n_features=N_FEATURES,
+                     weights=FIELD_WEIGHTS):
+    """Identifier of the inputs and settings the features depend on."""
+    tags = file_checksum(tags_path) if tags_path and os.path.exists(tags_path) else None
+    key = json.dumps([FEATURES_FORMAT, load_columns(movies_path, 'movies')[1], tags, n_features,
+                      sorted(weights.items())])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def build_features(movies_path=MOVIES_PATH, tags_path=TAGS_PATH, n_features=N_FEATURES,
+                   weights=FIELD_WEIGHTS, chunk_size=CHUNK_SIZE):
+    """Encode the whole movies file, chunk by chunk.
+
+    Parameters
+    ----------
+    movies_path : str
+        Movies .csv file with `movieId`, `title` and `genres` columns;
+        rows with missing values are skipped.
+    tags_path : str
+        Optional tags .csv file; ignored when it does not exist.
+    n_features : int
+        Number of hashed columns.
+    weights : dict (str, float)
+        Weight of every field.
+    chunk_size : int
+        Movies encoded per chunk.
+
+    Returns
+    -------
+    tuple
+        (features csr_matrix, movie ids, titles), one row per movie in
+        file order.
+
+    """
+    tag_features = read_tag_features(tags_path, n_features)
+    blocks, movie_ids, titles = [], [], []
+    for chunk in read_movies(movies_path, chunk_size):
+        blocks.append(encode_movies(chunk, tag_features, n_features, weights))
+        movie_ids.append(chunk['movieId'].to_numpy(dtype=np.int64))
+        titles.append(chunk['title'].to_numpy(dtype=str))
+    if not blocks:
+        return sp.csr_matrix((0, n_features), dtype=np.float32), np.empty(0, np.int64), np.empty(0, str)
+    return (sp.csr_matrix(sp.vstack(blocks), dtype=np.float32), np.concatenate(movie_ids),
+            np.concatenate(titles))
@@ -0,0 +1,340 @@
+"""
+
+    Precomputed item-item similarity index for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds the hashed content features of the whole movie
+    catalogue once (see `recommenders.content_features`), together with a
+    table of the top-K most similar movies for every movie, and persists
+    both to disk. `content_model` then only needs to look up and merge
+    neighbour lists at request time. The index has to be rebuilt whenever
+    the movies or tags files, or the feature settings, change. Building
+    it is an offline step, so the app never blocks on it: until the
+    rebuild, the previous index is served with a warning.
+
+    The index can be (re)built from the command line with:
+
+        python -m recommenders.content_index [lsh|ivf]
+
+    where the optional argument fills the neighbour table from an
+    approximate index instead of the exact scan.
+
+"""
+# Script dependencies
+import logging
+import os
+import sys
+import threading
+import numpy as np
+import scipy.sparse as sp
+
+from recommenders.content_features import TAGS_PATH, build_features, features_version
+from utils.data_loader import MODELS_DIR, MOVIES_PATH
+from utils.ranking import top_k_rows
+from utils.startup import lazy_singleton
+
+# Default location of the persisted index
+INDEX_PATH = os.path.join(MODELS_DIR, 'content_index.npz')
+# Number of neighbours stored per movie
+N_NEIGHBOURS = 50
+# Number of movies whose similarities are computed at once
+BLOCK_SIZE = 512
+
+# Serialises one-off builds of a missing index
+_build_lock = threading.Lock()
+
+
+def build_neighbour_table(features, n_neighbours=N_NEIGHBOURS, block_size=BLOCK_SIZE, ann_index=None):
+    """Compute the most similar movies for every row of a feature matrix.
+
+    Rows are expected to be L2-normalised so that the dot product equals
+    the cosine similarity. Similarities are computed block by block to keep
+    memory bounded. A movie is never its own neighbour, and movies sharing
+    no feature with it (similarity <= 0) are not neighbours either: rows
+    with fewer similar movies are padded with -1 and a score of -inf.
+
+    For catalogues too large for the exact O(n^2) scan, pass an
+    `ann_index` (see `recommenders.ann`) built over `features`; rows it
+    cannot fill are padded the same way.
+
+    Parameters
+    ----------
+    features : scipy.sparse.csr_matrix
+        L2-normalised feature matrix.
+    n_neighbours : int
+        Number of neighbours to keep per movie.
+    block_size : int
+        Number of rows scored per sparse matrix product.
+    ann_index : ANNIndex, optional
+        Approximate index used instead of the exact scan.
+
+    Returns
+    -------
+    tuple (np.ndarray, np.ndarray)
+        int32 neighbour rows and float32 similarity scores, both of shape
+        (n_movies, n_neighbours), ordered by descending similarity.
+
+    """
+    n_movies = features.shape[0]
+    n_neighbours = min(n_neighbours, max(n_movies - 1, 0))
+    neighbours = np.zeros((n_movies, n_neighbours), dtype=np.int32)
+    scores = np.zeros((n_movies, n_neighbours), dtype=np.float32)
+    if ann_index is not None:
+        neighbours[:] = -1
+        scores[:] = -np.inf
+        for row in range(n_movies):
+            found, similarities = ann_index.query(features[row], n_neighbours, exclude=row)
+            neighbours[row, :len(found)] = found
+            scores[row, :len(found)] = similarities
+        return neighbours, scores
+    features_t = features.T.tocsc()
+    for start in range(0, n_movies, block_size):
+        stop = min(start + block_size, n_movies)
+        block = (features[start:stop] @ features_t).toarray()
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        neighbours[start:stop], scores[start:stop] = _take_top(block, n_neighbours)
+    return neighbours, scores
+
+
+def _take_top(block, k):
+    """Top-k positive similarities of every row of a dense block, -1/-inf padded."""
+    top = top_k_rows(block, k, floor=0.0)
+    found = top >= 0
+    return top, np.where(found, np.take_along_axis(block, np.where(found, top, 0), axis=1), -np.inf)
+
+
+class ContentIndex:
+    """Sparse content features plus a top-K neighbour table per movie.
+
+    Attributes
+    ----------
+    features : scipy.sparse.csr_matrix
+        L2-normalised hashed feature matrix, one row per movie.
+    neighbours : np.ndarray
+        int32 array of neighbour rows, shape (n_movies, K).
+    scores : np.ndarray
+        float32 cosine similarities matching `neighbours`.
+    titles : np.ndarray
+        Movie title for every row.
+    movie_ids : np.ndarray
+        movieId of every row.
+    version : str
+        `features_version` of the inputs the index was built from.
+
+    """
+
+    def __init__(self, features, neighbours, scores, titles, movie_ids, version=''):
+        self.features = features
+        self.neighbours = neighbours
+        self.scores = scores
+        self.titles = np.asarray(titles)
+        self.movie_ids = np.asarray(movie_ids)
+        self.version = version
+        self._features_t = None
+        self.row_of = {}
+        for row, movie_id in enumerate(self.movie_ids.tolist()):
+            self.row_of.setdefault(movie_id, row)
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def neighbours_of(self, row, k):
+        """Return the k nearest neighbour rows and their similarities."""
+        return self.neighbours[row, :k], self.scores[row, :k]
+
+    def neighbours_batch(self, rows, k, block_size=BLOCK_SIZE):
+        """Return the k nearest neighbours of many rows at once.
+
+        Reads the neighbour table when it is wide enough and otherwise
+        scans the features exactly, block by block.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            Query rows of any shape; -1 marks a missing query.
+        k : int
+            Number of neighbours per row.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            Neighbour rows (-1 for empty slots) and similarities (-inf for
+            empty slots), both of shape `rows.shape + (k,)`.
+
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        flat = rows.ravel()
+        neighbours = np.full((len(flat), k), -1, dtype=np.int32)
+        scores = np.full((len(flat), k), -np.inf, dtype=np.float32)
+        found = np.flatnonzero(flat >= 0)
+        if k <= self.neighbours.shape[1]:
+            neighbours[found] = self.neighbours[flat[found], :k]
+            scores[found] = self.scores[flat[found], :k]
+        else:
+            if self._features_t is None:
+                self._features_t = self.features.T.tocsc()
+            width = min(k, max(len(self) - 1, 0))
+            for start in range(0, len(found), block_size):
+                queries = found[start:start + block_size]
+                block = (self.features[flat[queries]] @ self._features_t).toarray()
+                block[np.arange(len(queries)), flat[queries]] = -np.inf
+                neighbours[queries, :width], scores[queries, :width] = _take_top(block, width)
+        return neighbours.reshape(rows.shape + (k,)), scores.reshape(rows.shape + (k,))
+
+    def vectors_for(self, movie_ids):
+        """Feature rows of the given movie ids; all-zero rows for unknown ids."""
+        rows = [self.row_of.get(movie_id, -1) for movie_id in movie_ids]
+        known = np.flatnonzero(np.asarray(rows) >= 0)
+        selector = sp.csr_matrix((np.ones(len(known), dtype=np.float32),
+                                  (known, np.asarray(rows, dtype=np.intp)[known])),
+                                 shape=(len(rows), len(self)))
+        return selector @ self.features
+
+    def save(self, path=INDEX_PATH):
+        """Persist the index as a single compressed .npz archive.
+
+        The archive is written next to `path` and then renamed, so readers
+        never see a partly written index.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        root, extension = os.path.splitext(path)
+        partial = f'{root}.partial{extension or ".npz"}'
+        np.savez_compressed(partial,
+                            data=self.features.data,
+                            indices=self.features.indices,
+                            indptr=self.features.indptr,
+                            shape=np.asarray(self.features.shape),
+                            neighbours=self.neighbours,
+                            scores=self.scores,
+                            titles=self.titles.astype(str),
+                            movie_ids=self.movie_ids,
+                            version=np.asarray(self.version))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """Load an index previously written with `save`; None if outdated."""
+        with np.load(path, allow_pickle=False) as archive:
+            if 'movie_ids' not in archive.files:
+                return None
+            features = sp.csr_matrix((archive['data'], archive['indices'], archive['indptr']),
+                                     shape=tuple(archive['shape']))
+            return cls(features, archive['neighbours'], archive['scores'], archive['titles'],
+                       archive['movie_ids'], str(archive['version']))
+
+
+def build_content_index(n_neighbours=N_NEIGHBOURS, ann_kind=None, movies_path=MOVIES_PATH,
+                        tags_path=TAGS_PATH):
+    """Build a content index over the whole movie catalogue.
+
+    Parameters
+    ----------
+    n_neighbours : int
+        Number of neighbours to keep per movie.
+    ann_kind : str, optional
+        'lsh' or 'ivf' to fill the neighbour table from an approximate
+        index instead of the exact scan.
+    movies_path, tags_path : str
+        Movies and (optional) tags files to encode.
+
+    Returns
+    -------
+    ContentIndex
+        The freshly built index.
+
+    """
+    features, movie_ids, titles = build_features(movies_path, tags_path)
+    ann_index = None
+    if ann_kind is not None:
+        from recommenders.ann import INDEX_KINDS
+        ann_index = INDEX_KINDS[ann_kind]().build(features)
+    neighbours, scores = build_neighbour_table(features, n_neighbours, ann_index=ann_index)
+    return ContentIndex(features, neighbours, scores, titles, movie_ids,
+                        features_version(movies_path, tags_path))
+
+
+def content_index_ready(path=INDEX_PATH):
+    """Whether a usable (if possibly stale) index exists at `path`."""
+    if not os.path.exists(path):
+        return False
+    with np.load(path, allow_pickle=False) as archive:
+        return 'movie_ids' in archive.files
+
+
+def ensure_content_index(path=INDEX_PATH):
+    """Build and save the index once if there is no usable one at `path`.
+
+    Meant for startup and warm-up on a fresh checkout, so that no request
+    ever waits for the build; a stale index is left for the offline
+    rebuild.
+
+    Returns
+    -------
+    bool
+        Whether the index was built.
+
+    """
+    with _build_lock:
+        if content_index_ready(path):
+            return False
+        logging.getLogger(__name__).warning(
+            "No content index at %s; building it now (this takes a few minutes)", path)
+        build_content_index().save(path)
+        return True
+
+
+def load_content_index(path=INDEX_PATH):
+    """Load the persisted content index.
+
+    Building the index takes minutes on the full catalogue, so it is never
+    done on demand: run `python -m recommenders.content_index` offline, or
+    let the app or service build a missing one at startup
+    (`ensure_content_index`).
+    An index built from older movies or tags files (or feature settings)
+    is still served, with a warning, until it is rebuilt.
+
+    Parameters
+    ----------
+    path : str
+        Location of the persisted index.
+
+    Returns
+    -------
+    ContentIndex
+        The persisted index.
+
+    """
+    index = ContentIndex.load(path) if os.path.exists(path) else None
+    if index is None:
+        raise FileNotFoundError(f"No usable content index found at {path}; "
+                                "build it with `python -m recommenders.content_index`")
+    if index.version != features_version():
+        logging.getLogger(__name__).warning(
+            "Content index at %s is stale (movies, tags or feature settings changed); "
+            "serving it until it is rebuilt with `python -m recommenders.content_index`", path)
+    return index
+
+
+@lazy_singleton
+def content_state():
+    """Load the precomputed content features and neighbour table on first use.
+
+    Returns
+    -------
+    ContentIndex
+        The persisted index; it covers the whole catalogue.
+
+    """
+    return load_content_index()
+
+
+def content_vectors(movie_ids):
+    """Content feature rows of the given movie ids (see `ContentIndex.vectors_for`)."""
+    return content_state().vectors_for(movie_ids)
+
+
+if __name__ == '__main__':
+    content_index = build_content_index(ann_kind=sys.argv[1] if len(sys.argv) > 1 else None)
+    content_index.save(INDEX_PATH)
+    print(f"Content index with {len(content_index)} movies saved to: {INDEX_PATH}")
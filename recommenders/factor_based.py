@@ -0,0 +1,456 @@
+"""
+
+    Matrix-factorisation (SVD) collaborative filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Serves recommendations from the item factors of the SVD
+    model trained by `resources/models/train_colbased.py` (with surprise or
+    the in-repo ALS trainer of `recommenders.als`). The three
+    favourite movies are folded in as a pseudo-user by solving a small
+    ridge regression against their item factors, after which the whole
+    catalogue is scored with a single matrix-vector product and a partial
+    sort.
+
+    The surprise model is only needed once, to export the compact factor
+    arrays used at serving time:
+
+        python -m recommenders.factor_based export
+        python -m recommenders.factor_based compare
+
+"""
+# Script dependencies
+import os
+import pickle
+import sys
+import time
+import numpy as np
+
+from utils.catalog import load_catalog
+from utils.data_loader import MODELS_DIR
+from utils.instrumentation import count, stage
+from utils.ranking import top_k_rows
+from utils.rerank import DIVERSITY, diversify, mmr_pool_size
+from utils.startup import lazy_singleton
+
+# Pickled surprise.SVD model written by the training script
+SVD_PATH = os.path.join(MODELS_DIR, 'SVD.pkl')
+# Exported item factors used at serving time
+FACTORS_PATH = os.path.join(MODELS_DIR, 'svd_factors.npz')
+# Ridge penalty used when folding in the favourite movies
+FOLD_IN_REG = 0.1
+# SGD settings used when folding in new ratings (as in train_colbased.py)
+SGD_EPOCHS = 5
+SGD_LR = 0.005
+SGD_REG = 0.02
+SGD_INIT_STD = 0.05
+# Favourite sets scored per matrix product in batch recommendation
+BATCH_SIZE = 256
+
+
+class FactorModel:
+    """Item factors and biases of a trained SVD model.
+
+    Attributes
+    ----------
+    movie_ids : np.ndarray
+        Movie id of every row of `item_factors`.
+    item_factors : np.ndarray
+        float32 matrix of shape (n_movies, n_factors).
+    item_biases : np.ndarray
+        float32 bias of every movie.
+    global_mean : float
+        Mean rating of the training data.
+    rating_max : float
+        Highest rating on the training scale, assumed for favourites.
+    user_ids, user_factors, user_biases : np.ndarray
+        User side of the model; only needed to fold in new ratings.
+
+    """
+
+    def __init__(self, movie_ids, item_factors, item_biases, global_mean, rating_max=5.0,
+                 user_ids=None, user_factors=None, user_biases=None):
+        self.movie_ids = np.asarray(movie_ids)
+        self.item_factors = np.asarray(item_factors, dtype=np.float32)
+        self.item_biases = np.asarray(item_biases, dtype=np.float32)
+        self.global_mean = float(global_mean)
+        self.rating_max = float(rating_max)
+        self.row_of = {movie_id: row for row, movie_id in enumerate(self.movie_ids.tolist())}
+        n_factors = self.item_factors.shape[1]
+        self.user_ids = np.asarray(user_ids if user_ids is not None else [], dtype=np.int64)
+        self.user_factors = np.asarray(user_factors if user_factors is not None
+                                       else np.zeros((0, n_factors)), dtype=np.float32)
+        self.user_biases = np.asarray(user_biases if user_biases is not None else [],
+                                      dtype=np.float32)
+        self.user_row_of = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
+
+    @classmethod
+    def from_surprise(cls, algo):
+        """Extract the serving arrays from a fitted surprise.SVD."""
+        trainset = algo.trainset
+        movie_ids = np.array([trainset.to_raw_iid(inner) for inner in range(trainset.n_items)])
+        user_ids = np.array([trainset.to_raw_uid(inner) for inner in range(trainset.n_users)])
+        return cls(movie_ids, algo.qi, algo.bi, trainset.global_mean, trainset.rating_scale[1],
+                   user_ids, algo.pu, algo.bu)
+
+    def save(self, path=FACTORS_PATH):
+        """Persist the factor arrays as an .npz archive."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, movie_ids=self.movie_ids, item_factors=self.item_factors,
+                 item_biases=self.item_biases,
+                 scalars=np.array([self.global_mean, self.rating_max]),
+                 user_ids=self.user_ids, user_factors=self.user_factors,
+                 user_biases=self.user_biases)
+
+    @classmethod
+    def load(cls, path=FACTORS_PATH):
+        """Load factor arrays written with `save`."""
+        with np.load(path, allow_pickle=False) as archive:
+            global_mean, rating_max = archive['scalars']
+            user_side = [archive[name] if name in archive else None
+                         for name in ('user_ids', 'user_factors', 'user_biases')]
+            return cls(archive['movie_ids'], archive['item_factors'], archive['item_biases'],
+                       global_mean, rating_max, *user_side)
+
+    def _rows_for(self, ids, side, rng):
+        """Rows of the given ids, appending freshly initialised rows for new ids."""
+        row_of = self.row_of if side == 'item' else self.user_row_of
+        new_ids = [value for value in dict.fromkeys(ids.tolist()) if value not in row_of]
+        if new_ids:
+            n_factors = self.item_factors.shape[1]
+            factors = rng.normal(0, SGD_INIT_STD, (len(new_ids), n_factors)).astype(np.float32)
+            if side == 'item':
+                start = len(self.movie_ids)
+                self.movie_ids = np.concatenate([self.movie_ids, new_ids]).astype(self.movie_ids.dtype)
+                self.item_factors = np.vstack([self.item_factors, factors])
+                self.item_biases = np.concatenate([self.item_biases, np.zeros(len(new_ids), np.float32)])
+            else:
+                start = len(self.user_ids)
+                self.user_ids = np.concatenate([self.user_ids, new_ids]).astype(self.user_ids.dtype)
+                self.user_factors = np.vstack([self.user_factors, factors])
+                self.user_biases = np.concatenate([self.user_biases, np.zeros(len(new_ids), np.float32)])
+            row_of.update((value, start + offset) for offset, value in enumerate(new_ids))
+        return np.array([row_of[value] for value in ids.tolist()], dtype=np.intp)
+
+    def partial_fit(self, user_ids, movie_ids, ratings, n_epochs=SGD_EPOCHS, lr=SGD_LR,
+                    reg=SGD_REG, seed=0):
+        """Fold new ratings into the model with a few SGD epochs.
+
+        Only the factors and biases of the users and movies appearing in
+        the batch are updated, using the same update rule as surprise.SVD.
+        Unknown users and movies are added with randomly initialised
+        factors.
+
+        Parameters
+        ----------
+        user_ids, movie_ids, ratings : np.ndarray
+            Parallel arrays describing the new ratings.
+        n_epochs : int
+            Passes over the batch.
+        lr, reg : float
+            Learning rate and regularisation.
+        seed : int
+            Seed for initialisation and shuffling.
+
+        """
+        rng = np.random.default_rng(seed)
+        users = self._rows_for(np.asarray(user_ids), 'user', rng)
+        items = self._rows_for(np.asarray(movie_ids), 'item', rng)
+        ratings = np.asarray(ratings, dtype=np.float32)
+        pu, qi = self.user_factors, self.item_factors
+        bu, bi = self.user_biases, self.item_biases
+        for _ in range(n_epochs):
+            for index in rng.permutation(len(ratings)):
+                u, i = users[index], items[index]
+                err = ratings[index] - (self.global_mean + bu[u] + bi[i] + qi[i] @ pu[u])
+                bu[u] += lr * (err - reg * bu[u])
+                bi[i] += lr * (err - reg * bi[i])
+                user_factor = pu[u].copy()
+                pu[u] += lr * (err * qi[i] - reg * pu[u])
+                qi[i] += lr * (err * user_factor - reg * qi[i])
+
+    def predict(self, user_ids, movie_ids):
+        """Estimate ratings for parallel arrays of user and movie ids.
+
+        Unknown users or movies contribute neither factors nor a bias, so
+        a completely unknown pair is predicted as the global mean.
+
+        Returns
+        -------
+        np.ndarray
+            float64 rating estimates (not clipped to the rating scale).
+
+        """
+        users = np.array([self.user_row_of.get(user_id, -1) for user_id in np.asarray(user_ids).tolist()],
+                         dtype=np.intp)
+        items = np.array([self.row_of.get(movie_id, -1) for movie_id in np.asarray(movie_ids).tolist()],
+                         dtype=np.intp)
+        known_user, known_item = users >= 0, items >= 0
+        estimates = np.full(len(users), self.global_mean)
+        estimates[known_user] += self.user_biases[users[known_user]]
+        estimates[known_item] += self.item_biases[items[known_item]]
+        both = known_user & known_item
+        estimates[both] += np.einsum('ij,ij->i', self.user_factors[users[both]],
+                                     self.item_factors[items[both]])
+        return estimates
+
+    def fold_in(self, rows, ratings=None, reg=FOLD_IN_REG):
+        """Estimate a user factor vector from a few rated movies.
+
+        Solves min_p sum_i (r_i - mu - b_i - q_i.p)^2 + reg * |p|^2 over the
+        given rows.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            Factor rows of the rated movies.
+        ratings : np.ndarray, optional
+            Ratings of those movies; defaults to the top of the scale.
+        reg : float
+            Ridge penalty.
+
+        Returns
+        -------
+        np.ndarray
+            float32 pseudo-user factor vector.
+
+        """
+        if len(rows) == 0:
+            return np.zeros(self.item_factors.shape[1], dtype=np.float32)
+        if ratings is None:
+            ratings = np.full(len(rows), self.rating_max)
+        factors = self.item_factors[rows].astype(np.float64)
+        residuals = np.asarray(ratings) - self.global_mean - self.item_biases[rows]
+        # Solve in the (small) dual form: p = Q^T (Q Q^T + reg I)^-1 r
+        gram = factors @ factors.T + reg * np.eye(len(rows))
+        return (factors.T @ np.linalg.solve(gram, residuals)).astype(np.float32)
+
+    def fold_in_batch(self, row_lists, reg=FOLD_IN_REG):
+        """Fold in many favourite sets at once (see `fold_in`).
+
+        The sets are padded to a common length with zero factor rows,
+        which leave each regression unchanged, and solved together.
+
+        Parameters
+        ----------
+        row_lists : list (np.ndarray)
+            Factor rows of the favourite movies of every set.
+        reg : float
+            Ridge penalty.
+
+        Returns
+        -------
+        np.ndarray
+            float32 pseudo-user factors of shape (n_sets, n_factors).
+
+        """
+        width = max([len(rows) for rows in row_lists] + [1])
+        n_factors = self.item_factors.shape[1]
+        factors = np.zeros((len(row_lists), width, n_factors))
+        residuals = np.zeros((len(row_lists), width))
+        for position, rows in enumerate(row_lists):
+            factors[position, :len(rows)] = self.item_factors[rows]
+            residuals[position, :len(rows)] = self.rating_max - self.global_mean - self.item_biases[rows]
+        gram = factors @ factors.transpose(0, 2, 1) + reg * np.eye(width)
+        weights = np.linalg.solve(gram, residuals[:, :, None])
+        return (factors.transpose(0, 2, 1) @ weights)[:, :, 0].astype(np.float32)
+
+    def recommend_batch(self, movie_id_lists, top_n=10, batch_size=BATCH_SIZE):
+        """Score every movie for many favourite sets with shared matrix products.
+
+        Parameters
+        ----------
+        movie_id_lists : list (list (int))
+            Favourite movie ids of every set; ids unknown to the model are
+            ignored and the favourites themselves are never recommended.
+        top_n : int
+            Number of movie ids to return per set.
+        batch_size : int
+            Sets scored per matrix product (bounds memory).
+
+        Returns
+        -------
+        list (list (int))
+            Recommended movie ids of every set, best first.
+
+        """
+        recommended = []
+        for start in range(0, len(movie_id_lists), batch_size):
+            row_lists = [np.array([self.row_of[movie_id] for movie_id in movie_ids
+                                   if movie_id in self.row_of], dtype=np.intp)
+                         for movie_ids in movie_id_lists[start:start + batch_size]]
+            with stage('svd.fold_in'):
+                user_factors = self.fold_in_batch(row_lists)
+            with stage('svd.score'):
+                scores = self.item_biases + user_factors @ self.item_factors.T
+                for position, rows in enumerate(row_lists):
+                    scores[position, rows] = -np.inf
+            count('svd.vectors_scored', scores.size)
+            with stage('svd.top_k'):
+                recommended += self.movie_ids[top_k_rows(scores, top_n)].tolist()
+        return recommended
+
+    def recommend(self, movie_ids, top_n=10):
+        """Score every movie for the pseudo-user built from `movie_ids`.
+
+        Parameters
+        ----------
+        movie_ids : list (int)
+            Favourite movie ids; ids unknown to the model are ignored and
+            the favourites themselves are never recommended.
+        top_n : int
+            Number of movie ids to return.
+
+        Returns
+        -------
+        list (int)
+            Recommended movie ids, best first.
+
+        """
+        return self.recommend_batch([movie_ids], top_n)[0]
+
+
+def export_factors(svd_path=SVD_PATH, factors_path=FACTORS_PATH):
+    """Convert the pickled surprise model into the serving .npz archive."""
+    with open(svd_path, 'rb') as model_file:
+        algo = pickle.load(model_file)
+    model = FactorModel.from_surprise(algo)
+    model.save(factors_path)
+    return model
+
+
+@lazy_singleton
+def factor_state():
+    """Load the exported item factors once, exporting them if needed.
+
+    Returns
+    -------
+    FactorModel
+        Model used by `factor_model`.
+
+    """
+    if not os.path.exists(FACTORS_PATH):
+        if not os.path.exists(SVD_PATH):
+            raise FileNotFoundError(f"No SVD model found at {SVD_PATH}; "
+                                    "train one with resources/models/train_colbased.py")
+        return export_factors()
+    return FactorModel.load(FACTORS_PATH)
+
+
+def factor_batch(movie_lists, top_n=10, diversity=DIVERSITY):
+    """SVD-based recommendations for many favourite lists at once.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favourite movie titles of every query.
+    top_n : int
+        Number of recommendations per query.
+    diversity : float
+        MMR weight of diversity against the predicted ranking; 0 disables
+        MMR.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of every query.
+
+    """
+    catalog = load_catalog()
+    with stage('svd.lookup'):
+        id_lists = [[catalog.movie_id(title) for title in movie_list] for movie_list in movie_lists]
+    # ask for a few extra ids in case some are missing from the catalogue
+    width = max([len(movie_list) for movie_list in movie_lists] + [0])
+    pool_size = mmr_pool_size(top_n, diversity)
+    recommended = factor_state().recommend_batch(id_lists, pool_size + width)
+    if diversity > 0:
+        from recommenders.content_index import content_vectors
+        with stage('svd.rerank'):
+            for position, movie_ids in enumerate(recommended):
+                movie_ids = [movie_id for movie_id in movie_ids
+                             if catalog.title(movie_id) is not None][:pool_size]
+                # relevance falls linearly with the predicted rank
+                recommended[position] = diversify(movie_ids, np.linspace(1, 0, len(movie_ids)),
+                                                  top_n, content_vectors, diversity)
+    with stage('svd.titles'):
+        return [catalog.titles_for(movie_ids[:top_n + len(movie_list)])[:top_n]
+                for movie_ids, movie_list in zip(recommended, movie_lists)]
+
+
+def factor_model(movie_list, top_n=10):
+    """Performs SVD-based collaborative filtering for a list of movies.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : type
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    """
+    return factor_batch([movie_list], top_n)[0]
+
+
+def compare_algorithms(n_queries=50, top_n=10, min_liked=8, seed=0):
+    """Compare latency and quality of the collaborative algorithms.
+
+    For randomly chosen users with at least `min_liked` ratings of 4.0 or
+    more, three of those movies are used as favourites and the remaining
+    ones are held out. Each algorithm is timed on every query and scored
+    by precision@top_n against the held-out movies.
+
+    Returns
+    -------
+    dict
+        Per algorithm: median and 95th percentile latency (seconds) and
+        mean precision.
+
+    """
+    from recommenders.collaborative_based import ALGORITHMS
+
+    catalog = load_catalog()
+    users = catalog.rating_users
+    liked = catalog.rating_values >= 4.0
+    movie_ids = np.repeat(np.arange(len(catalog.rating_offsets) - 1), np.diff(catalog.rating_offsets))
+    liked_users, counts = np.unique(users[liked], return_counts=True)
+    rng = np.random.default_rng(seed)
+    candidates = liked_users[counts >= min_liked]
+    chosen = rng.choice(candidates, size=min(n_queries, len(candidates)), replace=False)
+    queries = []
+    for user in chosen:
+        user_liked = [movie for movie in movie_ids[liked & (users == user)].tolist()
+                      if catalog.title(movie) is not None]
+        favourites = rng.choice(user_liked, size=3, replace=False).tolist()
+        held_out = set(catalog.titles_for(set(user_liked) - set(favourites)))
+        queries.append((catalog.titles_for(favourites), held_out))
+    report = {}
+    for name, algorithm in ALGORITHMS.items():
+        latencies, precisions = [], []
+        for favourites, held_out in queries:
+            start = time.perf_counter()
+            recommended = algorithm(favourites, top_n)
+            latencies.append(time.perf_counter() - start)
+            precisions.append(len(held_out.intersection(recommended)) / top_n)
+        report[name] = {'p50_seconds': float(np.percentile(latencies, 50)),
+                        'p95_seconds': float(np.percentile(latencies, 95)),
+                        'precision': float(np.mean(precisions))}
+    return report
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'export'
+    if command == 'export':
+        exported = export_factors()
+        print(f"Exported {len(exported.movie_ids)} item factors to: {FACTORS_PATH}")
+    elif command == 'compare':
+        for name, metrics in compare_algorithms().items():
+            print(f"{name:<15} p50 {metrics['p50_seconds'] * 1000:8.1f} ms  "
+                  f"p95 {metrics['p95_seconds'] * 1000:8.1f} ms  "
+                  f"precision@10 {metrics['precision']:.3f}")
+    else:
+        sys.exit(f"Unknown command: {command} (expected 'export' or 'compare')")
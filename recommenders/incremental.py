@@ -0,0 +1,69 @@
+"""
+
+    Incremental ingestion of new ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Applies a batch of new (userId, movieId, rating) rows to
+    the in-memory recommender state without rerunning the full pipeline:
+    the per-user and per-movie slices of the shared rating store (and,
+    lazily, the popularity statistics derived from them), the normalised
+    utility matrix rows (means and ranges) of the touched users, the similarity
+    engine's row norms and stored neighbour lists, and - when an SVD model
+    is loaded - a few SGD fold-in epochs for the touched users and movies.
+
+    The batch only lives in memory; append it to the ratings file as well
+    so that the next full rebuild includes it.
+
+"""
+# Script dependencies
+import os
+import threading
+import numpy as np
+
+from recommenders.collaborative_based import collab_state
+from recommenders.factor_based import FACTORS_PATH, SVD_PATH, factor_state
+from utils.data_loader import bump_data_version
+from utils.popularity import popularity_stats
+from utils.rating_store import rating_store
+
+# Serialises concurrent ingestion batches
+_ingest_lock = threading.Lock()
+
+
+def ingest_ratings(new_ratings):
+    """Add a batch of ratings to the loaded recommender state.
+
+    Parameters
+    ----------
+    new_ratings : Pandas Dataframe
+        New ratings with `userId`, `movieId` and `rating` columns.
+
+    Returns
+    -------
+    dict
+        Number of ratings ingested and of users and movies touched.
+
+    """
+    user_ids = new_ratings['userId'].to_numpy(dtype=np.int32)
+    movie_ids = new_ratings['movieId'].to_numpy(dtype=np.int32)
+    ratings = new_ratings['rating'].to_numpy(dtype=np.float32)
+    with _ingest_lock:
+        state = collab_state()
+        # The catalogue and the collaborative state share the rating store,
+        # so this updates both its per-movie and per-user slices
+        rating_store().add_ratings(user_ids, movie_ids, ratings)
+        # Renormalise only the touched users, from their complete histories
+        touched = np.unique(user_ids)
+        state.util_matrix_norm = state.util_matrix_norm.update_users(
+            *state.ratings.ratings_of_users(touched.tolist()))
+        state.similarity_engine.update(state.util_matrix_norm.matrix,
+                                       state.util_matrix_norm.user_ids, touched)
+
+        if factor_state.is_loaded() or os.path.exists(FACTORS_PATH) or os.path.exists(SVD_PATH):
+            factor_state().partial_fit(user_ids, movie_ids, ratings)
+
+        # Invalidate cached results and statistics computed before this batch
+        bump_data_version(user_ids, movie_ids, ratings)
+        popularity_stats.reset()
+    return {'ratings': len(ratings), 'users': len(touched), 'movies': len(np.unique(movie_ids))}
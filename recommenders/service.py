@@ -0,0 +1,301 @@
+"""
+
+    Standalone recommendation service.
+
+    Author: Explore Data Science Academy.
+
+    Description: An asyncio HTTP/1.1 server (standard library only) that
+    loads the recommenders once and serves them to any number of app
+    processes, so that the Streamlit app can run as a thin client (see
+    `recommenders.client`). Concurrent requests for the same model and
+    `top_n` are gathered by a micro-batching queue and scored together
+    with the batch recommenders of `recommenders.batch`; the scoring runs
+    in a thread pool so the event loop keeps accepting requests.
+
+        python -m recommenders.service [--host 127.0.0.1] [--port 8765]
+            [--max-batch 64] [--max-wait-ms 2] [--workers 2]
+
+    Endpoints:
+        POST /recommend     {"model": "content", "movies": [...], "top_n": 10}
+                            -> {"recommendations": [...], "batch_size": n}
+        GET  /algorithms    {"content": ["content"], "collab": [...]}
+        GET  /health        {"status": "ok"}
+        GET  /metrics       instrumentation counters in Prometheus format
+
+"""
+# Script dependencies
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from recommenders import collaborative_based, content_based
+from recommenders.batch import BATCH_MODELS, recommend_batch
+from recommenders.content_index import ensure_content_index
+from utils import instrumentation
+from utils.result_cache import make_key, result_cache
+
+# Default address of the service
+HOST = '127.0.0.1'
+PORT = 8765
+# Most queries scored in one batch
+MAX_BATCH = 64
+# How long the first query of a batch waits for others to join (seconds)
+MAX_WAIT = 0.002
+# Threads scoring batches
+WORKERS = 2
+# Largest accepted request line plus headers, and body (bytes)
+MAX_HEADER_BYTES = 16384
+MAX_BODY_BYTES = 1 << 20
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def model_version(model):
+    """Version under which results of `model` are cached (see `result_cache`)."""
+    if model == 'content':
+        return content_based._cache_version()
+    # the collaborative version depends on this thread's selected algorithm
+    collaborative_based.set_collab_algorithm(model)
+    return collaborative_based._cache_version()
+
+
+def score_batch(model, movie_lists, top_n):
+    """Recommend for a batch of favourite lists, reusing cached results.
+
+    Runs in a worker thread. Results are cached under the same keys as
+    `content_model` and `collab_model` use.
+
+    """
+    with instrumentation.stage('service.batch'):
+        cache = result_cache()
+        if cache is None:
+            return recommend_batch(movie_lists, model, top_n)
+        version = model_version(model)
+        keys = [make_key(model, version, movie_list, top_n) for movie_list in movie_lists]
+        results = [cache.get(key) for key in keys]
+        missing = [position for position, result in enumerate(results) if result is None]
+        instrumentation.count('result_cache.hits', len(results) - len(missing))
+        instrumentation.count('result_cache.misses', len(missing))
+        if missing:
+            computed = recommend_batch([movie_lists[position] for position in missing], model, top_n)
+            for position, result in zip(missing, computed):
+                cache.put(keys[position], result)
+                results[position] = result
+        return results
+
+
+class MicroBatcher:
+    """Gather concurrent queries into batches, one queue per (model, top_n).
+
+    The first query of a batch waits up to `max_wait` seconds for others;
+    queries arriving while a batch is being scored form the next batch.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Runs `score_batch`.
+    max_batch : int
+        Most queries per batch.
+    max_wait : float
+        Seconds the first query of a batch waits for company.
+
+    """
+
+    def __init__(self, executor, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queues = {}
+        self._tasks = []
+
+    async def submit(self, model, movie_list, top_n):
+        """Queue one query and wait for its recommendations.
+
+        Returns
+        -------
+        tuple (list (str), int)
+            The recommended titles and the size of the batch they were
+            scored in.
+
+        """
+        key = (model, top_n)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Queue()
+            self._tasks.append(asyncio.get_running_loop().create_task(self._drain(model, top_n, queue)))
+        future = asyncio.get_running_loop().create_future()
+        queue.put_nowait((sorted(movie_list), future))
+        return await future
+
+    async def _drain(self, model, top_n, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            if queue.empty() and self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            instrumentation.count('service.batches')
+            instrumentation.count('service.requests', len(batch))
+            try:
+                results = await loop.run_in_executor(self.executor, score_batch, model,
+                                                     [movie_list for movie_list, _ in batch], top_n)
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result((result, len(batch)))
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+class RecommendationService:
+    """HTTP front end of the micro-batched recommenders."""
+
+    def __init__(self, max_batch=MAX_BATCH, max_wait=MAX_WAIT, workers=WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recommend')
+        self.batcher = MicroBatcher(self.executor, max_batch, max_wait)
+
+    def warm_up(self):
+        """Load every model up front instead of on the first request."""
+        ensure_content_index()
+        recommend_batch([[]], 'content')
+        for model in collaborative_based.ALGORITHMS:
+            try:
+                recommend_batch([[]], model)
+            except FileNotFoundError:
+                # no trained factors; requests for this model will fail
+                pass
+
+    async def handle(self, method, path, body):
+        """Route one request; returns (status, JSON-serialisable payload or str)."""
+        if path == '/health':
+            return 200, {'status': 'ok'}
+        if path == '/algorithms':
+            return 200, {'content': ['content'], 'collab': collaborative_based.collab_algorithms()}
+        if path == '/metrics':
+            return 200, instrumentation.prometheus_text()
+        if path != '/recommend':
+            return 404, {'error': f'Unknown path: {path}'}
+        if method != 'POST':
+            return 405, {'error': 'Use POST'}
+        try:
+            query = json.loads(body or b'{}')
+            model = query.get('model', 'content')
+            movies = [str(title) for title in query.get('movies', [])]
+            top_n = int(query.get('top_n', 10))
+        except (ValueError, TypeError, AttributeError) as error:
+            return 400, {'error': f'Malformed query: {error}'}
+        if model not in BATCH_MODELS:
+            return 400, {'error': f'Unknown model: {model!r}'}
+        try:
+            recommendations, batch_size = await self.batcher.submit(model, movies, top_n)
+        except FileNotFoundError as error:
+            return 500, {'error': str(error)}
+        return 200, {'recommendations': recommendations, 'batch_size': batch_size}
+
+    async def serve_connection(self, reader, writer):
+        """Answer requests on one (keep-alive) connection until it closes."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, 400, {'error': 'Malformed request line'}, False)
+                    return
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', '0') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {'error': 'Malformed Content-Length'}, False)
+                    return
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {'error': 'Request body too large'}, False)
+                    return
+                try:
+                    body = await reader.readexactly(length) if length else b''
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.upper() == 'HTTP/1.1')
+                start = time.perf_counter()
+                try:
+                    status, payload = await self.handle(method.upper(), target.split('?')[0], body)
+                except Exception as error:
+                    status, payload = 500, {'error': f'{type(error).__name__}: {error}'}
+                if isinstance(payload, dict):
+                    payload['server_ms'] = (time.perf_counter() - start) * 1000
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        head = (f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        """Serve until cancelled; `ready` (a threading.Event) is set once listening."""
+        server = await asyncio.start_server(self.serve_connection, host, port,
+                                            limit=MAX_HEADER_BYTES)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.batcher.close()
+            self.executor.shutdown(wait=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the recommenders over HTTP.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT * 1000)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='scoring threads')
+    parser.add_argument('--no-warm-up', action='store_true', help='load models on first use')
+    args = parser.parse_args(argv)
+    service = RecommendationService(args.max_batch, args.max_wait_ms / 1000, args.workers)
+    if not args.no_warm_up:
+        print('Loading models ...')
+        service.warm_up()
+    print(f'Serving recommendations on http://{args.host}:{args.port}')
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
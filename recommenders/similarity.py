@@ -0,0 +1,228 @@
+"""
+
+    Vectorised user-user similarity engine for collaborative filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Holds the normalised utility matrix as a CSR user x item
+    matrix together with precomputed row norms, and scores a batch of
+    reference users against every user with a single sparse matrix
+    product per block instead of a Python loop over rows.
+
+"""
+# Script dependencies
+import numpy as np
+import scipy.sparse as sp
+
+from utils.instrumentation import count
+from utils.ranking import top_k_indices
+
+# Number of reference users scored per sparse matrix product
+BATCH_SIZE = 64
+# Neighbour lists kept before the store is cleared
+MAX_NEIGHBOUR_LISTS = 100000
+
+
+class _EngineState:
+    """One consistent snapshot of the engine, replaced as a whole on `update`.
+
+    Readers take a single reference to the current state, so a concurrent
+    update never shows them a matrix and user ids from different
+    versions. `neighbours` maps a reference user id to its (ids, scores)
+    neighbour list; it is only ever added to, and is swapped for a new
+    dict rather than cleared.
+
+    """
+
+    def __init__(self, matrix, user_ids, norms, neighbours):
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.row_of = {user_id: row for row, user_id in enumerate(user_ids.tolist())}
+        self.norms = norms
+        self.matrix_t = matrix.T.tocsc()
+        self.neighbours = neighbours
+
+
+class UserSimilarityEngine:
+    """Cosine similarity between users of a sparse utility matrix.
+
+    The engine is shared by concurrent app sessions: queries read one
+    `_EngineState` snapshot and `update` publishes a new one in a single
+    assignment.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse matrix or np.ndarray
+        Normalised utility matrix with one row per user.
+    user_ids : array-like
+        User id of every row of `matrix`.
+
+    """
+
+    def __init__(self, matrix, user_ids):
+        matrix = sp.csr_matrix(matrix, dtype=np.float64)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        self._state = _EngineState(matrix, np.asarray(user_ids), norms, {})
+
+    @property
+    def matrix(self):
+        return self._state.matrix
+
+    @property
+    def user_ids(self):
+        return self._state.user_ids
+
+    @property
+    def row_of(self):
+        return self._state.row_of
+
+    @property
+    def norms(self):
+        return self._state.norms
+
+    def __contains__(self, user_id):
+        return user_id in self._state.row_of
+
+    def similarities(self, rows, state=None):
+        """Cosine similarity of the given rows against every user.
+
+        Parameters
+        ----------
+        rows : array-like
+            Row positions of the reference users.
+        state : _EngineState, optional
+            Snapshot the rows refer to; the current one by default.
+
+        Returns
+        -------
+        np.ndarray
+            Dense (len(rows), n_users) similarity matrix. Similarities
+            involving an all-zero user are NaN.
+
+        """
+        state = state or self._state
+        rows = np.asarray(rows, dtype=np.intp)
+        dots = (state.matrix[rows] @ state.matrix_t).toarray()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return dots / np.outer(state.norms[rows], state.norms)
+
+    def clear_neighbours(self):
+        """Forget every stored neighbour list, e.g. to time cold queries."""
+        self._state.neighbours = {}
+
+    def most_similar(self, user_ids, k=20, batch_size=BATCH_SIZE):
+        """Find the k most similar users for each reference user.
+
+        A user is never returned as its own neighbour. Ties are resolved in
+        favour of the user stored first, as with a sequential scan.
+        Neighbour lists are kept per reference user and reused until an
+        `update` affects them.
+
+        Parameters
+        ----------
+        user_ids : list
+            Reference user ids. Ids unknown to the engine are skipped.
+        k : int
+            Number of neighbours per reference user.
+        batch_size : int
+            Number of reference users scored per matrix product.
+
+        Returns
+        -------
+        tuple (np.ndarray, np.ndarray)
+            Neighbour user ids and similarity scores, both of shape
+            (n_known_references, k), best first.
+
+        """
+        state = self._state
+        known = [user_id for user_id in user_ids if user_id in state.row_of]
+        k = min(k, max(len(state.user_ids) - 1, 0))
+        store = state.neighbours
+        # look every list up once; other sessions may add to the store meanwhile
+        lists = {user_id: store.get(user_id) for user_id in known}
+        missing = [user_id for user_id, found in lists.items() if found is None or len(found[0]) < k]
+        if len(store) + len(missing) > MAX_NEIGHBOUR_LISTS:
+            store = state.neighbours = {}
+        rows = np.asarray([state.row_of[user_id] for user_id in missing], dtype=np.intp)
+        count('similarity.cache_hits', len(known) - len(missing))
+        count('similarity.vectors_scored', len(rows) * len(state.user_ids))
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            block = self.similarities(batch, state)
+            block[np.arange(len(batch)), batch] = np.nan
+            for row, row_scores in zip(batch, block):
+                top = top_k_indices(row_scores, k)
+                user_id = state.user_ids[row]
+                lists[user_id] = store[user_id] = (state.user_ids[top], row_scores[top])
+        neighbours = np.empty((len(known), k), dtype=state.user_ids.dtype)
+        scores = np.empty((len(known), k), dtype=np.float64)
+        for position, user_id in enumerate(known):
+            found, found_scores = lists[user_id]
+            neighbours[position] = found[:k]
+            scores[position] = found_scores[:k]
+        return neighbours, scores
+
+    def update(self, matrix, user_ids, touched):
+        """Swap in a utility matrix in which only the `touched` users changed.
+
+        Row norms are carried over for unchanged users and recomputed for
+        the touched ones. Every stored neighbour list is patched with the
+        new similarities to the touched users; a list is dropped (and
+        recomputed on next use) only when a touched user fell out of it
+        and nothing guarantees what should take its place. Queries keep
+        using the previous state until the new one is complete.
+
+        Parameters
+        ----------
+        matrix : scipy.sparse matrix
+            Updated normalised utility matrix.
+        user_ids : array-like
+            User id of every row of `matrix`.
+        touched : array-like
+            Ids of the users whose rows were added, changed or removed.
+
+        """
+        old = self._state
+        matrix = sp.csr_matrix(matrix, dtype=np.float64)
+        user_ids = np.asarray(user_ids)
+        touched = np.unique(np.asarray(touched))
+        old_rows = np.array([old.row_of.get(user_id, -1) for user_id in user_ids.tolist()],
+                            dtype=np.intp)
+        recompute = (old_rows < 0) | np.isin(user_ids, touched)
+        norms = np.empty(len(user_ids))
+        norms[~recompute] = old.norms[old_rows[~recompute]]
+        changed = matrix[np.flatnonzero(recompute)]
+        norms[recompute] = np.sqrt(np.asarray(changed.multiply(changed).sum(axis=1)).ravel())
+        state = _EngineState(matrix, user_ids, norms, {})
+        _patch_neighbours(state, old.neighbours.copy(), touched)
+        self._state = state
+
+
+def _patch_neighbours(state, old_lists, touched):
+    """Fill `state.neighbours` from the lists of the previous state."""
+    touched_set = set(touched.tolist())
+    lists = {user_id: found for user_id, found in old_lists.items()
+             if user_id in state.row_of and user_id not in touched_set}
+    if not lists:
+        return
+    present = np.array([state.row_of[user_id] for user_id in touched.tolist()
+                        if user_id in state.row_of], dtype=np.intp)
+    references = list(lists)
+    ref_rows = np.array([state.row_of[user_id] for user_id in references], dtype=np.intp)
+    dots = (state.matrix[ref_rows] @ state.matrix[present].T).toarray()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        touched_scores = dots / np.outer(state.norms[ref_rows], state.norms[present])
+    for position, user_id in enumerate(references):
+        found, found_scores = lists[user_id]
+        k = len(found)
+        stale = np.isin(found, touched)
+        rows = np.concatenate([[state.row_of[other] for other in found[~stale].tolist()],
+                               present]).astype(np.intp)
+        scores = np.concatenate([found_scores[~stale], touched_scores[position]])
+        scores = np.where(np.isnan(scores) | (rows == ref_rows[position]), -np.inf, scores)
+        order = np.lexsort((rows, -scores))[:k]
+        # Users outside the old list scored at most its last score, so a
+        # shortened list is only trusted if it refills above that score.
+        if stale.any() and (len(order) < k or scores[order[-1]] <= found_scores[-1]):
+            continue
+        state.neighbours[user_id] = (state.user_ids[rows[order]], scores[order])
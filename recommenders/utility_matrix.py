@@ -0,0 +1,169 @@
+"""
+
+    Sparse, normalised user x movie utility matrix.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds the mean-centred, range-normalised utility matrix
+    used by collaborative filtering directly from the rating triplets,
+    without ever materialising the dense (and almost entirely empty)
+    users x movies pivot table. This keeps the full MovieLens ratings
+    within memory.
+
+"""
+# Script dependencies
+import numpy as np
+import scipy.sparse as sp
+
+
+class UtilityMatrix:
+    """Normalised utility matrix with contiguous id <-> row mappings.
+
+    Every rating r of user u is stored as
+    (r - mean_u) / (max_u - min_u). Users whose ratings are all equal
+    have no defined normalisation and are left out, as are movies that
+    only such users rated.
+
+    Attributes
+    ----------
+    matrix : scipy.sparse.csr_matrix
+        float64 matrix of shape (n_users, n_movies).
+    user_ids : np.ndarray
+        User id of every row, sorted ascending.
+    movie_ids : np.ndarray
+        Movie id of every column, sorted ascending.
+    means : np.ndarray
+        Mean rating of every row's user.
+    ranges : np.ndarray
+        Rating range (max - min) of every row's user.
+
+    """
+
+    def __init__(self, matrix, user_ids, movie_ids, means, ranges):
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.movie_ids = movie_ids
+        self.means = means
+        self.ranges = ranges
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @classmethod
+    def from_ratings(cls, user_ids, movie_ids, ratings):
+        """Build the normalised matrix from parallel rating arrays.
+
+        Parameters
+        ----------
+        user_ids : np.ndarray
+            User id of every rating.
+        movie_ids : np.ndarray
+            Movie id of every rating.
+        ratings : np.ndarray
+            Rating values.
+
+        Returns
+        -------
+        UtilityMatrix
+            The normalised utility matrix.
+
+        """
+        users, user_rows = np.unique(np.asarray(user_ids), return_inverse=True)
+        movies, movie_cols = np.unique(np.asarray(movie_ids), return_inverse=True)
+        ratings = np.asarray(ratings, dtype=np.float64)
+        shape = (len(users), len(movies))
+        # Average repeated (user, movie) pairs, as a pivot table would
+        totals = sp.csr_matrix((ratings, (user_rows, movie_cols)), shape=shape)
+        counts = sp.csr_matrix((np.ones_like(ratings), (user_rows, movie_cols)), shape=shape)
+        totals.sum_duplicates()
+        counts.sum_duplicates()
+        values = totals.data / counts.data
+        rows = np.repeat(np.arange(shape[0]), np.diff(totals.indptr))
+        # Per-user statistics from the CSR segments
+        starts = totals.indptr[:-1]
+        n_rated = np.diff(totals.indptr)
+        means = np.add.reduceat(values, starts) / n_rated
+        ranges = np.maximum.reduceat(values, starts) - np.minimum.reduceat(values, starts)
+        # Users with a zero range cannot be normalised and are dropped
+        keep_users = ranges > 0
+        keep = keep_users[rows]
+        data = (values[keep] - means[rows[keep]]) / ranges[rows[keep]]
+        cols = totals.indices[keep]
+        new_row = np.cumsum(keep_users) - 1
+        rows = new_row[rows[keep]]
+        # Drop movies left without any rating and re-index the columns
+        keep_movies = np.zeros(shape[1], dtype=bool)
+        keep_movies[cols] = True
+        new_col = np.cumsum(keep_movies) - 1
+        matrix = sp.csr_matrix((data, (rows, new_col[cols])),
+                               shape=(int(keep_users.sum()), int(keep_movies.sum())))
+        return cls(matrix, users[keep_users], movies[keep_movies],
+                   means[keep_users], ranges[keep_users])
+
+    @classmethod
+    def from_frame(cls, ratings_df):
+        """Build the matrix from a ratings Dataframe."""
+        return cls.from_ratings(ratings_df['userId'].to_numpy(),
+                                ratings_df['movieId'].to_numpy(),
+                                ratings_df['rating'].to_numpy())
+
+    def user_rows(self, user_ids):
+        """Map user ids to rows; unknown ids map to -1."""
+        return self._lookup(self.user_ids, user_ids)
+
+    def movie_cols(self, movie_ids):
+        """Map movie ids to columns; unknown ids map to -1."""
+        return self._lookup(self.movie_ids, movie_ids)
+
+    @staticmethod
+    def _lookup(sorted_ids, ids):
+        ids = np.atleast_1d(np.asarray(ids))
+        if len(sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.intp)
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[positions] == ids, positions, -1)
+
+    def update_users(self, user_ids, movie_ids, ratings):
+        """Replace the rows of some users, e.g. after they rated new movies.
+
+        Only the given users are renormalised; the rows of every other user
+        are carried over unchanged. New users and movies are inserted at
+        their sorted positions.
+
+        Parameters
+        ----------
+        user_ids : np.ndarray
+            User id of every rating. Must hold the *complete* rating
+            history of each user it mentions.
+        movie_ids : np.ndarray
+            Movie id of every rating.
+        ratings : np.ndarray
+            Rating values.
+
+        Returns
+        -------
+        UtilityMatrix
+            The updated matrix (a new object; `self` is left untouched).
+
+        """
+        touched = self.from_ratings(user_ids, movie_ids, ratings)
+        carried = ~np.isin(self.user_ids, np.unique(user_ids))
+        users = np.union1d(self.user_ids[carried], touched.user_ids)
+        movies = np.union1d(self.movie_ids, touched.movie_ids)
+        old = self.matrix.tocoo()
+        new = touched.matrix.tocoo()
+        keep = carried[old.row]
+        rows = np.concatenate([np.searchsorted(users, self.user_ids[old.row[keep]]),
+                               np.searchsorted(users, touched.user_ids[new.row])])
+        cols = np.concatenate([np.searchsorted(movies, self.movie_ids[old.col[keep]]),
+                               np.searchsorted(movies, touched.movie_ids[new.col])])
+        data = np.concatenate([old.data[keep], new.data])
+        matrix = sp.csr_matrix((data, (rows, cols)), shape=(len(users), len(movies)))
+        means = np.empty(len(users))
+        ranges = np.empty(len(users))
+        for source, mask in ((self, carried), (touched, slice(None))):
+            positions = np.searchsorted(users, source.user_ids[mask])
+            means[positions] = source.means[mask]
+            ranges[positions] = source.ranges[mask]
+        return UtilityMatrix(matrix, users, movies, means, ranges)
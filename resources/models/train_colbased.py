@@ -4,36 +4,385 @@
 
     Author: Explore Data Science Academy.
 
-    Description: Simple script to train and save an instance of the
-    SVDpp algorithm on MovieLens data.
+    Description: Training pipeline for the SVD collaborative model on
+    MovieLens data. A hyperparameter grid is cross-validated with every
+    (configuration, fold) pair running as its own job on a process pool.
+    Finished jobs are checkpointed to the run directory as they complete,
+    so an interrupted run resumes where it stopped when started again with
+    the same --run-id (and the same folds, seed, ratings and trainer,
+    which are recorded in the run's manifest.json). The best configuration is then refit on all ratings
+    and written, together with its metrics and training wall-time, as a
+    versioned artifact; `SVD.pkl` is updated to point at the latest model.
+
+    With --trainer als the in-repo ALS trainer (`recommenders.als`) is used
+    instead of surprise.SVD. Its jobs also checkpoint their factors after
+    every iteration, so an interrupted fit resumes mid-way, and the run
+    exports `svd_factors.npz` directly rather than a pickled model.
+
+    Run from the repository root:
+
+        python resources/models/train_colbased.py --folds 3 --jobs 8
+        python resources/models/train_colbased.py --trainer als
 
 """
 # Script dependencies
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
-import pandas as pd
 from surprise import SVD
 import surprise
-import pickle
+from surprise import accuracy
+
+# Make the repository's packages importable when run as a script
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+from recommenders.als import rmse, train_als  # noqa: E402
+from utils.data_loader import load_ratings  # noqa: E402
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
+# Default locations, relative to the repository root
+RATINGS_PATH = 'resources/data/ratings.csv'
+OUTPUT_DIR = 'resources/models'
 
-def svd_pp(save_path):
+# Hyperparameter grid searched by default
+PARAM_GRID = {
+    'n_factors': [50, 100, 200],
+    'lr_all': [0.005, 0.01],
+    'reg_all': [0.02, 0.05],
+    'n_epochs': [20, 40],
+}
+# Grid searched by default for each trainer
+PARAM_GRIDS = {
+    'surprise': PARAM_GRID,
+    'als': {
+        'n_factors': [20, 50, 100],
+        'reg': [0.05, 0.1, 0.2],
+        'n_iters': [5, 10],
+    },
+}
+# Fixed settings shared by every configuration
+BASE_PARAMS = {'init_std_dev': 0.05}
+
+
+def build_dataset(ratings, rating_scale=None):
+    """Wrap a ratings Dataframe as a surprise Dataset."""
     # Check the range of the rating
-    min_rat = ratings['rating'].min()
-    max_rat = ratings['rating'].max()
+    min_rat, max_rat = rating_scale or (ratings['rating'].min(), ratings['rating'].max())
     # Changing ratings to their standard form
-    reader = surprise.Reader(rating_scale = (min_rat,max_rat))
-    # Loading the data frame using surprice
-    data_load = surprise.Dataset.load_from_df(ratings, reader)
+    reader = surprise.Reader(rating_scale=(min_rat, max_rat))
+    return surprise.Dataset.load_from_df(ratings, reader)
+
+
+def expand_grid(grid):
+    """List every configuration of a {name: [values]} grid."""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def config_key(trainer, config):
+    """Stable identifier of a trainer's configuration."""
+    payload = json.dumps([trainer, config], sort_keys=True).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()[:10]
+
+
+def ratings_checksum(ratings):
+    """SHA-1 of the ratings' userId, movieId and rating columns."""
+    digest = hashlib.sha1()
+    for column in ('userId', 'movieId', 'rating'):
+        digest.update(np.ascontiguousarray(ratings[column].to_numpy()).tobytes())
+    return digest.hexdigest()
+
+
+def check_manifest(run_dir, manifest, resuming):
+    """Record a run's settings, or check them against the run being resumed.
+
+    Parameters
+    ----------
+    run_dir : str
+        Directory of the run.
+    manifest : dict
+        Settings that checkpointed results depend on.
+    resuming : bool
+        Whether results were already checkpointed in `run_dir`.
+
+    Raises
+    ------
+    ValueError
+        If the run was started with other settings, or its settings are
+        unknown.
+
+    """
+    path = os.path.join(run_dir, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as manifest_file:
+            recorded = json.load(manifest_file)
+        changed = sorted(name for name in set(manifest) | set(recorded)
+                         if manifest.get(name) != recorded.get(name))
+        if changed:
+            raise ValueError(f"Cannot resume {run_dir}: it was started with different "
+                             f"{', '.join(changed)}; use a new --run-id")
+        return
+    if resuming:
+        raise ValueError(f"Cannot resume {run_dir}: it has no manifest.json to check its "
+                         "settings against; use a new --run-id")
+    with open(path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def assign_folds(n_ratings, n_folds, seed):
+    """Shuffled fold number of every rating, shared by all trainers."""
+    rng = np.random.default_rng(seed)
+    return rng.permutation(n_ratings) % n_folds
+
+
+# State shared by the jobs of one worker process
+_worker = {}
+
+
+def _init_worker(ratings, n_folds, seed):
+    """Keep the ratings and their fold split once per worker process."""
+    _worker['ratings'] = ratings
+    _worker['fold_of'] = assign_folds(len(ratings), n_folds, seed)
+    _worker['scale'] = (float(ratings['rating'].min()), float(ratings['rating'].max()))
+    _worker['seed'] = seed
+
+
+def _run_job(trainer, config, fold, checkpoint_path):
+    """Fit one configuration on one fold and score it on the held-out part."""
+    ratings, scale, seed = _worker['ratings'], _worker['scale'], _worker['seed']
+    held_out = _worker['fold_of'] == fold
+    train_df, test_df = ratings[~held_out], ratings[held_out]
+    start = time.perf_counter()
+    if trainer == 'als':
+        model, _ = train_als(train_df['userId'].to_numpy(), train_df['movieId'].to_numpy(),
+                             train_df['rating'].to_numpy(), seed=seed,
+                             checkpoint_path=checkpoint_path, **config)
+        fit_seconds = time.perf_counter() - start
+        estimates = np.clip(model.predict(test_df['userId'].to_numpy(),
+                                          test_df['movieId'].to_numpy()), *scale)
+        errors = estimates - test_df['rating'].to_numpy()
+        scores = {'rmse': rmse(estimates, test_df['rating']), 'mae': float(np.abs(errors).mean())}
+    else:
+        trainset = build_dataset(train_df, scale).build_full_trainset()
+        model = SVD(random_state=seed, **BASE_PARAMS, **config).fit(trainset)
+        fit_seconds = time.perf_counter() - start
+        predictions = model.test(list(test_df.itertuples(index=False, name=None)))
+        scores = {'rmse': accuracy.rmse(predictions, verbose=False),
+                  'mae': accuracy.mae(predictions, verbose=False)}
+    return {'trainer': trainer, 'config': config, 'key': config_key(trainer, config),
+            'fold': fold, 'fit_seconds': fit_seconds, **scores}
+
+
+def read_checkpoint(path):
+    """Return the job results recorded so far in a run's checkpoint file."""
+    if not os.path.exists(path):
+        return []
+    results = []
+    with open(path) as checkpoint:
+        for line in checkpoint:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                # A line cut short by an interruption; its job is rerun
+                continue
+    return results
+
+
+def cross_validate_grid(ratings, grid, run_dir, n_folds=3, n_jobs=None, seed=0, trainer='surprise'):
+    """Cross-validate every configuration of `grid` on a process pool.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        `userId`, `movieId` and `rating` columns.
+    grid : dict
+        Hyperparameter name -> list of values.
+    run_dir : str
+        Directory holding the run's checkpoint file.
+    n_folds : int
+        Number of cross-validation folds.
+    n_jobs : int, optional
+        Worker processes; defaults to the number of CPUs.
+    seed : int
+        Seed of the fold split and of the models.
+    trainer : str
+        'surprise' or 'als'.
+
+    Returns
+    -------
+    list (dict)
+        One result per (configuration, fold), including checkpointed ones.
+
+    Raises
+    ------
+    ValueError
+        If `run_dir` holds a run started with other folds, seed, ratings
+        or trainer.
+
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    checkpoint_path = os.path.join(run_dir, 'checkpoint.jsonl')
+    results = read_checkpoint(checkpoint_path)
+    # Fold results are only comparable within one split of the same ratings
+    check_manifest(run_dir, {'folds': n_folds, 'seed': seed, 'trainer': trainer,
+                             'ratings_sha1': ratings_checksum(ratings)}, bool(results))
+    done = {(result['key'], result['fold']) for result in results}
+    jobs = [(config, fold) for config in expand_grid(grid) for fold in range(n_folds)
+            if (config_key(trainer, config), fold) not in done]
+
+    def job_path(config, fold):
+        # Per-iteration factor checkpoint of an unfinished ALS job
+        if trainer != 'als':
+            return None
+        return os.path.join(run_dir, 'jobs', f"{config_key(trainer, config)}-{fold}.npz")
+
+    print(f"{len(done)} jobs already checkpointed, {len(jobs)} to run")
+    if not jobs:
+        return results
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(ratings, n_folds, seed)) as pool, \
+            open(checkpoint_path, 'a') as checkpoint:
+        futures = [pool.submit(_run_job, trainer, config, fold, job_path(config, fold))
+                   for config, fold in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            checkpoint.write(json.dumps(result) + '\n')
+            checkpoint.flush()
+            results.append(result)
+            finished = job_path(result['config'], result['fold'])
+            if finished is not None and os.path.exists(finished):
+                os.remove(finished)
+            print(f"fold {result['fold']} {result['config']}: rmse {result['rmse']:.4f} "
+                  f"({result['fit_seconds']:.1f} s)")
+    return results
+
+
+def summarise(results):
+    """Average the fold results of every configuration, best RMSE first."""
+    summary = {}
+    for result in results:
+        entry = summary.setdefault(result['key'], {'config': result['config'], 'folds': []})
+        entry['folds'].append(result)
+    rows = []
+    for key, entry in summary.items():
+        folds = entry['folds']
+        rows.append({'key': key, 'config': entry['config'], 'n_folds': len(folds),
+                     'rmse': float(np.mean([fold['rmse'] for fold in folds])),
+                     'rmse_std': float(np.std([fold['rmse'] for fold in folds])),
+                     'mae': float(np.mean([fold['mae'] for fold in folds])),
+                     'fit_seconds': float(np.sum([fold['fit_seconds'] for fold in folds]))})
+    return sorted(rows, key=lambda row: row['rmse'])
+
+
+def promote(path, output_dir):
+    """Atomically copy a run's artifact to where the app loads it from."""
+    latest_path = os.path.join(output_dir, os.path.basename(path))
+    shutil.copyfile(path, latest_path + '.tmp')
+    os.replace(latest_path + '.tmp', latest_path)
+    return latest_path
+
+
+def train_final(ratings, config, run_dir, output_dir=OUTPUT_DIR, seed=0, trainer='surprise'):
+    """Refit `config` on every rating and write the versioned artifact.
+
+    A surprise model is saved to `<run_dir>/SVD.pkl` and copied to
+    `<output_dir>/SVD.pkl`, where the app picks it up (its item factors are
+    re-exported on the next start). An ALS model is saved and promoted as
+    `svd_factors.npz`, the exported factors themselves.
+
+    Returns
+    -------
+    dict
+        Path of the artifact and the final fit's wall-time.
+
+    """
+    if trainer == 'als':
+        checkpoint_path = os.path.join(run_dir, 'final.npz')
+        model, stats = train_als(ratings['userId'].to_numpy(), ratings['movieId'].to_numpy(),
+                                 ratings['rating'].to_numpy(), seed=seed,
+                                 checkpoint_path=checkpoint_path, **config)
+        model_path = os.path.join(run_dir, 'svd_factors.npz')
+        model.save(model_path)
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        latest_path = promote(model_path, output_dir)
+        print(f"Training completed. Saving factors to: {model_path} (latest: {latest_path})")
+        return {'model_path': model_path, 'fit_seconds': stats['fit_seconds'],
+                'ratings_per_second': stats['ratings_per_second']}
+    data = build_dataset(ratings)
+    start = time.perf_counter()
+    model = SVD(random_state=seed, **BASE_PARAMS, **config).fit(data.build_full_trainset())
+    fit_seconds = time.perf_counter() - start
+    model_path = os.path.join(run_dir, 'SVD.pkl')
+    with open(model_path, 'wb') as model_file:
+        pickle.dump(model, model_file, protocol=pickle.HIGHEST_PROTOCOL)
+    latest_path = promote(model_path, output_dir)
+    # Factors exported from the previous model would shadow the new one
+    stale_factors = os.path.join(output_dir, 'svd_factors.npz')
+    if os.path.exists(stale_factors):
+        os.remove(stale_factors)
+    print(f"Training completed. Saving model to: {model_path} (latest: {latest_path})")
+    return {'model_path': model_path, 'fit_seconds': fit_seconds,
+            'ratings_per_second': len(ratings) * model.n_epochs / fit_seconds}
+
+
+def svd_pp(save_path, ratings_path=RATINGS_PATH):
+    """Train the original fixed configuration on all ratings and pickle it."""
+    ratings = load_ratings(ratings_path)
+    data_load = build_dataset(ratings)
     # Insatntiating surpricce
     method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
     # Loading a trainset into the model
     model = method.fit(data_load.build_full_trainset())
     print (f"Training completed. Saving model to: {save_path}")
+    with open(save_path, 'wb') as model_file:
+        pickle.dump(model, model_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[2].strip())
+    parser.add_argument('--ratings', default=RATINGS_PATH, help='ratings .csv file')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='directory of SVD.pkl and runs/')
+    parser.add_argument('--trainer', choices=sorted(PARAM_GRIDS), default='surprise')
+    parser.add_argument('--run-id', default=None, help='resume the run with this id')
+    parser.add_argument('--grid', default=None, help='JSON hyperparameter grid')
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run_id = args.run_id or time.strftime('%Y%m%d-%H%M%S')
+    run_dir = os.path.join(args.output_dir, 'runs', run_id)
+    grid = json.loads(args.grid) if args.grid else PARAM_GRIDS[args.trainer]
+    ratings = load_ratings(args.ratings)
+
+    start = time.perf_counter()
+    try:
+        results = cross_validate_grid(ratings, grid, run_dir, args.folds, args.jobs, args.seed,
+                                      args.trainer)
+    except ValueError as error:
+        sys.exit(str(error))
+    summary = summarise(results)
+    best = summary[0]
+    print(f"Best configuration {best['config']}: rmse {best['rmse']:.4f} +/- {best['rmse_std']:.4f}")
+    final = train_final(ratings, best['config'], run_dir, args.output_dir, args.seed, args.trainer)
+    metrics = {'run_id': run_id, 'trainer': args.trainer, 'ratings': os.path.abspath(args.ratings),
+               'n_ratings': len(ratings), 'folds': args.folds, 'seed': args.seed, 'grid': grid,
+               'best': best, 'final_fit_seconds': final['fit_seconds'],
+               'ratings_per_second': final['ratings_per_second'], 'model_path': final['model_path'],
+               'wall_seconds': time.perf_counter() - start, 'results': summary}
+    with open(os.path.join(run_dir, 'metrics.json'), 'w') as metrics_file:
+        json.dump(metrics, metrics_file, indent=2)
 
-    return pickle.dump(model, open(save_path,'wb'))
 
 if __name__ == '__main__':
-    svd_pp('SVD.pkl')
+    main()
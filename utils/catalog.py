@@ -0,0 +1,121 @@
+"""
+
+    Shared lookup index over the movie catalogue and its ratings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Replaces the per-call boolean scans of `movies_df` and
+    `ratings_df` (e.g. `movies_df[movies_df['movieId'] == idx]`) with
+    hash and offset lookups that are built once per process.
+
+"""
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import load_movies
+from utils.rating_store import RatingStore, rating_store
+from utils.startup import lazy_singleton
+
+
+class CatalogIndex:
+    """O(1) title <-> movieId <-> row lookups and per-movie rating slices.
+
+    Rows refer to positions within the movies Dataframe the index was built
+    from. When a title occurs more than once, its first occurrence wins.
+    Ratings are kept in a `RatingStore`, grouped by movie (keeping file
+    order within a movie) with CSR-style offsets, so the ratings of a
+    movie are a contiguous slice.
+
+    Parameters
+    ----------
+    movies_df : Pandas Dataframe
+        Movies with `movieId` and `title` columns.
+    ratings_df : Pandas Dataframe, optional
+        Ratings with `userId`, `movieId` and `rating` columns.
+    store : RatingStore, optional
+        Ratings already grouped by movie; used instead of `ratings_df`.
+
+    """
+
+    def __init__(self, movies_df, ratings_df=None, store=None):
+        self.movie_ids = movies_df['movieId'].to_numpy()
+        self.titles = movies_df['title'].to_numpy()
+        self.title_to_id = {}
+        self.id_to_title = {}
+        self.id_to_row = {}
+        for row, (movie_id, title) in enumerate(zip(self.movie_ids.tolist(), self.titles.tolist())):
+            self.title_to_id.setdefault(title, movie_id)
+            self.id_to_title.setdefault(movie_id, title)
+            self.id_to_row.setdefault(movie_id, row)
+        if store is None:
+            if ratings_df is None:
+                ratings_df = pd.DataFrame({'userId': [], 'movieId': [], 'rating': []})
+            store = RatingStore.from_frame(ratings_df)
+        self.ratings = store
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    # rating_offsets[m]:rating_offsets[m + 1] spans the ratings of movieId m
+    @property
+    def rating_offsets(self):
+        return self.ratings.movie_offsets
+
+    @property
+    def rating_users(self):
+        return self.ratings.movie_users
+
+    @property
+    def rating_values(self):
+        return self.ratings.movie_values
+
+    def add_ratings(self, user_ids, movie_ids, ratings):
+        """Insert new ratings into the per-movie (and per-user) slices.
+
+        New ratings go to the end of their movie's slice, as if they had
+        been appended to the ratings file.
+
+        Parameters
+        ----------
+        user_ids, movie_ids, ratings : np.ndarray
+            Parallel arrays describing the new ratings.
+
+        """
+        self.ratings.add_ratings(user_ids, movie_ids, ratings)
+
+    def movie_id(self, title):
+        """Return the movieId of a title, or None if it is unknown."""
+        return self.title_to_id.get(title)
+
+    def title(self, movie_id):
+        """Return the title of a movieId, or None if it is unknown."""
+        return self.id_to_title.get(movie_id)
+
+    def row(self, movie_id):
+        """Return the row of a movieId within the catalogue, or None."""
+        return self.id_to_row.get(movie_id)
+
+    def titles_for(self, movie_ids):
+        """Map movieIds to titles, skipping ids missing from the catalogue."""
+        titles = (self.id_to_title.get(movie_id) for movie_id in movie_ids)
+        return [title for title in titles if title is not None]
+
+    def ratings_for(self, movie_id):
+        """Return the (userIds, ratings) of a movie as array slices."""
+        return self.ratings.movie_ratings(movie_id)
+
+
+@lazy_singleton
+def load_catalog():
+    """Build the process-wide catalogue index once and reuse it afterwards.
+
+    Returns
+    -------
+    CatalogIndex
+        Index over the movies and the shared store of the configured
+        ratings.
+
+    """
+    movies_df = load_movies().dropna()
+    return CatalogIndex(movies_df, store=rating_store())
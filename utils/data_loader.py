@@ -4,11 +4,230 @@
 
     Author: Explore Data Science Academy.
 
+    Description: The movie and rating CSVs are parsed once and converted
+    into a binary columnar cache under `resources/cache`: one .npy file per
+    column with compact types (int32 ids, float32 ratings), memory-mapped on
+    load so that every worker process shares the same pages. A checksum of
+    the source file is stored alongside the columns and a stale cache is
+    rebuilt automatically.
+
 """
 # Data handling dependencies
+import functools
+import hashlib
+import json
+import os
+import shutil
+import tempfile
 import pandas as pd
 import numpy as np
 
+# Location of the movies file
+MOVIES_PATH = os.environ.get('EDSA_MOVIES_PATH', 'resources/data/movies.csv')
+# Location of the ratings file. Point EDSA_RATINGS_PATH at the full
+# MovieLens ratings to use it instead of the bundled sample.
+RATINGS_PATH = os.environ.get('EDSA_RATINGS_PATH', 'resources/data/ratings.csv')
+# Root directory of the binary column cache
+CACHE_DIR = os.environ.get('EDSA_CACHE_DIR', 'resources/cache')
+# Directory of the trained model artifacts (indexes, factors)
+MODELS_DIR = os.environ.get('EDSA_MODELS_DIR', 'resources/models')
+# Bump when the on-disk layout changes
+CACHE_FORMAT = 1
+
+# Column types of the supported source files
+MOVIE_DTYPES = {'movieId': np.int32, 'title': str, 'genres': str}
+RATING_DTYPES = {'userId': np.int32, 'movieId': np.int32, 'rating': np.float32,
+                 'timestamp': np.int64}
+
+
+def file_checksum(path, chunk_size=1 << 20):
+    """Return the SHA-1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_path(path_to_csv):
+    """Cache directory of a source file, unique per absolute path."""
+    source = os.path.abspath(path_to_csv)
+    key = hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(CACHE_DIR, f'{name}-{key}')
+
+
+def _read_meta(cache_path):
+    try:
+        with open(os.path.join(cache_path, 'meta.json')) as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(meta, path_to_csv):
+    """Check a cache's metadata against the current source file.
+
+    Size and modification time are compared first; if only the
+    modification time differs (e.g. the file was copied or touched) the
+    contents are re-hashed before the cache is declared stale.
+
+    """
+    if meta is None or meta.get('format') != CACHE_FORMAT:
+        return False
+    stat = os.stat(path_to_csv)
+    if stat.st_size != meta['size']:
+        return False
+    if stat.st_mtime_ns == meta['mtime_ns']:
+        return True
+    return file_checksum(path_to_csv) == meta['checksum']
+
+
+def _save_strings(directory, name, values):
+    """Store strings as one UTF-8 byte blob plus int64 offsets."""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    np.save(os.path.join(directory, f'{name}.bytes.npy'),
+            np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(directory, f'{name}.offsets.npy'), offsets)
+
+
+def _load_strings(directory, name):
+    blob = np.load(os.path.join(directory, f'{name}.bytes.npy'), mmap_mode='r').tobytes()
+    offsets = np.load(os.path.join(directory, f'{name}.offsets.npy')).tolist()
+    return [blob[start:stop].decode('utf-8') for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def _build_cache(path_to_csv, dtypes, cache_path):
+    """Parse a CSV once and write its columns to `cache_path` atomically."""
+    frame = pd.read_csv(path_to_csv, dtype={name: dtype for name, dtype in dtypes.items()
+                                            if dtype is not str})
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=CACHE_DIR, prefix='.build-')
+    os.chmod(staging, 0o755)
+    columns = {}
+    for name in frame.columns:
+        dtype = dtypes.get(name)
+        if dtype is str:
+            _save_strings(staging, name, frame[name].fillna('').astype(str).tolist())
+            columns[name] = 'str'
+        else:
+            values = frame[name].to_numpy(dtype=dtype)
+            np.save(os.path.join(staging, f'{name}.npy'), values)
+            columns[name] = values.dtype.str
+    stat = os.stat(path_to_csv)
+    meta = {'format': CACHE_FORMAT, 'source': os.path.abspath(path_to_csv),
+            'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'checksum': file_checksum(path_to_csv), 'rows': len(frame),
+            'columns': columns}
+    with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    # Swap the new cache in; if another process won the race keep theirs
+    if os.path.exists(cache_path):
+        stale = tempfile.mkdtemp(dir=CACHE_DIR, prefix='.stale-')
+        try:
+            os.replace(cache_path, os.path.join(stale, 'old'))
+        except OSError:
+            pass
+        shutil.rmtree(stale, ignore_errors=True)
+    try:
+        os.replace(staging, cache_path)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+    return _read_meta(cache_path)
+
+
+@functools.lru_cache(maxsize=None)
+def load_columns(path_to_csv, kind):
+    """Return the cached columns of a CSV file, building the cache if needed.
+
+    Parameters
+    ----------
+    path_to_csv : str
+        Relative or absolute path to a movies or ratings .csv file.
+    kind : str
+        Either 'movies' or 'ratings'; selects the column types.
+
+    Returns
+    -------
+    tuple (dict, str)
+        Mapping of column name to memory-mapped np.ndarray (or list of
+        str for text columns) and the checksum of the source file.
+
+    """
+    dtypes = MOVIE_DTYPES if kind == 'movies' else RATING_DTYPES
+    cache_path = _cache_path(path_to_csv)
+    meta = _read_meta(cache_path)
+    if not _is_fresh(meta, path_to_csv):
+        meta = _build_cache(path_to_csv, dtypes, cache_path)
+    columns = {}
+    for name, dtype in meta['columns'].items():
+        if dtype == 'str':
+            columns[name] = _load_strings(cache_path, name)
+        else:
+            columns[name] = np.load(os.path.join(cache_path, f'{name}.npy'), mmap_mode='r')
+    return columns, meta['checksum']
+
+
+# Running hash of the rating batches ingested in memory since the files
+# were loaded; None until the first batch
+_ingested_digest = None
+
+
+def bump_data_version(user_ids, movie_ids, ratings):
+    """Mark that ratings were added in memory (see `recommenders.incremental`).
+
+    The version then identifies the ingested rows themselves, so processes
+    that ingested different batches never share a version (nor their
+    cached results), while identical ingestion histories do.
+
+    Parameters
+    ----------
+    user_ids, movie_ids, ratings : np.ndarray
+        Parallel arrays describing the ingested ratings.
+
+    """
+    global _ingested_digest
+    digest = hashlib.sha1(b'' if _ingested_digest is None else _ingested_digest.encode('ascii'))
+    for values, dtype in ((user_ids, np.int64), (movie_ids, np.int64), (ratings, np.float64)):
+        digest.update(np.ascontiguousarray(values, dtype=dtype).tobytes())
+    _ingested_digest = digest.hexdigest()
+
+
+def data_version(path_to_movies=MOVIES_PATH, path_to_ratings=RATINGS_PATH):
+    """Short identifier of the current movies and ratings contents.
+
+    Ratings ingested in memory add a `+<hash>` suffix.
+
+    """
+    movies_checksum = load_columns(path_to_movies, 'movies')[1]
+    ratings_checksum = load_columns(path_to_ratings, 'ratings')[1]
+    version = hashlib.sha1((movies_checksum + ratings_checksum).encode('ascii')).hexdigest()[:12]
+    return f'{version}+{_ingested_digest[:12]}' if _ingested_digest else version
+
+
+def load_movies(path_to_movies=MOVIES_PATH):
+    """Load the movie catalogue from the binary cache.
+
+    Parameters
+    ----------
+    path_to_movies : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `movieId` (int32), `title` and `genres` columns.
+
+    """
+    columns, _ = load_columns(path_to_movies, 'movies')
+    movies = pd.DataFrame(columns, copy=False)
+    # Empty strings stand in for missing values within the cache
+    return movies.replace('', np.nan)
+
+
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
 
@@ -24,7 +243,28 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
+    df = load_movies(path_to_movies)
     df = df.dropna()
     movie_list = df['title'].to_list()
     return movie_list
+
+
+def load_ratings(path_to_ratings=RATINGS_PATH, columns=('userId', 'movieId', 'rating')):
+    """Load user ratings with compact column types from the binary cache.
+
+    Parameters
+    ----------
+    path_to_ratings : str
+        Relative or absolute path to the ratings stored in .csv format.
+    columns : tuple (str)
+        Columns to include; the timestamp is left out by default.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `userId` and `movieId` (int32), `rating` (float32) and optionally
+        `timestamp` (int64) columns backed by the memory-mapped cache.
+
+    """
+    cached, _ = load_columns(path_to_ratings, 'ratings')
+    return pd.DataFrame({name: cached[name] for name in columns}, copy=False)
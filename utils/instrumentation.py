@@ -0,0 +1,252 @@
+"""
+
+    Stage timers and counters for the recommender hot paths.
+
+    Author: Explore Data Science Academy.
+
+    Description: The recommenders wrap each stage of a query in
+    `stage(name)` and report quantities (candidate users, vectors scored,
+    cache hits) with `count(name, n)`. While instrumentation is disabled
+    both return immediately, so the hooks cost one flag check. Once
+    enabled, stage durations are aggregated into Prometheus-style
+    histograms and counters, and every query run under `trace(model)`
+    keeps a per-stage breakdown that the app can show for the last query.
+
+    Recording is a process-wide setting, controlled by EDSA_INSTRUMENT (or
+    `set_enabled`). A single thread, e.g. one Streamlit session, can
+    instead `set_capture(True)` to keep the breakdown of its own queries
+    without touching the shared metrics.
+
+    Configuration:
+        EDSA_INSTRUMENT          enable at startup (default off)
+        EDSA_METRICS_PORT        serve Prometheus text on :port/metrics
+        EDSA_INSTRUMENT_LOG      append every traced query as a JSON line
+
+"""
+# Dependencies
+import contextlib
+import http.server
+import json
+import os
+import threading
+import time
+
+# Enable instrumentation at startup
+ENABLED = os.environ.get('EDSA_INSTRUMENT', '') not in ('', '0')
+# Port of the Prometheus endpoint; unset means no endpoint
+METRICS_PORT = int(os.environ.get('EDSA_METRICS_PORT', '0'))
+# JSON-lines file receiving every traced query; unset means no log
+LOG_PATH = os.environ.get('EDSA_INSTRUMENT_LOG') or None
+# Upper bounds (seconds) of the stage duration histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_enabled = ENABLED
+_lock = threading.Lock()
+# stage name -> [bucket counts..., +Inf count, sum of seconds]
+_histograms = {}
+# counter name -> total
+_counters = {}
+_local = threading.local()
+_noop = contextlib.nullcontext()
+
+
+def enabled():
+    """Whether stages and counters are currently recorded."""
+    return _enabled
+
+
+def set_enabled(value):
+    """Turn recording on or off for the whole process."""
+    global _enabled
+    _enabled = bool(value)
+    if _enabled and METRICS_PORT:
+        metrics_server(METRICS_PORT)
+
+
+def set_capture(value):
+    """Trace the queries of the calling thread only (see `last_trace`).
+
+    Captured stages and counters go to the thread's traces but not to the
+    process-wide histograms, counters or log, which follow `enabled()`.
+
+    """
+    _local.capture = bool(value)
+
+
+def _recording():
+    return _enabled or getattr(_local, 'capture', False)
+
+
+def _observe(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for position, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[position] += 1
+        histogram[len(BUCKETS)] += 1
+        histogram[-1] += seconds
+
+
+class _Stage:
+    """Times one stage; see `stage`."""
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        if _enabled:
+            _observe(self.name, seconds)
+        current = getattr(_local, 'trace', None)
+        if current is not None:
+            current['stages'].append((self.name, seconds))
+        return False
+
+
+def stage(name):
+    """Context manager timing the enclosed block as stage `name`.
+
+    Returns a shared no-op context while instrumentation is disabled and
+    the thread does not capture its traces.
+
+    """
+    if not _recording():
+        return _noop
+    return _Stage(name)
+
+
+def count(name, value=1):
+    """Add `value` to counter `name` (and to the current query's trace)."""
+    if not _recording():
+        return
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        current['counters'][name] = current['counters'].get(name, 0) + value
+
+
+@contextlib.contextmanager
+def trace(model):
+    """Collect the stages and counters of one query.
+
+    The breakdown becomes `last_trace()` of the calling thread (i.e. of
+    the Streamlit session) and, while recording is enabled, is appended to
+    EDSA_INSTRUMENT_LOG.
+    Nested traces are folded into the outermost one.
+
+    """
+    if not _recording() or getattr(_local, 'trace', None) is not None:
+        yield
+        return
+    current = {'model': model, 'started': time.time(), 'stages': [], 'counters': {}}
+    _local.trace = current
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.trace = None
+        current['seconds'] = time.perf_counter() - start
+        _local.last = current
+        if _enabled:
+            _observe(f'{model}.total', current['seconds'])
+            if LOG_PATH is not None:
+                _append_log(current)
+
+
+def last_trace():
+    """Breakdown of the last query traced by this thread, or None.
+
+    Returns
+    -------
+    dict
+        `model`, total `seconds`, `stages` as (name, seconds) pairs in
+        completion order and `counters`.
+
+    """
+    return getattr(_local, 'last', None)
+
+
+def format_trace(current):
+    """Render a trace as an aligned text table."""
+    width = max([len(name) for name, _ in current['stages']] + [len('total')])
+    lines = [f"{name:<{width}} {seconds * 1000:9.2f} ms" for name, seconds in current['stages']]
+    lines.append(f"{'total':<{width}} {current['seconds'] * 1000:9.2f} ms")
+    lines += [f"{name:<{width}} {value:>12,}" for name, value in sorted(current['counters'].items())]
+    return '\n'.join(lines)
+
+
+def _append_log(current):
+    line = json.dumps(current) + '\n'
+    with _lock:
+        with open(LOG_PATH, 'a') as log_file:
+            log_file.write(line)
+
+
+def reset():
+    """Discard every recorded histogram and counter."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def prometheus_text():
+    """Render the histograms and counters in the Prometheus text format."""
+    with _lock:
+        histograms = {name: list(values) for name, values in _histograms.items()}
+        counters = dict(_counters)
+    lines = ['# HELP edsa_stage_seconds Time spent in each recommender stage.',
+             '# TYPE edsa_stage_seconds histogram']
+    for name, values in sorted(histograms.items()):
+        for bound, bucket in zip(BUCKETS, values):
+            lines.append(f'edsa_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {bucket}')
+        lines.append(f'edsa_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {values[len(BUCKETS)]}')
+        lines.append(f'edsa_stage_seconds_sum{{stage="{name}"}} {values[-1]}')
+        lines.append(f'edsa_stage_seconds_count{{stage="{name}"}} {values[len(BUCKETS)]}')
+    lines += ['# HELP edsa_events_total Items processed by the recommender stages.',
+              '# TYPE edsa_events_total counter']
+    for name, value in sorted(counters.items()):
+        lines.append(f'edsa_events_total{{name="{name}"}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_servers = {}
+
+
+def metrics_server(port=METRICS_PORT):
+    """Serve `prometheus_text()` on http://0.0.0.0:port/metrics (once per port)."""
+    with _lock:
+        if port not in _servers:
+            server = http.server.ThreadingHTTPServer(('', port), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _servers[port] = server
+        return _servers[port]
+
+
+if ENABLED and METRICS_PORT:
+    metrics_server(METRICS_PORT)
@@ -0,0 +1,215 @@
+"""
+
+    Precomputed per-movie rating statistics and popularity rankings.
+
+    Author: Explore Data Science Academy.
+
+    Description: Derives, once per data version, every movie's rating
+    count, mean, maximum, damped (Bayesian) mean and the users who gave
+    the maximum rating, plus the best-scored movies overall and per genre,
+    from the catalogue's per-movie rating slices. Everything is stored as
+    flat arrays indexed by movieId (CSR-style offsets for the variable
+    length lists) and saved next to the binary column cache, so later
+    processes load it instead of recomputing it.
+
+    The damped mean `(prior * global_mean + sum) / (prior + count)` pulls
+    movies with few ratings towards the global mean, so a single 5-star
+    rating no longer outranks hundreds of 4.5-star ones.
+
+"""
+# Data handling dependencies
+import os
+import tempfile
+import numpy as np
+
+from utils.catalog import load_catalog
+from utils.data_loader import CACHE_DIR, data_version, load_movies
+from utils.startup import lazy_singleton
+
+# Bump when the saved layout changes
+STATS_FORMAT = 1
+
+
+class PopularityStats:
+    """Per-movie rating statistics and popularity rankings.
+
+    Per-movie arrays (`counts`, `means`, `max_ratings`, `scores`) are
+    indexed by movieId; movies without ratings have a count of 0, a NaN
+    mean and maximum and a score of -inf.
+
+    Parameters
+    ----------
+    arrays : dict (str, np.ndarray)
+        The arrays built by `build` (or loaded from its saved file).
+
+    """
+
+    def __init__(self, arrays):
+        self.counts = arrays['counts']
+        self.means = arrays['means']
+        self.max_ratings = arrays['max_ratings']
+        self.scores = arrays['scores']
+        # max_offsets[m]:max_offsets[m + 1] spans the max-raters of movieId m
+        self.max_offsets = arrays['max_offsets']
+        self.max_users = arrays['max_users']
+        # rated catalogue movies, best damped mean first
+        self.ranked = arrays['ranked']
+        # genre_offsets[g]:genre_offsets[g + 1] spans genre g of `ranked_by_genre`
+        self.genres = arrays['genres'].tolist()
+        self.genre_offsets = arrays['genre_offsets']
+        self.ranked_by_genre = arrays['ranked_by_genre']
+        self.global_mean = float(arrays['global_mean'])
+        self.prior = float(arrays['prior'])
+        self._genre_of = {genre: position for position, genre in enumerate(self.genres)}
+
+    @classmethod
+    def build(cls, catalog, movies_df, prior=None):
+        """Compute the statistics from a catalogue index.
+
+        Parameters
+        ----------
+        catalog : CatalogIndex
+            Index holding the per-movie rating slices.
+        movies_df : Pandas Dataframe
+            Movies with `movieId` and `genres` columns.
+        prior : float, optional
+            Weight of the global mean in the damped mean, in ratings.
+            Defaults to the mean number of ratings of a rated movie.
+
+        Returns
+        -------
+        PopularityStats
+
+        """
+        offsets = catalog.rating_offsets
+        values = catalog.rating_values.astype(np.float64)
+        n_ids = len(offsets) - 1
+        counts = np.diff(offsets)
+        movie_of = np.repeat(np.arange(n_ids), counts)
+        sums = np.bincount(movie_of, weights=values, minlength=n_ids)
+        rated = counts > 0
+        global_mean = float(values.mean()) if len(values) else 0.0
+        if prior is None:
+            prior = float(counts[rated].mean()) if rated.any() else 0.0
+        means = np.full(n_ids, np.nan)
+        means[rated] = sums[rated] / counts[rated]
+        max_ratings = np.full(n_ids, np.nan)
+        if rated.any():
+            max_ratings[rated] = np.maximum.reduceat(values, offsets[:-1][rated])
+        scores = np.full(n_ids, -np.inf)
+        scores[rated] = (prior * global_mean + sums[rated]) / (prior + counts[rated])
+        # users who gave each movie its maximum rating, in file order
+        is_max = values == max_ratings[movie_of]
+        max_offsets = np.zeros(n_ids + 1, dtype=np.int64)
+        np.cumsum(np.bincount(movie_of[is_max], minlength=n_ids), out=max_offsets[1:])
+        max_users = catalog.rating_users[is_max]
+
+        # rankings over the rated movies of the catalogue; equal scores
+        # are ordered by movieId
+        movie_ids = movies_df['movieId'].to_numpy().astype(np.int64)
+        genres = movies_df['genres'].fillna('').to_numpy()
+        keep = np.zeros(len(movie_ids), dtype=bool)
+        keep[np.unique(movie_ids, return_index=True)[1]] = True
+        keep &= movie_ids < n_ids
+        keep[keep] = rated[movie_ids[keep]]
+        movie_ids, genres = movie_ids[keep], genres[keep]
+        order = np.lexsort((movie_ids, -scores[movie_ids]))
+        ranked = movie_ids[order]
+        members = {}
+        for movie_id, movie_genres in zip(ranked.tolist(), genres[order].tolist()):
+            for genre in movie_genres.split('|'):
+                if genre and genre != '(no genres listed)':
+                    members.setdefault(genre, []).append(movie_id)
+        genre_names = sorted(members)
+        genre_offsets = np.zeros(len(genre_names) + 1, dtype=np.int64)
+        np.cumsum([len(members[genre]) for genre in genre_names], out=genre_offsets[1:])
+        ranked_by_genre = np.array([movie_id for genre in genre_names for movie_id in members[genre]],
+                                   dtype=np.int64)
+        return cls({'counts': counts, 'means': means, 'max_ratings': max_ratings,
+                    'scores': scores, 'max_offsets': max_offsets, 'max_users': max_users,
+                    'ranked': ranked, 'genres': np.array(genre_names, dtype=str),
+                    'genre_offsets': genre_offsets, 'ranked_by_genre': ranked_by_genre,
+                    'global_mean': np.float64(global_mean), 'prior': np.float64(prior)})
+
+    def save(self, path):
+        """Write the arrays to an .npz file atomically."""
+        arrays = {'format': np.int64(STATS_FORMAT), 'counts': self.counts, 'means': self.means,
+                  'max_ratings': self.max_ratings, 'scores': self.scores,
+                  'max_offsets': self.max_offsets, 'max_users': self.max_users,
+                  'ranked': self.ranked, 'genres': np.array(self.genres, dtype=str),
+                  'genre_offsets': self.genre_offsets, 'ranked_by_genre': self.ranked_by_genre,
+                  'global_mean': np.float64(self.global_mean), 'prior': np.float64(self.prior)}
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        handle, staging = tempfile.mkstemp(dir=directory, prefix='.stats-', suffix='.npz')
+        with os.fdopen(handle, 'wb') as stats_file:
+            np.savez(stats_file, **arrays)
+        os.replace(staging, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load arrays written with `save`; None if missing or outdated."""
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                if int(archive['format']) != STATS_FORMAT:
+                    return None
+                return cls({name: archive[name] for name in archive.files})
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _known(self, movie_id):
+        return movie_id is not None and 0 <= movie_id < len(self.counts)
+
+    def count(self, movie_id):
+        """Number of ratings of a movie."""
+        return int(self.counts[movie_id]) if self._known(movie_id) else 0
+
+    def max_raters(self, movie_id):
+        """Users who gave a movie its highest rating, in file order."""
+        if not self._known(movie_id):
+            return self.max_users[:0]
+        return self.max_users[self.max_offsets[movie_id]:self.max_offsets[movie_id + 1]]
+
+    def top_movies(self, n=10, genre=None):
+        """The n movies with the best damped mean, optionally within a genre.
+
+        Returns
+        -------
+        list (int)
+            Movie ids, best first; empty for an unknown genre.
+
+        """
+        if genre is None:
+            return self.ranked[:n].tolist()
+        position = self._genre_of.get(genre)
+        if position is None:
+            return []
+        start = self.genre_offsets[position]
+        return self.ranked_by_genre[start:min(start + n, self.genre_offsets[position + 1])].tolist()
+
+
+def stats_path(version):
+    """Location of the saved statistics of a data version."""
+    return os.path.join(CACHE_DIR, f'popularity-{version}.npz')
+
+
+@lazy_singleton
+def popularity_stats():
+    """Load, or build and save, the statistics of the current data.
+
+    Statistics of ratings ingested in memory (see
+    `recommenders.incremental`) are rebuilt but never saved.
+
+    Returns
+    -------
+    PopularityStats
+
+    """
+    version = data_version()
+    path = stats_path(version)
+    stats = PopularityStats.load(path)
+    if stats is None:
+        stats = PopularityStats.build(load_catalog(), load_movies().dropna())
+        if '+' not in version:
+            stats.save(path)
+    return stats
@@ -0,0 +1,105 @@
+"""
+
+    Helper functions for ranking score vectors.
+
+    Author: Explore Data Science Academy.
+
+"""
+# Data handling dependencies
+import numpy as np
+
+def top_k_indices(scores, k):
+    """Select the positions of the k highest scores.
+
+    Equivalent to `heapq.nlargest(k, enumerate(scores), key=score)`, i.e.
+    results are ordered by descending score and ties are resolved in
+    favour of the lower position, but runs in O(n) using `argpartition`.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        One-dimensional array of scores. NaN values rank below all others.
+    k : int
+        Number of positions to return.
+
+    Returns
+    -------
+    np.ndarray
+        Positions of the k highest scores, best first.
+
+    """
+    scores = np.asarray(scores)
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+    k = min(int(k), scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.shape[0]:
+        # Find the k-th largest value, then keep everything strictly above it
+        # plus the lowest positions that tie with it.
+        kth_value = scores[np.argpartition(scores, -k)[-k]]
+        above = np.flatnonzero(scores > kth_value)
+        ties = np.flatnonzero(scores == kth_value)[:k - len(above)]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(scores.shape[0])
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def top_k_rows(scores, k, floor=None):
+    """Select the positions of the k highest scores of every row.
+
+    Row-wise equivalent of `top_k_indices` (same ordering and tie rules)
+    for a whole score matrix at once.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        Two-dimensional array of scores. NaN values rank below all others.
+    k : int
+        Number of positions to return per row.
+    floor : float, optional
+        Scores at or below `floor` are never selected; rows with fewer
+        than k higher scores are padded with -1. On sparse score rows
+        (e.g. similarities that are mostly zero) this also avoids ranking
+        the long runs of ties at the floor.
+
+    Returns
+    -------
+    np.ndarray
+        Array of shape (n_rows, min(k, n_columns)) holding the positions
+        of each row's k highest scores, best first.
+
+    """
+    scores = np.asarray(scores)
+    if np.isnan(scores).any():
+        scores = np.where(np.isnan(scores), -np.inf, scores)
+    n_rows, n_columns = scores.shape
+    k = max(min(int(k), n_columns), 0)
+    if k == 0 or n_rows == 0:
+        return np.empty((n_rows, k), dtype=np.intp)
+    if k < n_columns:
+        # Keep every score above the row's k-th largest value, plus the
+        # lowest positions tying with it, so that exactly k remain. Only
+        # the positions of the ties are ranked, never the whole row.
+        kth_values = np.partition(scores, n_columns - k, axis=1)[:, n_columns - k, None]
+        rows, columns = np.nonzero(scores > kth_values)
+        tie_rows, tie_columns = np.nonzero(scores == kth_values)
+        tie_rank = np.arange(len(tie_rows)) - np.searchsorted(tie_rows, np.arange(n_rows))[tie_rows]
+        needed = k - np.bincount(rows, minlength=n_rows)
+        keep = tie_rank < needed[tie_rows]
+        rows = np.concatenate([rows, tie_rows[keep]])
+        columns = np.concatenate([columns, tie_columns[keep]])
+    else:
+        rows, columns = np.divmod(np.arange(n_rows * n_columns), n_columns)
+    if floor is not None:
+        above_floor = scores[rows, columns] > floor
+        rows, columns = rows[above_floor], columns[above_floor]
+    order = np.lexsort((columns, -scores[rows, columns], rows))
+    rows, columns = rows[order], columns[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, np.arange(n_rows))[rows]
+    if floor is None:
+        return columns.reshape(n_rows, k)
+    top = np.full((n_rows, k), -1, dtype=np.intp)
+    top[rows, rank] = columns
+    return top
@@ -0,0 +1,233 @@
+"""
+
+    Compact rating store with per-user and per-movie offsets.
+
+    Author: Explore Data Science Academy.
+
+    Description: Holds every rating twice, grouped by user and grouped by
+    movie, as typed arrays (int32 ids, float16 ratings when the values
+    allow it) with CSR-style offsets indexed by id. The ratings of a user
+    or of a movie are then a contiguous slice, so "top-N movies of user u"
+    and "raters of movie m" cost O(degree) instead of a scan of the whole
+    table. Within a slice ratings keep their file order.
+
+    The store is built once per ratings file and saved as .npy files next
+    to the binary column cache; later processes memory-map it, so worker
+    processes share its pages.
+
+"""
+# Data handling dependencies
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from utils.data_loader import CACHE_DIR, RATINGS_PATH, load_columns
+from utils.startup import lazy_singleton
+
+# Bump when the on-disk layout changes
+STORE_FORMAT = 1
+# Arrays making up a store
+ARRAYS = ('user_offsets', 'user_movies', 'user_values',
+          'movie_offsets', 'movie_users', 'movie_values')
+
+
+def _rating_dtype(ratings):
+    """float16 if it holds every rating exactly (e.g. half stars), else float32."""
+    ratings = np.asarray(ratings, dtype=np.float32)
+    return np.float16 if np.array_equal(ratings.astype(np.float16), ratings) else np.float32
+
+
+def _group(keys, others, values, dtype):
+    """Group parallel arrays by key; returns (offsets, others, values)."""
+    keys = np.asarray(keys, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    max_key = int(keys.max()) if len(keys) else -1
+    # offsets[k]:offsets[k + 1] spans the entries of key k
+    offsets = np.searchsorted(keys[order], np.arange(max_key + 2))
+    return (offsets, np.asarray(others, dtype=np.int32)[order],
+            np.asarray(values)[order].astype(dtype))
+
+
+def _insert(offsets, others, values, keys, new_others, new_values):
+    """Append entries to the end of their key's slice."""
+    keys = np.asarray(keys, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    max_key = int(keys.max())
+    if max_key + 2 > len(offsets):
+        offsets = np.concatenate([offsets, np.full(max_key + 2 - len(offsets), offsets[-1])])
+    positions = offsets[keys[order] + 1]
+    others = np.insert(others, positions, np.asarray(new_others, dtype=others.dtype)[order])
+    values = np.insert(values, positions, np.asarray(new_values)[order].astype(values.dtype))
+    added = np.bincount(keys, minlength=len(offsets) - 1)
+    offsets = offsets + np.concatenate([[0], np.cumsum(added)])
+    return offsets, others, values
+
+
+class RatingStore:
+    """Ratings grouped by user and by movie.
+
+    Attributes
+    ----------
+    user_offsets : np.ndarray
+        `user_offsets[u]:user_offsets[u + 1]` spans user u's ratings
+        within `user_movies` / `user_values`.
+    movie_offsets : np.ndarray
+        `movie_offsets[m]:movie_offsets[m + 1]` spans movie m's ratings
+        within `movie_users` / `movie_values`.
+
+    """
+
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def from_ratings(cls, user_ids, movie_ids, ratings):
+        """Build a store from parallel rating arrays (in file order)."""
+        dtype = _rating_dtype(ratings)
+        user_offsets, user_movies, user_values = _group(user_ids, movie_ids, ratings, dtype)
+        movie_offsets, movie_users, movie_values = _group(movie_ids, user_ids, ratings, dtype)
+        return cls({'user_offsets': user_offsets, 'user_movies': user_movies,
+                    'user_values': user_values, 'movie_offsets': movie_offsets,
+                    'movie_users': movie_users, 'movie_values': movie_values})
+
+    @classmethod
+    def from_frame(cls, ratings_df):
+        """Build a store from a ratings Dataframe."""
+        return cls.from_ratings(ratings_df['userId'].to_numpy(), ratings_df['movieId'].to_numpy(),
+                                ratings_df['rating'].to_numpy())
+
+    def save(self, path):
+        """Write the arrays to directory `path`, replacing it atomically."""
+        parent = os.path.dirname(path) or '.'
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent, prefix='.store-')
+        os.chmod(staging, 0o755)
+        for name in ARRAYS:
+            np.save(os.path.join(staging, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+            json.dump({'format': STORE_FORMAT, 'ratings': len(self)}, meta_file)
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Memory-map a store written with `save`; None if missing or outdated."""
+        try:
+            with open(os.path.join(path, 'meta.json')) as meta_file:
+                if json.load(meta_file).get('format') != STORE_FORMAT:
+                    return None
+            return cls({name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                        for name in ARRAYS})
+        except (OSError, ValueError):
+            return None
+
+    def __len__(self):
+        return len(self.user_movies)
+
+    def __contains__(self, user_id):
+        return 0 <= user_id < len(self.user_offsets) - 1 and \
+            self.user_offsets[user_id + 1] > self.user_offsets[user_id]
+
+    @property
+    def nbytes(self):
+        """Memory taken by the arrays."""
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def user_ratings(self, user_id):
+        """Return the (movieIds, ratings) of a user as array slices."""
+        if user_id is None or not 0 <= user_id < len(self.user_offsets) - 1:
+            return self.user_movies[:0], self.user_values[:0]
+        start, stop = self.user_offsets[user_id], self.user_offsets[user_id + 1]
+        return self.user_movies[start:stop], self.user_values[start:stop]
+
+    def movie_ratings(self, movie_id):
+        """Return the (userIds, ratings) of a movie as array slices."""
+        if movie_id is None or not 0 <= movie_id < len(self.movie_offsets) - 1:
+            return self.movie_users[:0], self.movie_values[:0]
+        start, stop = self.movie_offsets[movie_id], self.movie_offsets[movie_id + 1]
+        return self.movie_users[start:stop], self.movie_values[start:stop]
+
+    def top_movies(self, user_id, n=20):
+        """A user's n highest-rated movie ids, best first.
+
+        Equal ratings are ordered exactly as
+        `sort_values(by='rating', ascending=False)` orders the user's
+        ratings in file order.
+
+        """
+        movies, values = self.user_ratings(user_id)
+        # the descending sort of pandas: argsort the reversed values
+        reversed_rows = np.arange(len(values) - 1, -1, -1)
+        best_first = reversed_rows[values[reversed_rows].astype(np.float32).argsort(kind='quicksort')][::-1]
+        return movies[best_first[:n]].tolist()
+
+    def ratings_of_users(self, user_ids):
+        """All ratings of the given users as (userIds, movieIds, ratings) arrays."""
+        user_ids = [user_id for user_id in user_ids if user_id in self]
+        if not user_ids:
+            return (np.empty(0, dtype=np.int32), self.user_movies[:0].copy(),
+                    self.user_values[:0].copy())
+        starts = self.user_offsets[user_ids]
+        counts = self.user_offsets[np.asarray(user_ids) + 1] - starts
+        # positions of every rating of every user, slice after slice
+        positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return (np.repeat(np.asarray(user_ids, dtype=np.int32), counts),
+                self.user_movies[positions], self.user_values[positions])
+
+    def triplets(self):
+        """Every rating as (userIds, movieIds, ratings) arrays, grouped by user."""
+        counts = np.diff(self.user_offsets)
+        return (np.repeat(np.arange(len(counts), dtype=np.int32), counts),
+                np.asarray(self.user_movies), np.asarray(self.user_values))
+
+    def add_ratings(self, user_ids, movie_ids, ratings):
+        """Insert new ratings as if they had been appended to the ratings file.
+
+        Parameters
+        ----------
+        user_ids, movie_ids, ratings : np.ndarray
+            Parallel arrays describing the new ratings.
+
+        """
+        if len(user_ids) == 0:
+            return
+        if np.dtype(_rating_dtype(ratings)).itemsize > self.user_values.dtype.itemsize:
+            # values float16 cannot hold exactly; widen the store
+            self.user_values = self.user_values.astype(np.float32)
+            self.movie_values = self.movie_values.astype(np.float32)
+        self.user_offsets, self.user_movies, self.user_values = _insert(
+            self.user_offsets, self.user_movies, self.user_values, user_ids, movie_ids, ratings)
+        self.movie_offsets, self.movie_users, self.movie_values = _insert(
+            self.movie_offsets, self.movie_users, self.movie_values, movie_ids, user_ids, ratings)
+
+
+def store_path(path_to_ratings=RATINGS_PATH):
+    """Location of the saved store of a ratings file (per file contents)."""
+    checksum = load_columns(path_to_ratings, 'ratings')[1]
+    return os.path.join(CACHE_DIR, f'rating-store-{checksum[:12]}')
+
+
+@lazy_singleton
+def rating_store():
+    """Memory-map, or build and save, the store of the configured ratings.
+
+    Returns
+    -------
+    RatingStore
+
+    """
+    path = store_path()
+    store = RatingStore.load(path)
+    if store is None:
+        columns, _ = load_columns(RATINGS_PATH, 'ratings')
+        store = RatingStore.from_ratings(columns['userId'], columns['movieId'], columns['rating'])
+        store.save(path)
+        store = RatingStore.load(path)
+    return store
@@ -0,0 +1,177 @@
+"""
+
+    Merging and re-ranking of per-seed candidate lists.
+
+    Author: Explore Data Science Academy.
+
+    Description: Each favourite movie (a "seed") yields a ranked list of
+    candidates: its nearest content neighbours, or the top-rated movies of
+    a similar user. `fuse` merges those lists on NumPy arrays - the seeds
+    themselves are excluded, duplicates are removed with a hash-based O(n)
+    pass and scores are aggregated by their maximum, sum or reciprocal
+    rank (RRF). `mmr` then optionally re-ranks the fused list for
+    diversity (maximal marginal relevance) against item vectors such as
+    the content features; `diversify` applies it to a recommended list of
+    movie ids, given a lookup of their vectors.
+
+    Configuration:
+        EDSA_DIVERSITY      MMR trade-off in [0, 1] (default 0, no re-ranking)
+
+"""
+# Data handling dependencies
+import logging
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+# Ways of aggregating the scores an item gets from several seeds
+AGGREGATIONS = ('max', 'sum', 'rrf')
+# Rank offset of reciprocal rank fusion, 1 / (RRF_K + rank)
+RRF_K = 60
+# Default weight of diversity against relevance in `mmr`
+DIVERSITY = float(os.environ.get('EDSA_DIVERSITY', '0'))
+# Fused candidates considered by `mmr`, per recommendation
+MMR_POOL_FACTOR = 3
+
+
+def fuse(items, scores=None, method='max', exclude=(), rrf_k=RRF_K):
+    """Merge ranked candidate lists into one duplicate-free ranking.
+
+    Parameters
+    ----------
+    items : np.ndarray
+        (n_lists, width) candidate ids, each row ranked best first; -1
+        marks an empty slot.
+    scores : np.ndarray, optional
+        Scores matching `items`; 1 for every candidate by default (so that
+        'sum' counts occurrences).
+    method : str
+        'max' keeps an item's best score, 'sum' adds its scores and 'rrf'
+        adds 1 / (rrf_k + rank) over the lists it appears in.
+    exclude : array-like
+        Ids never returned, e.g. the seeds.
+    rrf_k : int
+        Rank offset of reciprocal rank fusion.
+
+    Returns
+    -------
+    tuple (np.ndarray, np.ndarray)
+        Unique ids and their aggregated scores, best first. Equal scores
+        keep the order in which the items first appear (with 'max': in
+        which they first appear once all candidates are sorted by score).
+
+    """
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {method!r} (expected one of {AGGREGATIONS})")
+    items = np.atleast_2d(np.asarray(items))
+    if method == 'rrf':
+        values = np.broadcast_to(1.0 / (rrf_k + 1 + np.arange(items.shape[1])), items.shape)
+    elif scores is None:
+        values = np.ones(items.shape)
+    else:
+        values = np.asarray(scores, dtype=np.float64)
+    keep = items >= 0
+    if len(exclude):
+        keep &= ~np.isin(items, np.asarray(exclude))
+    items, values = items[keep], values[keep]
+    if method == 'max':
+        # rank every candidate first; an item's first occurrence is its best
+        order = np.argsort(-values, kind='stable')
+        items, values = items[order], values[order]
+    # hash-based dedupe: codes number the unique items in first-seen order
+    codes, unique = pd.factorize(items, sort=False)
+    if method == 'max':
+        first = np.full(len(unique), len(codes))
+        np.minimum.at(first, codes, np.arange(len(codes)))
+        return np.asarray(unique), values[first]
+    totals = np.bincount(codes, weights=values, minlength=len(unique))
+    order = np.argsort(-totals, kind='stable')
+    return np.asarray(unique)[order], totals[order]
+
+
+def mmr(relevance, vectors, top_n, diversity=DIVERSITY):
+    """Greedy maximal marginal relevance re-ranking.
+
+    Each step picks the candidate maximising
+    `(1 - diversity) * relevance - diversity * max_similarity`, where
+    relevance is rescaled to [0, 1] and `max_similarity` is the cosine
+    similarity to the closest candidate picked so far.
+
+    Parameters
+    ----------
+    relevance : np.ndarray
+        Scores of the candidates, best first.
+    vectors : scipy.sparse matrix or np.ndarray
+        One L2-normalised row per candidate; rows of unknown items may be
+        all zero.
+    top_n : int
+        Number of candidates to pick.
+    diversity : float
+        0 keeps the relevance order, 1 only maximises diversity.
+
+    Returns
+    -------
+    np.ndarray
+        Positions of the picked candidates, in pick order.
+
+    """
+    n = len(relevance)
+    top_n = min(int(top_n), n)
+    if diversity <= 0 or n <= 1:
+        return np.arange(top_n)
+    relevance = np.asarray(relevance, dtype=np.float64)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(n)
+    similarity = vectors @ vectors.T
+    similarity = similarity.toarray() if sp.issparse(similarity) else np.asarray(similarity)
+    closest = np.zeros(n)
+    available = np.ones(n, dtype=bool)
+    picked = np.empty(top_n, dtype=np.intp)
+    for step in range(top_n):
+        gain = np.where(available, (1 - diversity) * relevance - diversity * closest, -np.inf)
+        choice = int(np.argmax(gain))
+        picked[step] = choice
+        available[choice] = False
+        np.maximum(closest, similarity[choice], out=closest)
+    return picked
+
+
+def diversify(movie_ids, relevance, top_n, vectors_for, diversity=DIVERSITY):
+    """Re-rank recommended movie ids for diversity with MMR.
+
+    Parameters
+    ----------
+    movie_ids : list (int)
+        Candidate movie ids, best first.
+    relevance : np.ndarray
+        Score of every candidate.
+    top_n : int
+        Number of movie ids to return.
+    vectors_for : callable
+        Maps a list of movie ids to their L2-normalised vectors (see
+        `mmr`), e.g. `recommenders.content_index.content_vectors`. It may
+        raise FileNotFoundError while its vectors are not built.
+    diversity : float
+        Weight of diversity against relevance; 0 keeps the given order.
+
+    Returns
+    -------
+    list (int)
+        The top-n movie ids in MMR order; the relevance order while no
+        vectors are available.
+
+    """
+    if diversity <= 0:
+        return list(movie_ids[:top_n])
+    try:
+        vectors = vectors_for(movie_ids)
+    except FileNotFoundError as error:
+        logging.getLogger(__name__).warning("Not diversifying: %s", error)
+        return list(movie_ids[:top_n])
+    return np.asarray(movie_ids)[mmr(relevance, vectors, top_n, diversity)].tolist()
+
+
+def mmr_pool_size(top_n, diversity=DIVERSITY):
+    """Candidates to fuse so that `mmr` has room to diversify."""
+    return top_n * MMR_POOL_FACTOR if diversity > 0 else top_n
@@ -0,0 +1,192 @@
+"""
+
+    Recommendation result cache.
+
+    Author: Explore Data Science Academy.
+
+    Description: The app's favourite-movie choices come from small, fixed
+    slices of the catalogue, so the same queries are asked over and over.
+    Results are cached in a size-bounded, in-process LRU keyed on the
+    model, a model/data version, the (order-insensitive) favourite set and
+    `top_n`. Optionally the cache is backed by an SQLite file so that it
+    survives restarts and is shared between worker processes.
+
+    Configuration:
+        EDSA_RESULT_CACHE_SIZE  in-memory entries (default 1024, 0 disables)
+        EDSA_RESULT_CACHE_PATH  SQLite file for the persistent cache
+
+"""
+# Dependencies
+import collections
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.instrumentation import count, stage, trace
+from utils.startup import lazy_singleton
+
+# Number of entries kept in memory; 0 disables result caching
+CACHE_SIZE = int(os.environ.get('EDSA_RESULT_CACHE_SIZE', '1024'))
+# Optional SQLite file backing the cache
+CACHE_PATH = os.environ.get('EDSA_RESULT_CACHE_PATH') or None
+# Entries kept on disk before the least recently used are pruned
+DISK_CACHE_SIZE = int(os.environ.get('EDSA_RESULT_CACHE_DISK_SIZE', '100000'))
+
+
+def make_key(model, version, movie_list, top_n):
+    """Cache key of a query; the order of the favourites does not matter."""
+    return json.dumps([model, version, sorted(movie_list), int(top_n)])
+
+
+def file_version(path):
+    """Version tag of a model artifact: its modification time, if present."""
+    try:
+        return str(os.stat(path).st_mtime_ns)
+    except OSError:
+        return ''
+
+
+class ResultCache:
+    """Thread-safe LRU cache of recommendation lists.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of entries kept in memory.
+    path : str, optional
+        SQLite file used as a persistent, cross-process second level.
+    disk_maxsize : int
+        Number of entries kept in the SQLite file.
+
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, path=None, disk_maxsize=DISK_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._db = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                             '(key TEXT PRIMARY KEY, value TEXT, accessed REAL)')
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return a copy of the cached list for `key`, or None."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(self._entries[key])
+            if self._db is not None:
+                row = self._db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE results SET accessed = ? WHERE key = ?', (time.time(), key))
+                    self._db.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return list(value)
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """Store a recommendation list under `key`."""
+        value = list(value)
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                                 (key, json.dumps(value), time.time()))
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._prune_disk()
+                self._db.commit()
+
+    def clear(self):
+        """Drop every entry, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size."""
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self._entries)}
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_disk(self):
+        self._db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                         'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.disk_maxsize,))
+
+
+@lazy_singleton
+def result_cache():
+    """Process-wide result cache, or None when caching is disabled."""
+    if CACHE_SIZE <= 0:
+        return None
+    return ResultCache(CACHE_SIZE, CACHE_PATH)
+
+
+def cached_recommender(model, version):
+    """Cache the results of a `(movie_list, top_n)` recommender function.
+
+    The favourites are passed on in sorted order, so that the result does
+    not depend on the order in which they were chosen and the cache key
+    can ignore it.
+
+    Parameters
+    ----------
+    model : str or callable
+        Model name, or a function returning it (e.g. the selected
+        algorithm).
+    version : callable
+        Returns the current model/data version; results cached under an
+        older version are never returned.
+
+    """
+    def decorate(recommender):
+        @functools.wraps(recommender)
+        def wrapper(movie_list, top_n=10):
+            favourites = sorted(movie_list)
+            name = model() if callable(model) else model
+            with trace(name):
+                cache = result_cache()
+                if cache is None:
+                    return recommender(favourites, top_n)
+                with stage('result_cache.get'):
+                    key = make_key(name, version(), favourites, top_n)
+                    result = cache.get(key)
+                count('result_cache.hits' if result is not None else 'result_cache.misses')
+                if result is None:
+                    result = recommender(favourites, top_n)
+                    cache.put(key, result)
+                return result
+        wrapper.uncached = recommender
+        return wrapper
+    return decorate
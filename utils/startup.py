@@ -0,0 +1,133 @@
+"""
+
+    Lazy initialisation and startup profiling helpers.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommender state (data, matrices, indexes) is built on
+    first use behind process-wide singletons rather than at import time, so
+    the app only pays for the algorithm a user actually runs. Every
+    singleton records how long it took to build. Setting
+    EDSA_PROFILE_STARTUP=1 shows these timings within the app, and
+
+        python -m utils.startup
+
+    reports the standalone import time of each module and the
+    initialisation time of each recommender.
+
+"""
+# Dependencies
+import functools
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Show startup timings within the app when set
+PROFILE_STARTUP = os.environ.get('EDSA_PROFILE_STARTUP', '') not in ('', '0')
+
+# Modules whose import cost is reported by the command line profiler
+PROFILED_MODULES = [
+    'numpy', 'pandas', 'scipy.sparse', 'sklearn.feature_extraction.text', 'surprise',
+    'utils.data_loader', 'utils.catalog',
+    'recommenders.content_based', 'recommenders.collaborative_based',
+]
+
+_timings = []
+_timings_lock = threading.Lock()
+
+
+def record_timing(kind, name, seconds):
+    """Record a startup event, e.g. ('init', 'content_state', 1.2)."""
+    with _timings_lock:
+        _timings.append((kind, name, seconds))
+
+
+def startup_timings():
+    """Return the recorded (kind, name, seconds) events in order."""
+    with _timings_lock:
+        return list(_timings)
+
+
+def format_timings(timings):
+    """Render (kind, name, seconds) rows as an aligned text table."""
+    width = max([len(name) for _, name, _ in timings] + [6])
+    lines = [f"{'kind':<7} {'name':<{width}} {'seconds':>8}"]
+    for kind, name, seconds in timings:
+        lines.append(f"{kind:<7} {name:<{width}} {seconds:>8.3f}")
+    return '\n'.join(lines)
+
+
+def lazy_singleton(build):
+    """Turn a zero-argument builder into a thread-safe, build-once accessor.
+
+    The first call runs `build` and records its duration; later calls
+    return the same object. `accessor.is_loaded()` tells whether the
+    object exists yet and `accessor.reset()` discards it so that the next
+    call rebuilds it.
+
+    """
+    lock = threading.Lock()
+    holder = []
+
+    @functools.wraps(build)
+    def accessor():
+        if not holder:
+            with lock:
+                if not holder:
+                    start = time.perf_counter()
+                    holder.append(build())
+                    record_timing('init', build.__name__, time.perf_counter() - start)
+        return holder[0]
+
+    def reset():
+        with lock:
+            holder.clear()
+
+    accessor.is_loaded = lambda: bool(holder)
+    accessor.reset = reset
+    return accessor
+
+
+def profile_imports(modules=PROFILED_MODULES):
+    """Measure the standalone import time of each module.
+
+    Every module is imported in a fresh interpreter so that its cost
+    includes all of its own dependencies and does not depend on what was
+    imported before it.
+
+    Parameters
+    ----------
+    modules : list (str)
+        Dotted module names.
+
+    Returns
+    -------
+    list (tuple)
+        ('import', module, seconds) rows; seconds is NaN if the import
+        failed.
+
+    """
+    probe = ('import importlib, sys, time; start = time.perf_counter(); '
+             'importlib.import_module(sys.argv[1]); print(time.perf_counter() - start)')
+    rows = []
+    for module in modules:
+        result = subprocess.run([sys.executable, '-c', probe, module],
+                                capture_output=True, text=True)
+        seconds = float(result.stdout.strip()) if result.returncode == 0 else float('nan')
+        rows.append(('import', module, seconds))
+    return rows
+
+
+if __name__ == '__main__':
+    # Singletons record into the importable module, not into __main__
+    from utils import startup
+    from recommenders.collaborative_based import collab_state
+    from recommenders.content_index import content_state
+
+    rows = profile_imports()
+    content_state()
+    collab_state()
+    rows += startup.startup_timings()
+    print(format_timings(rows))